@@ -0,0 +1,237 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.utils.dataIO import DataIO  # noqa: E402
+
+#
+# Measures what loading and saving data files costs with cogs/utils/dataIO.
+#
+# Usage:
+#   python benchmarks/bench_dataio.py
+#   python benchmarks/bench_dataio.py --sizes 1KB 10MB --shapes bank
+#   python benchmarks/bench_dataio.py --storage sqlite --output after.json \
+#       --compare before.json
+#
+# Every run happens in a temporary folder, the data folder is untouched.
+#
+
+SIZES = ("1KB", "100KB", "1MB", "10MB", "100MB")
+DEFAULT_SIZES = ("1KB", "100KB", "1MB", "10MB")
+SHAPES = ("bank", "modlog", "nicknames")
+OPS = ("save", "load", "load_cached", "is_valid_json", "fileio")
+UNITS = {"KB": 2**10, "MB": 2**20}
+
+
+def parse_size(size):
+    return int(float(size[:-2]) * UNITS[size[-2:].upper()])
+
+
+def snowflake(rnd):
+    return str(rnd.randint(10**16, 10**18))
+
+
+def bank_account(rnd, n):
+    return {"name": "user{}".format(n),
+            "balance": rnd.randint(0, 10**6),
+            "created_at": "2017-0{}-1{} 12:34:56".format(rnd.randint(1, 9),
+                                                          rnd.randint(0, 9))}
+
+
+def modlog_case(rnd, n):
+    return {"case": n,
+            "created": 1500000000.0 + n,
+            "modified": None,
+            "action": rnd.choice(("Ban", "Kick", "Softban", "Mute")),
+            "channel": snowflake(rnd),
+            "user": "user#{:04}".format(n % 10000),
+            "user_id": snowflake(rnd),
+            "reason": "Spamming in #general" if n % 3 else None,
+            "moderator": "mod#0001",
+            "moderator_id": snowflake(rnd),
+            "amended_by": None,
+            "amended_id": None,
+            "message": snowflake(rnd),
+            "until": None}
+
+
+def nickname_history(rnd, n):
+    return ["nick{}-{}".format(n, i) for i in range(rnd.randint(1, 20))]
+
+
+MAKERS = {"bank": bank_account,
+          "modlog": modlog_case,
+          "nicknames": nickname_history}
+
+
+def make_document(shape, size, seed=0):
+    """Builds a document shaped like the cog's data of about size bytes
+
+    Entries are spread over servers of 50 to 500 entries each, keyed by
+    server id and then user id (or case number for modlog)"""
+    rnd = random.Random(seed)
+    maker = MAKERS[shape]
+    sample = len(json.dumps({snowflake(rnd): maker(rnd, 0)}, indent=4))
+    entries = max(1, size // sample)
+    doc = {}
+    n = 0
+    while n < entries:
+        server = doc.setdefault(snowflake(rnd), {})
+        for _ in range(min(rnd.randint(50, 500), entries - n)):
+            n += 1
+            key = str(n) if shape == "modlog" else snowflake(rnd)
+            server[key] = maker(rnd, n)
+    return doc
+
+
+def make_dataio(args):
+    io = DataIO()
+    io.fsync = args.fsync
+    if args.storage == "sqlite":
+        from cogs.utils.sqlite_engine import SQLiteEngine
+        io.use_engine(SQLiteEngine("data/bench.sqlite3"))
+    return io
+
+
+def run_op(io, op, filename, data):
+    if op == "save":
+        io.save_json(filename, data)
+    elif op == "load":
+        io.read_cache.clear()
+        io.load_json(filename)
+    elif op == "load_cached":
+        io.load_json(filename)
+    elif op == "is_valid_json":
+        io.is_valid_json(filename)
+    elif op == "fileio":
+        io._legacy_fileio(filename, "save", data)
+        io.read_cache.clear()
+        io._legacy_fileio(filename, "load")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def bench(io, op, filename, data, nbytes, repeat, max_time):
+    run_op(io, op, filename, data)  # Warm up, creates the file
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < repeat:
+        t = time.perf_counter()
+        run_op(io, op, filename, data)
+        timings.append(time.perf_counter() - t)
+        if time.perf_counter() - started > max_time and len(timings) >= 3:
+            break
+
+    tracemalloc.start()
+    run_op(io, op, filename, data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = sum(timings)
+    return {"runs": len(timings),
+            "ops_per_s": len(timings) / total,
+            "mb_per_s": nbytes * len(timings) / total / 2**20,
+            "p50_ms": percentile(timings, 50) * 1000,
+            "p90_ms": percentile(timings, 90) * 1000,
+            "p99_ms": percentile(timings, 99) * 1000,
+            "peak_mb": peak / 2**20}
+
+
+def compare(results, baseline):
+    print("\nCompared to {}".format(baseline["mode"]))
+    print("{:<10} {:>6} {:<14} {:>10} {:>10} {:>8}"
+          "".format("shape", "size", "op", "p50 before", "p50 after",
+                    "speedup"))
+    old = {(r["shape"], r["size"], r["op"]): r for r in baseline["results"]}
+    for r in results:
+        before = old.get((r["shape"], r["size"], r["op"]))
+        if before is None:
+            continue
+        print("{:<10} {:>6} {:<14} {:>10.2f} {:>10.2f} {:>7.2f}x"
+              "".format(r["shape"], r["size"], r["op"], before["p50_ms"],
+                        r["p50_ms"], before["p50_ms"] / r["p50_ms"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks Red's dataIO")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES,
+                        help="Document sizes, e.g. 1KB 10MB (default: {})"
+                             "".format(" ".join(DEFAULT_SIZES)))
+    parser.add_argument("--shapes", nargs="+", choices=SHAPES, default=SHAPES)
+    parser.add_argument("--ops", nargs="+", choices=OPS, default=OPS)
+    parser.add_argument("--storage", choices=("json", "sqlite"),
+                        default="json")
+    parser.add_argument("--fsync", choices=DataIO.FSYNC_POLICIES,
+                        default="none")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="Runs per case (default: 20)")
+    parser.add_argument("--max-time", type=float, default=10,
+                        help="Seconds after which a case stops repeating, "
+                             "as long as it ran 3 times (default: 10)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Saves the results as json")
+    parser.add_argument("--compare", metavar="RESULTS",
+                        help="Results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    mode = "storage={} fsync={}".format(args.storage, args.fsync)
+    print("dataIO benchmark, {} (python {})"
+          "".format(mode, sys.version.split()[0]))
+    print("{:<10} {:>6} {:<14} {:>5} {:>9} {:>9} {:>9} {:>9} {:>9} {:>8}"
+          "".format("shape", "size", "op", "runs", "ops/s", "MB/s",
+                    "p50 ms", "p90 ms", "p99 ms", "peak MB"))
+
+    results = []
+    cwd = os.getcwd()
+    folder = tempfile.mkdtemp(prefix="red-bench-")
+    try:
+        os.chdir(folder)
+        os.makedirs("data/bench")
+        io = make_dataio(args)
+        for shape in args.shapes:
+            for size in args.sizes:
+                data = make_document(shape, parse_size(size), args.seed)
+                nbytes = len(io._encode_json(data))
+                filename = "data/bench/{}-{}.json".format(shape, size)
+                for op in args.ops:
+                    r = bench(io, op, filename, data, nbytes, args.repeat,
+                              args.max_time)
+                    r.update(shape=shape, size=size, op=op, bytes=nbytes)
+                    results.append(r)
+                    print("{shape:<10} {size:>6} {op:<14} {runs:>5} "
+                          "{ops_per_s:>9.1f} {mb_per_s:>9.1f} {p50_ms:>9.2f} "
+                          "{p90_ms:>9.2f} {p99_ms:>9.2f} {peak_mb:>8.1f}"
+                          "".format(**r))
+                io.delete(filename)
+        if io.engine is not None:
+            io.engine.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(folder, ignore_errors=True)
+
+    report = {"mode": mode, "python": sys.version.split()[0],
+              "results": results}
+    if args.output:
+        with open(args.output, encoding="utf-8", mode="w") as f:
+            json.dump(report, f, indent=4)
+    if args.compare:
+        with open(args.compare, encoding="utf-8", mode="r") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
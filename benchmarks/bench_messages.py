@@ -0,0 +1,340 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "lib"))  # Where the launcher installs
+
+from cogs.utils.eventloop import LOOPS, use_loop  # noqa: E402
+
+#
+# Measures how many messages Red handles per second, and how long each
+# takes, on every event loop implementation.
+#
+# Usage:
+#   python benchmarks/bench_messages.py
+#   python benchmarks/bench_messages.py --loops asyncio uvloop \
+#       --messages 50000 --concurrency 200 --output results.json
+#   # Arguments after -- are passed to Red, e.g. to compare its options
+#   python benchmarks/bench_messages.py -- --coalesce-window 50
+#
+# Every loop is benchmarked in its own process. Red runs on a fake
+# client: servers, members and messages are built from gateway payloads
+# and the HTTP requests are answered locally after --api-latency ms, so
+# no token is needed. Messages go through Bot.on_message (pipeline,
+# user_allowed, process_commands and the command itself) while the cogs'
+# on_message listeners run alongside. Everything happens in a temporary
+# folder, the data folder is untouched.
+#
+
+COGS = ("owner", "general", "mod", "alias", "customcom", "trivia")
+BOT_ID = "100000000000000001"
+OWNER_ID = "100000000000000002"
+FILTERED = "bannedword"
+
+CHATTER = ("hello there", "anyone up for a game tonight?", "lol",
+           "that's not how it works", "brb", "did you see the stream",
+           "can someone help me with my setup", "gg", "same",
+           "this is a " + FILTERED + " message")
+COMMANDS = ("!choose pizza pasta salad", "!roll 1000", "!8 is this fast?",
+            "!flip", "!ping", "!lmgtfy event loops")
+UNKNOWN = ("!notacommand", "!hi", "!wiki red")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+class IdMaker:
+
+    def __init__(self, start=200000000000000000):
+        self.n = start
+
+    def __call__(self):
+        self.n += 1
+        return str(self.n)
+
+
+def user_payload(user_id, name=None, bot=False):
+    return {"id": user_id, "username": name or "user" + user_id[-6:],
+            "discriminator": user_id[-4:], "avatar": None, "bot": bot}
+
+
+def guild_payload(new_id, members):
+    """A server with a few channels and roles, shaped like GUILD_CREATE"""
+    guild_id = new_id()
+    admin, mod = new_id(), new_id()
+    roles = [{"id": guild_id, "name": "@everyone", "permissions": 104324161,
+              "position": 0},
+             {"id": mod, "name": "Process", "permissions": 104324161,
+              "position": 1},
+             {"id": admin, "name": "Transistor", "permissions": 8,
+              "position": 2}]
+    # The first channel shares the server's id, it's the default one
+    channels = [{"id": guild_id if i == 0 else new_id(), "type": 0,
+                 "name": "channel{}".format(i), "position": i,
+                 "permission_overwrites": []} for i in range(5)]
+    member_ids = [BOT_ID, OWNER_ID] + [new_id() for _ in range(members)]
+    return {"id": guild_id, "name": "server" + guild_id[-4:],
+            "owner_id": OWNER_ID, "region": "us-east",
+            "verification_level": 0, "member_count": len(member_ids),
+            "large": False, "roles": roles, "channels": channels,
+            "members": [{"user": user_payload(uid, bot=uid == BOT_ID),
+                         "roles": [admin] if uid == OWNER_ID else
+                                  ([mod] if i % 20 == 0 else []),
+                         "joined_at": "2017-01-01T00:00:00+00:00",
+                         "deaf": False, "mute": False}
+                        for i, uid in enumerate(member_ids)]}
+
+
+def message_payload(message_id, channel_id, author, content):
+    return {"id": message_id, "channel_id": channel_id, "author": author,
+            "content": content, "timestamp": "2017-06-01T12:00:00+00:00",
+            "edited_timestamp": None, "tts": False,
+            "mention_everyone": False, "mentions": [], "mention_roles": [],
+            "attachments": [], "embeds": [], "pinned": False, "type": 0,
+            "reactions": []}
+
+
+class FakeHTTP:
+    """Answers the requests of discord.py's HTTP client after a delay"""
+
+    def __init__(self, new_id, latency):
+        self.new_id = new_id
+        self.latency = latency
+        self.calls = Counter()
+
+    async def request(self, route, **kwargs):
+        self.calls["{} {}".format(route.method, route.path)] += 1
+        await asyncio.sleep(self.latency)
+        if route.method == "POST" and route.path.endswith("/messages"):
+            content = kwargs.get("json", {}).get("content")
+            return message_payload(self.new_id(), route.channel_id,
+                                   user_payload(BOT_ID, "Red", bot=True),
+                                   content)
+        return {}
+
+
+def make_messages(servers, count, mix, seed):
+    """(channel, author id, content) of the messages sent to Red"""
+    rnd = random.Random(seed)
+    kinds = ("chatter", "command", "unknown")
+    texts = {"chatter": CHATTER, "command": COMMANDS, "unknown": UNKNOWN}
+    messages = []
+    for _ in range(count):
+        server = rnd.choice(servers)
+        channel = rnd.choice(list(server.channels))
+        author = rnd.choice(list(server.members))
+        kind = rnd.choices(kinds, mix)[0] if hasattr(rnd, "choices") else \
+            _weighted(rnd, kinds, mix)
+        messages.append((channel, author, rnd.choice(texts[kind])))
+    return messages
+
+
+def _weighted(rnd, items, weights):  # random.choices is Python 3.6+
+    x = rnd.uniform(0, sum(weights))
+    for item, weight in zip(items, weights):
+        x -= weight
+        if x <= 0:
+            return item
+    return items[-1]
+
+
+async def drive(bot, messages, concurrency, new_id):
+    """Hands messages to Red from concurrency senders at once, returns
+    the time each took and the total time until Red was done"""
+    connection = bot.connection
+    listeners = bot.extra_events.get("on_message", ())
+    pending = iter(messages)
+    latencies = []
+
+    async def sender():
+        for channel, author, content in pending:
+            data = message_payload(new_id(), channel.id,
+                                   user_payload(author.id, author.name),
+                                   content)
+            # What the gateway's MESSAGE_CREATE does, minus the dispatch
+            message = connection._create_message(channel=channel, **data)
+            connection.messages.append(message)
+            for listener in listeners:
+                asyncio.ensure_future(listener(message))
+            started = time.perf_counter()
+            await bot.on_message(message)
+            latencies.append(time.perf_counter() - started)
+
+    all_tasks = getattr(asyncio, "all_tasks", None) or asyncio.Task.all_tasks
+    started = time.perf_counter()
+    await asyncio.gather(*[sender() for _ in range(concurrency)])
+    # Replies, listeners and coalesced messages still running
+    current = asyncio.Task.current_task() if not hasattr(
+        asyncio, "current_task") else asyncio.current_task()
+    others = [t for t in all_tasks() if t is not current and not t.done()]
+    if others:
+        await asyncio.wait(others, timeout=30)
+    return latencies, time.perf_counter() - started
+
+
+def run_child(args):
+    """Benchmarks Red on one loop, in this process"""
+    folder = tempfile.mkdtemp(prefix="red-bench-")
+    os.chdir(folder)
+    os.makedirs("data/red")
+    sys.argv = ["red.py", "--no-prompt", "--prefix", "!",
+                "--owner", OWNER_ID, "--stall-threshold", "0",
+                "--loop", args.child] + args.red_args
+    bot = None
+    try:
+        loop = use_loop(args.child)
+        import red
+        import __main__
+        __main__.set_cog = red.set_cog  # Imported by the owner cog
+        bot = red.initialize(loop=loop)
+        for cog in args.cogs:
+            bot.load_extension("cogs." + cog)
+
+        new_id = IdMaker()
+        fake = FakeHTTP(new_id, args.api_latency / 1000)
+        bot.http.request = bot.scheduler.wrap(fake.request)
+        bot.user = red.discord.User(
+            **user_payload(BOT_ID, "Red", bot=True))
+        servers = [bot.connection._add_server_from_data(
+                   guild_payload(new_id, args.members))
+                   for _ in range(args.servers)]
+        mod = bot.get_cog("Mod")
+        if mod is not None:
+            for server in servers:
+                mod.filter[server.id] = [FILTERED]
+
+        messages = make_messages(servers, args.messages + args.warmup,
+                                 args.mix, args.seed)
+        loop.run_until_complete(drive(bot, messages[:args.warmup],
+                                      args.concurrency, new_id))
+        fake.calls.clear()
+        latencies, elapsed = loop.run_until_complete(
+            drive(bot, messages[args.warmup:], args.concurrency, new_id))
+        result = {"loop": args.child,
+                  "messages": len(latencies),
+                  "msgs_per_s": len(latencies) / elapsed,
+                  "p50_ms": percentile(latencies, 50) * 1000,
+                  "p90_ms": percentile(latencies, 90) * 1000,
+                  "p99_ms": percentile(latencies, 99) * 1000,
+                  "max_ms": max(latencies) * 1000,
+                  "api_calls": sum(fake.calls.values()),
+                  "api_routes": dict(fake.calls)}
+    finally:
+        if bot is not None:
+            for cog in args.cogs:  # Their __unload close their sessions
+                bot.unload_extension("cogs." + cog)
+            bot.http.session.close()
+        os.chdir(ROOT)
+        shutil.rmtree(folder, ignore_errors=True)
+    print(json.dumps(result))
+
+
+def run_loop(name, args, argv):
+    """Benchmarks Red on the loop name in a new process"""
+    p = subprocess.run([sys.executable, os.path.abspath(__file__),
+                        "--child", name] + argv,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if p.returncode != 0:
+        # Tracebacks end with the exception, Red prints some of its errors
+        # (like discord.py missing) on stdout and starts with them
+        error = p.stderr.decode("utf-8", "replace").strip().splitlines()
+        output = p.stdout.decode("utf-8", "replace").strip().splitlines()
+        error = error[-1:] or output[:1] or ["exit code {}"
+                                             "".format(p.returncode)]
+        return {"loop": name, "error": error[0]}
+    return json.loads(p.stdout.decode("utf-8").strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks Red's message handling on every event loop")
+    parser.add_argument("--loops", nargs="+", choices=LOOPS, default=LOOPS)
+    parser.add_argument("--messages", type=int, default=20000,
+                        help="Messages measured per loop (default: 20000)")
+    parser.add_argument("--warmup", type=int, default=2000,
+                        help="Messages sent before measuring (default: "
+                             "2000)")
+    parser.add_argument("--concurrency", type=int, default=100,
+                        help="Messages being handled at once (default: "
+                             "100)")
+    parser.add_argument("--servers", type=int, default=50)
+    parser.add_argument("--members", type=int, default=200,
+                        help="Members per server (default: 200)")
+    parser.add_argument("--mix", type=float, nargs=3, default=(80, 15, 5),
+                        metavar=("CHATTER", "COMMANDS", "UNKNOWN"),
+                        help="Share of plain messages, commands and "
+                             "unknown commands (default: 80 15 5)")
+    parser.add_argument("--api-latency", type=float, default=20,
+                        help="Milliseconds the fake API takes to answer "
+                             "(default: 20)")
+    parser.add_argument("--cogs", nargs="+", default=COGS,
+                        help="Cogs loaded (default: {})"
+                             "".format(" ".join(COGS)))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Saves the results as json")
+    parser.add_argument("--child", choices=LOOPS, help=argparse.SUPPRESS)
+    parser.add_argument("red_args", nargs="*", metavar="-- RED ARGS",
+                        help="Passed to Red")
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    argv = sys.argv[1:]
+    if "--loops" in argv:  # The children get their loop from --child
+        i = argv.index("--loops")
+        del argv[i:i + 1 + len(args.loops)]
+
+    print("Message handling benchmark, {} messages from {} senders, "
+          "{:.0f}ms API latency (python {})"
+          "".format(args.messages, args.concurrency, args.api_latency,
+                    sys.version.split()[0]))
+    print("{:<8} {:>9} {:>9} {:>9} {:>9} {:>9} {:>10}"
+          "".format("loop", "msgs/s", "p50 ms", "p90 ms", "p99 ms",
+                    "max ms", "API calls"))
+    results = []
+    for name in args.loops:
+        r = run_loop(name, args, argv)
+        results.append(r)
+        if "error" in r:
+            print("{:<8} failed: {}".format(name, r["error"]))
+        else:
+            print("{loop:<8} {msgs_per_s:>9.0f} {p50_ms:>9.2f} {p90_ms:>9.2f} "
+                  "{p99_ms:>9.2f} {max_ms:>9.2f} {api_calls:>10}"
+                  "".format(**r))
+
+    ok = [r for r in results if "error" not in r]
+    if len(ok) > 1:
+        base = ok[0]
+        for r in ok[1:]:
+            print("{} handles {:.2f}x the messages of {}, p99 {:.2f}x"
+                  "".format(r["loop"], r["msgs_per_s"] / base["msgs_per_s"],
+                            base["loop"], base["p99_ms"] / r["p99_ms"]))
+
+    if args.output:
+        report = {"python": sys.version.split()[0],
+                  "options": {k: v for k, v in vars(args).items()
+                              if k not in ("output", "child")},
+                  "results": results}
+        with open(args.output, encoding="utf-8", mode="w") as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,28 @@
 from discord.ext import commands
 from .utils.chat_formatting import box
 from .utils.dataIO import dataIO
+from .utils.profiling import profiler
 from .utils import checks
-from __main__ import user_allowed, send_cmd_help
+from __main__ import send_cmd_help
 from copy import copy
 import os
 import discord
 
 
+DATA_FILES = ("data/alias/aliases.json",)
+
+
 class Alias:
     def __init__(self, bot):
         self.bot = bot
         self.file_path = "data/alias/aliases.json"
         self.aliases = dataIO.load_json(self.file_path)
         self.remove_old()
+        bot.pipeline.subscribe(self.on_prefixed, prefixed=True,
+                               server_only=True)
+
+    def __unload(self):
+        self.bot.pipeline.unsubscribe(self.on_prefixed)
 
     @commands.group(pass_context=True, no_pm=True)
     async def alias(self, ctx):
@@ -110,19 +119,16 @@ class Alias:
             else:
                 await self.bot.say("There are no aliases on this server.")
 
-    async def on_message(self, message):
-        if len(message.content) < 2 or message.channel.is_private:
-            return
-
-        msg = message.content
-        server = message.server
-        prefix = self.get_prefix(server, msg)
+    async def on_prefixed(self, ctx):
+        message = ctx.message
+        server = ctx.server
+        prefix = ctx.prefix
 
-        if not prefix:
+        if len(ctx.content) < 2 or not prefix:
             return
 
-        if server.id in self.aliases and user_allowed(message):
-            alias = self.first_word(msg[len(prefix):]).lower()
+        if server.id in self.aliases and ctx.allowed:
+            alias = self.first_word(ctx.invoked).lower()
             if alias in self.aliases[server.id]:
                 new_command = self.aliases[server.id][alias]
                 args = message.content[len(prefix + alias):]
@@ -163,11 +169,7 @@ class Alias:
         return msg.split(" ")[0]
 
     def get_prefix(self, server, msg):
-        prefixes = self.bot.settings.get_prefixes(server)
-        for p in prefixes:
-            if msg.startswith(p):
-                return p
-        return None
+        return self.bot.settings.match_prefix(server, msg)
 
 
 def check_folder():
@@ -186,6 +188,7 @@ def check_file():
 
 
 def setup(bot):
-    check_folder()
-    check_file()
+    with profiler.phase("check_files"):
+        check_folder()
+        check_file()
     bot.add_cog(Alias(bot))
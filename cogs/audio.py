@@ -4,6 +4,9 @@ import threading
 import os
 from random import shuffle, choice
 from cogs.utils.dataIO import dataIO
+from cogs.utils.profiling import profiler
+from cogs.utils.scheduler import BACKGROUND
+from cogs.utils.metrics import metrics
 from cogs.utils import checks
 from cogs.utils.chat_formatting import pagify, escape
 from urllib.parse import urlparse
@@ -27,6 +30,12 @@ __version__ = "0.1.1"
 
 log = logging.getLogger("red.audio")
 
+DATA_FILES = ("data/audio/settings.json",)
+
+# Voice state updates are ignored until a queue exists, which takes a
+# command, so they don't need the cog to be loaded when it's lazy
+LAZY_IGNORED_EVENTS = ("on_voice_state_update",)
+
 try:
     import youtube_dl
 except:
@@ -314,8 +323,12 @@ class Audio:
         self.bot = bot
         self.queue = {}  # add deque's, repeat
         self.downloaders = {}  # sid: object
-        self.settings = dataIO.load_json("data/audio/settings.json")
+        self.settings = dataIO.load_tracked("data/audio/settings.json")
         self.settings_path = "data/audio/settings.json"
+        self.servers = dataIO.load_sharded("data/audio/servers")
+        if "SERVERS" in self.settings:  # Moves them to data/audio/servers
+            for sid, settings in self.settings.pop("SERVERS").items():
+                self.servers[sid] = settings
         self.server_specific_setting_keys = ["VOLUME", "VOTE_ENABLED",
                                              "VOTE_THRESHOLD", "NOPPL_DISCONNECT",
                                              "NOTIFY", "NOTIFY_CHANNEL", "TIMER_DISCONNECT"]
@@ -327,6 +340,11 @@ class Audio:
 
         self.connect_timers = {}
 
+        metrics.gauge("red_audio_queued_songs",
+                      "Songs waiting to be played", func=self._queued_songs)
+        metrics.gauge("red_audio_voice_clients", "Voice channels joined",
+                      func=lambda: len(self.bot.voice_clients))
+
         if player == "ffmpeg":
             self.settings["AVCONV"] = False
         elif player == "avconv":
@@ -988,6 +1006,10 @@ class Audio:
 
         return dataIO.is_valid_json(f)
 
+    def _queued_songs(self):
+        return sum(len(q[QueueKey.QUEUE]) + len(q[QueueKey.TEMP_QUEUE])
+                   for q in self.queue.values())
+
     def _remove_queue(self, server):
         if server.id in self.queue:
             del self.queue[server.id]
@@ -2205,9 +2227,9 @@ class Audio:
         except:
             sid = server
 
-        if sid not in self.settings["SERVERS"]:
-            self.settings["SERVERS"][sid] = {}
-        ret = self.settings["SERVERS"][sid]
+        if sid not in self.servers:
+            self.servers[sid] = {}
+        ret = self.servers[sid]
 
         # Not the cleanest way. Some refactoring is suggested if more settings
         # have to be added
@@ -2262,7 +2284,7 @@ class Audio:
             play"""
         server = self.bot.get_server(sid)
         if self.get_server_settings(server)["NOTIFY"] is True:
-            notify_channel = self.settings["SERVERS"][server.id]["NOTIFY_CHANNEL"]
+            notify_channel = self.servers[server.id]["NOTIFY_CHANNEL"]
         if self.get_server_settings(server)["NOTIFY"] is False:
             notify_channel = None
         max_length = self.settings["MAX_LENGTH"]
@@ -2358,7 +2380,9 @@ class Audio:
             else:
                 return False
         try:
-            await self.bot.purge_from(channel, limit=50, check=to_delete)
+            await self.bot.scheduler.submit(self.bot.purge_from, channel,
+                                            limit=50, check=to_delete,
+                                            priority=BACKGROUND)
         except discord.errors.Forbidden:
             await self.bot.say("I need permissions to manage messages in this channel.")
 
@@ -2385,7 +2409,8 @@ class Audio:
         em.set_thumbnail(url=song.thumbnail)
         em.description = msg.replace('None', '-')
 
-        await self.bot.send_message(channel, "**Now Playing:**", embed=em)
+        await self.bot.send_message(channel, "**Now Playing:**", embed=em,
+                                    priority=BACKGROUND)
 
     async def queue_scheduler(self):
         while self == self.bot.get_cog('Audio'):
@@ -2416,12 +2441,13 @@ class Audio:
                 pass
 
     def save_settings(self):
-        dataIO.save_json('data/audio/settings.json', self.settings)
+        dataIO.mark_dirty('data/audio/settings.json', self.settings)
+        self.servers.save()
 
     def set_server_setting(self, server, key, value):
-        if server.id not in self.settings["SERVERS"]:
-            self.settings["SERVERS"][server.id] = {}
-        self.settings["SERVERS"][server.id][key] = value
+        if server.id not in self.servers:
+            self.servers[server.id] = {}
+        self.servers[server.id][key] = value
 
     def voice_client(self, server):
         return self.bot.voice_client_in(server)
@@ -2466,6 +2492,8 @@ class Audio:
     def __unload(self):
         for vc in self.bot.voice_clients:
             self.bot.loop.create_task(vc.disconnect())
+        metrics.unregister("red_audio_queued_songs")
+        metrics.unregister("red_audio_voice_clients")
 
 
 def check_folders():
@@ -2480,11 +2508,10 @@ def check_folders():
 def check_files():
     default = {"VOLUME": 50, "MAX_LENGTH": 3700, "VOTE_ENABLED": True,
                "MAX_CACHE": 0, "SOUNDCLOUD_CLIENT_ID": None,
-               "TITLE_STATUS": True, "AVCONV": False, "VOTE_THRESHOLD": 50,
-               "SERVERS": {}}
+               "TITLE_STATUS": True, "AVCONV": False, "VOTE_THRESHOLD": 50}
     settings_path = "data/audio/settings.json"
 
-    if not os.path.isfile(settings_path):
+    if not dataIO.exists(settings_path):
         print("Creating default audio settings.json...")
         dataIO.save_json(settings_path, default)
     else:  # consistency check
@@ -2521,8 +2548,9 @@ def verify_ffmpeg_avconv():
 
 
 def setup(bot):
-    check_folders()
-    check_files()
+    with profiler.phase("check_files"):
+        check_folders()
+        check_files()
 
     if youtube_dl is None:
         raise RuntimeError("You need to run `pip3 install youtube_dl`")
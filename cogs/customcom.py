@@ -1,11 +1,15 @@
 from discord.ext import commands
 from .utils.dataIO import dataIO
+from .utils.profiling import profiler
 from .utils import checks
 from .utils.chat_formatting import pagify, box
 import os
 import re
 
 
+DATA_FILES = ("data/customcom/commands.json",)
+
+
 class CustomCommands:
     """Custom commands
 
@@ -15,6 +19,11 @@ class CustomCommands:
         self.bot = bot
         self.file_path = "data/customcom/commands.json"
         self.c_commands = dataIO.load_json(self.file_path)
+        bot.pipeline.subscribe(self.on_prefixed, prefixed=True,
+                               server_only=True)
+
+    def __unload(self):
+        self.bot.pipeline.unsubscribe(self.on_prefixed)
 
     @commands.group(aliases=["cc"], pass_context=True, no_pm=True)
     async def customcom(self, ctx):
@@ -121,19 +130,16 @@ class CustomCommands:
             for page in pagify(commands, delims=[" ", "\n"]):
                 await self.bot.whisper(box(page))
 
-    async def on_message(self, message):
-        if len(message.content) < 2 or message.channel.is_private:
-            return
-
-        server = message.server
-        prefix = self.get_prefix(message)
+    async def on_prefixed(self, ctx):
+        message = ctx.message
+        server = ctx.server
 
-        if not prefix:
+        if len(ctx.content) < 2 or not ctx.prefix:
             return
 
-        if server.id in self.c_commands and self.bot.user_allowed(message):
+        if server.id in self.c_commands and ctx.allowed:
             cmdlist = self.c_commands[server.id]
-            cmd = message.content[len(prefix):]
+            cmd = ctx.invoked
             if cmd in cmdlist:
                 cmd = cmdlist[cmd]
                 cmd = self.format_cc(cmd, message)
@@ -143,12 +149,6 @@ class CustomCommands:
                 cmd = self.format_cc(cmd, message)
                 await self.bot.send_message(message.channel, cmd)
 
-    def get_prefix(self, message):
-        for p in self.bot.settings.get_prefixes(message.server):
-            if message.content.startswith(p):
-                return p
-        return False
-
     def format_cc(self, command, message):
         results = re.findall("\{([^}]+)\}", command)
         for result in results:
@@ -195,6 +195,7 @@ def check_files():
 
 
 def setup(bot):
-    check_folders()
-    check_files()
+    with profiler.phase("check_files"):
+        check_folders()
+        check_files()
     bot.add_cog(CustomCommands(bot))
@@ -1,5 +1,6 @@
 from discord.ext import commands
 from cogs.utils.dataIO import dataIO
+from cogs.utils.profiling import profiler
 from cogs.utils import checks
 from cogs.utils.chat_formatting import pagify, box
 from __main__ import send_cmd_help, set_cog
@@ -30,6 +31,9 @@ DISCLAIMER = ("You're about to add a 3rd party repository. The creator of Red"
               " next reboot.")
 
 
+DATA_FILES = ("data/downloader/repos.json",)
+
+
 class UpdateError(Exception):
     pass
 
@@ -239,7 +243,7 @@ class Downloader:
 
         base_msg = "Downloading updated cogs, please wait... "
         status = ' %d/%d repos updated' % (tasknum, num_repos)
-        msg = await self.bot.say(base_msg + status)
+        msg = await self.bot.say(base_msg + status, coalesce=False)
 
         updated_cogs = []
         new_cogs = []
@@ -676,7 +680,8 @@ class Downloader:
         try:
             msg = await self.bot.edit_message(msg, text)
         except discord.errors.NotFound:
-            msg = await self.bot.send_message(msg.channel, text)
+            msg = await self.bot.send_message(msg.channel, text,
+                                             coalesce=False)
         except:
             raise
         return msg
@@ -703,7 +708,8 @@ def check_files():
 
 
 def setup(bot):
-    check_folders()
-    check_files()
+    with profiler.phase("check_files"):
+        check_folders()
+        check_files()
     n = Downloader(bot)
     bot.add_cog(n)
@@ -1,6 +1,7 @@
 import discord
 from discord.ext import commands
 from cogs.utils.dataIO import dataIO
+from cogs.utils.profiling import profiler
 from collections import namedtuple, defaultdict, deque
 from datetime import datetime
 from copy import deepcopy
@@ -18,6 +19,9 @@ default_settings = {"PAYDAY_TIME": 300, "PAYDAY_CREDITS": 120,
                     "REGISTER_CREDITS": 0}
 
 
+DATA_FILES = ("data/economy/settings.json",)
+
+
 class EconomyError(Exception):
     pass
 
@@ -113,7 +117,8 @@ SLOT_PAYOUTS_MSG = ("Slot machine payouts:\n"
 class Bank:
 
     def __init__(self, bot, file_path):
-        self.accounts = dataIO.load_json(file_path)
+        folder = os.path.splitext(file_path)[0]
+        self.accounts = dataIO.load_sharded(folder, legacy=file_path)
         self.bot = bot
 
     def create_account(self, user, *, initial_balance=0):
@@ -214,14 +219,19 @@ class Bank:
             return []
 
     def get_all_accounts(self):
+        """Returns the accounts of every server
+
+        Reads the bank file of every server, use get_server_accounts
+        when a single server's accounts are needed"""
         accounts = []
-        for server_id, v in self.accounts.items():
+        for server_id in self.accounts:
             server = self.bot.get_server(server_id)
             if server is None:
                 # Servers that have since been left will be ignored
                 # Same for users_id from the old bank format
                 continue
-            raw_server_accounts = deepcopy(self.accounts[server.id])
+            # Not kept in memory, unlike the servers' own lookups
+            raw_server_accounts = deepcopy(self.accounts.peek(server.id))
             for k, v in raw_server_accounts.items():
                 v["id"] = k
                 v["server"] = server
@@ -248,7 +258,7 @@ class Bank:
         return Account(**account)
 
     def _save_bank(self):
-        dataIO.save_json("data/economy/bank.json", self.accounts)
+        self.accounts.save()
 
     def _get_account(self, user):
         server = user.server
@@ -717,16 +727,12 @@ def check_files():
         print("Creating default economy's settings.json...")
         dataIO.save_json(f, {})
 
-    f = "data/economy/bank.json"
-    if not dataIO.is_valid_json(f):
-        print("Creating empty bank.json...")
-        dataIO.save_json(f, {})
-
 
 def setup(bot):
     global logger
-    check_folders()
-    check_files()
+    with profiler.phase("check_files"):
+        check_folders()
+        check_files()
     logger = logging.getLogger("red.economy")
     if logger.level == 0:
         # Prevents the logger from being loaded again in case of module reload
@@ -342,6 +342,8 @@ class General:
             p = NewPoll(message, " ".join(text), self)
             if p.valid:
                 self.poll_sessions.append(p)
+                self.bot.pipeline.subscribe(p.checkVote,
+                                            channel=p.channel.id)
                 await p.start()
             else:
                 await self.bot.say("poll question;option1;option2 (...)")
@@ -364,10 +366,9 @@ class General:
                 return poll
         return False
 
-    async def check_poll_votes(self, message):
-        if message.author.id != self.bot.user.id:
-            if self.getPollByChannel(message):
-                    self.getPollByChannel(message).checkAnswer(message)
+    def __unload(self):
+        for poll in self.poll_sessions:
+            self.bot.pipeline.unsubscribe(poll.checkVote)
 
     def fetch_joined_at(self, user, server):
         """Just a special case for someone special :^)"""
@@ -414,6 +415,12 @@ class NewPoll():
             msg += "*{}* - {} votes\n".format(data["ANSWER"], str(data["VOTES"]))
         await self.client.send_message(self.channel, msg)
         self.poll_sessions.remove(self)
+        self.client.pipeline.unsubscribe(self.checkVote,
+                                         channel=self.channel.id)
+
+    async def checkVote(self, ctx):
+        if ctx.author.id != self.client.user.id:
+            self.checkAnswer(ctx.message)
 
     def checkAnswer(self, message):
         try:
@@ -429,5 +436,4 @@ class NewPoll():
 
 def setup(bot):
     n = General(bot)
-    bot.add_listener(n.check_poll_votes, "on_message")
     bot.add_cog(n)
@@ -1,7 +1,11 @@
 import discord
 from discord.ext import commands
 from .utils.dataIO import dataIO
+from .utils.profiling import profiler
 from .utils import checks
+from .utils.bus import bus, IgnoreListChanged
+from .utils.scheduler import CRITICAL
+from .utils.metrics import metrics
 from __main__ import send_cmd_help, settings
 from datetime import datetime
 from collections import deque, defaultdict, OrderedDict
@@ -12,6 +16,10 @@ import logging
 import asyncio
 
 
+AUTO_ACTIONS = metrics.counter("red_mod_auto_actions_total",
+                               "Messages acted on by the automatic "
+                               "moderation", ("action",))
+
 ACTIONS_REPR = {
     "BAN"     : ("Ban", "\N{HAMMER}"),
     "KICK"    : ("Kick", "\N{WOMANS BOOTS}"),
@@ -45,6 +53,12 @@ for act, enabled in ACTIONS_CASES.items():
     default_settings[act] = enabled
 
 
+DATA_FILES = ("data/mod/settings.json",
+              "data/mod/ignorelist.json",
+              "data/mod/filter.json",
+              "data/mod/perms_cache.json")
+
+
 class ModError(Exception):
     pass
 
@@ -95,17 +109,22 @@ class Mod:
     def __init__(self, bot):
         self.bot = bot
         self.ignore_list = dataIO.load_json("data/mod/ignorelist.json")
+        # Sets of the same ids, checked on every message by user_allowed
+        self.ignored = {k: set(v) for k, v in self.ignore_list.items()}
         self.filter = dataIO.load_json("data/mod/filter.json")
-        self.past_names = dataIO.load_json("data/mod/past_names.json")
-        self.past_nicknames = dataIO.load_json("data/mod/past_nicknames.json")
-        settings = dataIO.load_json("data/mod/settings.json")
-        self.settings = defaultdict(lambda: default_settings.copy(), settings)
+        self.past_names = dataIO.load_journaled("data/mod/past_names.json")
+        self.past_nicknames = dataIO.load_sharded(
+            "data/mod/past_nicknames", legacy="data/mod/past_nicknames.json")
+        self.settings = dataIO.load_tracked("data/mod/settings.json",
+                                            lambda: default_settings.copy())
         self.cache = OrderedDict()
-        self.cases = dataIO.load_json("data/mod/modlog.json")
+        self.cases = dataIO.load_sharded("data/mod/modlog",
+                                         legacy="data/mod/modlog.json")
         self.last_case = defaultdict(dict)
         self.temp_cache = TempCache(bot)
         perms_cache = dataIO.load_json("data/mod/perms_cache.json")
         self._perms_cache = defaultdict(dict, perms_cache)
+        bot.pipeline.subscribe(self.on_server_message, server_only=True)
 
     @commands.group(pass_context=True, no_pm=True)
     @checks.serverowner_or_permissions(administrator=True)
@@ -201,7 +220,7 @@ class Mod:
         """Resets modlog's cases"""
         server = ctx.message.server
         self.cases[server.id] = {}
-        dataIO.save_json("data/mod/modlog.json", self.cases)
+        self.cases.save()
         await self.bot.say("Cases have been reset.")
 
     @modset.command(pass_context=True, no_pm=True)
@@ -454,7 +473,8 @@ class Mod:
                 try:  # We don't want blocked DMs preventing us from banning
                     msg = await self.bot.send_message(user, "You have been banned and "
                               "then unbanned as a quick way to delete your messages.\n"
-                              "You can now join the server again.{}".format(invite))
+                              "You can now join the server again.{}".format(invite),
+                              coalesce=False)
                 except:
                     pass
                 self.temp_cache.add(user, server, "BAN")
@@ -876,25 +896,12 @@ class Mod:
         is_bot = self.bot.user.bot
         has_permissions = channel.permissions_for(server.me).manage_messages
 
-        prefixes = self.bot.command_prefix
-        if isinstance(prefixes, str):
-            prefixes = [prefixes]
-        elif callable(prefixes):
-            if asyncio.iscoroutine(prefixes):
-                await self.bot.say('Coroutine prefixes not yet implemented.')
-                return
-            prefixes = prefixes(self.bot, ctx.message)
-
-        # In case some idiot sets a null prefix
-        if '' in prefixes:
-            prefixes.pop('')
-
         def check(m):
             if m.author.id == self.bot.user.id:
                 return True
             elif m == ctx.message:
                 return True
-            p = discord.utils.find(m.content.startswith, prefixes)
+            p = self.bot.settings.match_prefix(server, m.content)
             if p and len(p) > 0:
                 return m.content[len(p):].startswith(tuple(self.bot.commands))
             return False
@@ -1057,16 +1064,12 @@ class Mod:
         Defaults to current one"""
         current_ch = ctx.message.channel
         if not channel:
-            if current_ch.id not in self.ignore_list["CHANNELS"]:
-                self.ignore_list["CHANNELS"].append(current_ch.id)
-                dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+            if self.add_ignored("CHANNELS", current_ch.id):
                 await self.bot.say("Channel added to ignore list.")
             else:
                 await self.bot.say("Channel already in ignore list.")
         else:
-            if channel.id not in self.ignore_list["CHANNELS"]:
-                self.ignore_list["CHANNELS"].append(channel.id)
-                dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+            if self.add_ignored("CHANNELS", channel.id):
                 await self.bot.say("Channel added to ignore list.")
             else:
                 await self.bot.say("Channel already in ignore list.")
@@ -1075,9 +1078,7 @@ class Mod:
     async def ignore_server(self, ctx):
         """Ignores current server"""
         server = ctx.message.server
-        if server.id not in self.ignore_list["SERVERS"]:
-            self.ignore_list["SERVERS"].append(server.id)
-            dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+        if self.add_ignored("SERVERS", server.id):
             await self.bot.say("This server has been added to the ignore list.")
         else:
             await self.bot.say("This server is already being ignored.")
@@ -1097,16 +1098,12 @@ class Mod:
         Defaults to current one"""
         current_ch = ctx.message.channel
         if not channel:
-            if current_ch.id in self.ignore_list["CHANNELS"]:
-                self.ignore_list["CHANNELS"].remove(current_ch.id)
-                dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+            if self.remove_ignored("CHANNELS", current_ch.id):
                 await self.bot.say("This channel has been removed from the ignore list.")
             else:
                 await self.bot.say("This channel is not in the ignore list.")
         else:
-            if channel.id in self.ignore_list["CHANNELS"]:
-                self.ignore_list["CHANNELS"].remove(channel.id)
-                dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+            if self.remove_ignored("CHANNELS", channel.id):
                 await self.bot.say("Channel removed from ignore list.")
             else:
                 await self.bot.say("That channel is not in the ignore list.")
@@ -1115,13 +1112,34 @@ class Mod:
     async def unignore_server(self, ctx):
         """Removes current server from ignore list"""
         server = ctx.message.server
-        if server.id in self.ignore_list["SERVERS"]:
-            self.ignore_list["SERVERS"].remove(server.id)
-            dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+        if self.remove_ignored("SERVERS", server.id):
             await self.bot.say("This server has been removed from the ignore list.")
         else:
             await self.bot.say("This server is not in the ignore list.")
 
+    def add_ignored(self, kind, id):
+        """Adds a server or channel id to the ignore list
+
+        kind is "SERVERS" or "CHANNELS". Returns False if it was
+        already ignored"""
+        if id in self.ignored[kind]:
+            return False
+        self.ignore_list[kind].append(id)
+        self.ignored[kind].add(id)
+        dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+        bus.publish(IgnoreListChanged(kind))
+        return True
+
+    def remove_ignored(self, kind, id):
+        """Returns False if id wasn't ignored"""
+        if id not in self.ignored[kind]:
+            return False
+        self.ignore_list[kind].remove(id)
+        self.ignored[kind].discard(id)
+        dataIO.save_json("data/mod/ignorelist.json", self.ignore_list)
+        bus.publish(IgnoreListChanged(kind))
+        return True
+
     def count_ignored(self):
         msg = "```Currently ignoring:\n"
         msg += str(len(self.ignore_list["CHANNELS"])) + " channels\n"
@@ -1283,10 +1301,14 @@ class Mod:
     async def mass_purge(self, messages):
         while messages:
             if len(messages) > 1:
-                await self.bot.delete_messages(messages[:100])
+                await self.bot.scheduler.submit(self.bot.delete_messages,
+                                                messages[:100],
+                                                priority=CRITICAL)
                 messages = messages[100:]
             else:
-                await self.bot.delete_message(messages[0])
+                await self.bot.scheduler.submit(self.bot.delete_message,
+                                                messages[0],
+                                                priority=CRITICAL)
                 messages = []
             await asyncio.sleep(1.5)
 
@@ -1392,7 +1414,8 @@ class Mod:
         case_msg = self.format_case_msg(case)
 
         try:
-            msg = await self.bot.send_message(mod_channel, case_msg)
+            msg = await self.bot.send_message(mod_channel, case_msg,
+                                              coalesce=False)
             case["message"] = msg.id
         except:
             pass
@@ -1402,7 +1425,7 @@ class Mod:
         if mod:
             self.last_case[server.id][mod.id] = case_n
 
-        dataIO.save_json("data/mod/modlog.json", self.cases)
+        self.cases.save()
 
         return case_n
 
@@ -1435,7 +1458,7 @@ class Mod:
 
         case_msg = self.format_case_msg(case)
 
-        dataIO.save_json("data/mod/modlog.json", self.cases)
+        self.cases.save()
 
         if case["message"] is None:  # The case's message was never sent
             raise CaseMessageNotFound()
@@ -1497,21 +1520,30 @@ class Mod:
 
         return case_msg
 
-    async def check_filter(self, message):
+    async def check_filter(self, message, content=None):
+        """content is the message's lowercased content, if known"""
         server = message.server
         if server.id in self.filter.keys():
+            if content is None:
+                content = message.content.lower()
             for w in self.filter[server.id]:
-                if w in message.content.lower():
+                if w in content:
                     try:
-                        await self.bot.delete_message(message)
+                        await self.delete_now(message)
                         logger.info("Message deleted in server {}."
                                     "Filtered: {}"
                                     "".format(server.id, w))
+                        AUTO_ACTIONS.inc(action="filter")
                         return True
                     except:
                         pass
         return False
 
+    async def delete_now(self, message):
+        """Deletes a message ahead of Red's less urgent API calls"""
+        await self.bot.scheduler.submit(self.bot.delete_message, message,
+                                        priority=CRITICAL)
+
     async def check_duplicates(self, message):
         server = message.server
         author = message.author
@@ -1529,7 +1561,8 @@ class Mod:
             msgs = self.cache[author.id]
             if len(msgs) == 3 and msgs[0] == msgs[1] == msgs[2]:
                 try:
-                    await self.bot.delete_message(message)
+                    await self.delete_now(message)
+                    AUTO_ACTIONS.inc(action="repeat")
                     return True
                 except:
                     pass
@@ -1546,7 +1579,8 @@ class Mod:
             if len(mentions) >= max_mentions:
                 try:
                     self.temp_cache.add(author, server, "BAN")
-                    await self.bot.ban(author, 1)
+                    await self.bot.scheduler.submit(self.bot.ban, author, 1,
+                                                    priority=CRITICAL)
                 except:
                     logger.info("Failed to ban member for mention spam in "
                                 "server {}".format(server.id))
@@ -1556,6 +1590,7 @@ class Mod:
                                         mod=server.me,
                                         user=author,
                                         reason="Mention spam (Autoban)")
+                    AUTO_ACTIONS.inc(action="mention_spam")
                     return True
         return False
 
@@ -1586,9 +1621,10 @@ class Mod:
         await asyncio.sleep(delay)
         await _delete_helper(self.bot, message)
 
-    async def on_message(self, message):
-        author = message.author
-        if message.server is None or self.bot.user == author:
+    async def on_server_message(self, ctx):
+        message = ctx.message
+        author = ctx.author
+        if self.bot.user == author:
             return
 
         valid_user = isinstance(author, discord.Member) and not author.bot
@@ -1597,7 +1633,7 @@ class Mod:
         if not valid_user or self.is_mod_or_superior(message):
             return
 
-        deleted = await self.check_filter(message)
+        deleted = await self.check_filter(message, ctx.lowered)
         if not deleted:
             deleted = await self.check_duplicates(message)
         if not deleted:
@@ -1637,7 +1673,6 @@ class Mod:
                     names = deque(self.past_names[before.id], maxlen=20)
                     names.append(after.name)
                     self.past_names[before.id] = list(names)
-            dataIO.save_json("data/mod/past_names.json", self.past_names)
 
         if before.nick != after.nick and after.nick is not None:
             server = before.server
@@ -1651,8 +1686,11 @@ class Mod:
             if after.nick not in nicks:
                 nicks.append(after.nick)
                 self.past_nicknames[server.id][before.id] = list(nicks)
-                dataIO.save_json("data/mod/past_nicknames.json",
-                                 self.past_nicknames)
+                self.past_nicknames.save()
+
+    def __unload(self):
+        self.bot.pipeline.unsubscribe(self.on_server_message)
+        self.past_names.close()
 
     def are_overwrites_empty(self, overwrites):
         """There is currently no cleaner way to check if a
@@ -1698,22 +1736,21 @@ def check_files():
         "ignorelist.json"     : ignore_list,
         "filter.json"         : {},
         "past_names.json"     : {},
-        "past_nicknames.json" : {},
         "settings.json"       : {},
-        "modlog.json"         : {},
         "perms_cache.json"    : {}
     }
 
     for filename, value in files.items():
-        if not os.path.isfile("data/mod/{}".format(filename)):
+        if not dataIO.exists("data/mod/{}".format(filename)):
             print("Creating empty {}".format(filename))
             dataIO.save_json("data/mod/{}".format(filename), value)
 
 
 def setup(bot):
     global logger
-    check_folders()
-    check_files()
+    with profiler.phase("check_files"):
+        check_folders()
+        check_files()
     logger = logging.getLogger("mod")
     # Prevents the logger from being loaded again in case of module reload
     if logger.level == 0:
@@ -3,10 +3,16 @@ from discord.ext import commands
 from cogs.utils import checks
 from cogs.utils.converters import GlobalUser
 from __main__ import set_cog
+from .utils.bus import bus, CommandToggled, GlobalIgnoresChanged
 from .utils.dataIO import dataIO
+from .utils.snapshots import take_snapshot_async
+from .utils.profiling import profiler
+from .utils.perf import format_stats
+from .utils import lazy
 from .utils.chat_formatting import pagify, box
 
 import importlib
+import sys
 import traceback
 import logging
 import asyncio
@@ -46,7 +52,9 @@ class Owner:
         self.bot = bot
         self.setowner_lock = False
         self.disabled_commands = dataIO.load_json("data/red/disabled_commands.json")
-        self.global_ignores = dataIO.load_json("data/red/global_ignores.json")
+        self.global_ignores = dataIO.load_tracked("data/red/global_ignores.json")
+        # Sets of the same ids, checked on every message by user_allowed
+        self.ignored = {k: set(v) for k, v in self.global_ignores.items()}
         self.session = aiohttp.ClientSession(loop=self.bot.loop)
 
     def __unload(self):
@@ -173,7 +181,9 @@ class Owner:
         loaded = [c.__module__.split(".")[1] for c in self.bot.cogs.values()]
         # What's in the folder but not loaded is unloaded
         unloaded = [c.split(".")[1] for c in self._list_cogs()
-                    if c.split(".")[1] not in loaded]
+                    if c.split(".")[1] not in loaded and c not in lazy.stubs]
+        # Loaded on first use
+        loaded += [c.split(".")[1] + " (lazy)" for c in lazy.stubs]
 
         if not unloaded:
             unloaded = ["None"]
@@ -240,7 +250,8 @@ class Owner:
             if i != 0 and i % 4 == 0:
                 last = await self.bot.say("There are still {} messages. "
                                           "Type `more` to continue."
-                                          "".format(len(result) - (i+1)))
+                                          "".format(len(result) - (i+1)),
+                                          coalesce=False)
                 msg = await self.bot.wait_for_message(author=author,
                                                       channel=channel,
                                                       check=check,
@@ -538,9 +549,10 @@ class Owner:
     @blacklist.command(name="add")
     async def _blacklist_add(self, user: GlobalUser):
         """Adds user to Red's global blacklist"""
-        if user.id not in self.global_ignores["blacklist"]:
+        if user.id not in self.ignored["blacklist"]:
             self.global_ignores["blacklist"].append(user.id)
-            self.save_global_ignores()
+            self.ignored["blacklist"].add(user.id)
+            self.save_global_ignores("blacklist")
             await self.bot.say("User has been blacklisted.")
         else:
             await self.bot.say("User is already blacklisted.")
@@ -548,9 +560,10 @@ class Owner:
     @blacklist.command(name="remove")
     async def _blacklist_remove(self, user: GlobalUser):
         """Removes user from Red's global blacklist"""
-        if user.id in self.global_ignores["blacklist"]:
+        if user.id in self.ignored["blacklist"]:
             self.global_ignores["blacklist"].remove(user.id)
-            self.save_global_ignores()
+            self.ignored["blacklist"].discard(user.id)
+            self.save_global_ignores("blacklist")
             await self.bot.say("User has been removed from the blacklist.")
         else:
             await self.bot.say("User is not blacklisted.")
@@ -570,7 +583,8 @@ class Owner:
     async def _blacklist_clear(self):
         """Clears the global blacklist"""
         self.global_ignores["blacklist"] = []
-        self.save_global_ignores()
+        self.ignored["blacklist"].clear()
+        self.save_global_ignores("blacklist")
         await self.bot.say("Blacklist is now empty.")
 
     @commands.group(pass_context=True)
@@ -586,13 +600,14 @@ class Owner:
     @whitelist.command(name="add")
     async def _whitelist_add(self, user: GlobalUser):
         """Adds user to Red's global whitelist"""
-        if user.id not in self.global_ignores["whitelist"]:
+        if user.id not in self.ignored["whitelist"]:
             if not self.global_ignores["whitelist"]:
                 msg = "\nNon-whitelisted users will be ignored."
             else:
                 msg = ""
             self.global_ignores["whitelist"].append(user.id)
-            self.save_global_ignores()
+            self.ignored["whitelist"].add(user.id)
+            self.save_global_ignores("whitelist")
             await self.bot.say("User has been whitelisted." + msg)
         else:
             await self.bot.say("User is already whitelisted.")
@@ -600,9 +615,10 @@ class Owner:
     @whitelist.command(name="remove")
     async def _whitelist_remove(self, user: GlobalUser):
         """Removes user from Red's global whitelist"""
-        if user.id in self.global_ignores["whitelist"]:
+        if user.id in self.ignored["whitelist"]:
             self.global_ignores["whitelist"].remove(user.id)
-            self.save_global_ignores()
+            self.ignored["whitelist"].discard(user.id)
+            self.save_global_ignores("whitelist")
             await self.bot.say("User has been removed from the whitelist.")
         else:
             await self.bot.say("User is not whitelisted.")
@@ -622,7 +638,8 @@ class Owner:
     async def _whitelist_clear(self):
         """Clears the global whitelist"""
         self.global_ignores["whitelist"] = []
-        self.save_global_ignores()
+        self.ignored["whitelist"].clear()
+        self.save_global_ignores("whitelist")
         await self.bot.say("Whitelist is now empty.")
 
     @commands.command()
@@ -681,6 +698,7 @@ class Owner:
             comm_obj.hidden = True
             self.disabled_commands.append(command)
             self.save_disabled_commands()
+            bus.publish(CommandToggled(command, False))
             await self.bot.say("Command has been disabled.")
 
     @command_disabler.command()
@@ -689,6 +707,7 @@ class Owner:
         if command in self.disabled_commands:
             self.disabled_commands.remove(command)
             self.save_disabled_commands()
+            bus.publish(CommandToggled(command, True))
             await self.bot.say("Command enabled.")
         else:
             await self.bot.say("That command is not disabled.")
@@ -918,6 +937,148 @@ class Owner:
         else:
             await self.bot.say("No exception has occurred yet.")
 
+    @commands.command()
+    @checks.is_owner()
+    async def snapshot(self):
+        """Takes a snapshot of the data folder
+
+        Files that haven't changed since the last snapshot are linked to
+        it instead of copied. Snapshots are saved in the snapshots folder"""
+        snapshot = await take_snapshot_async(dataIO)
+        await self.bot.say("Snapshot `{}` taken in {:.2f}s (writes held off "
+                           "for {:.0f}ms): {} files linked, {} copied. "
+                           "Compressing it..."
+                           "".format(snapshot.name, snapshot.elapsed,
+                                     snapshot.held * 1000, snapshot.linked,
+                                     snapshot.copied))
+        try:
+            archive = await asyncio.wrap_future(snapshot.compressed)
+        except Exception as e:
+            log.exception("Snapshot compression failed")
+            await self.bot.say("Compression failed: {}".format(e))
+        else:
+            await self.bot.say("Snapshot saved to `{}`.".format(archive))
+
+    @commands.group(invoke_without_command=True)
+    @checks.is_owner()
+    async def perf(self, count: int=25):
+        """Shows the slowest commands since Red started
+
+        Latencies go from receiving the command's message to the end of
+        the command, percentiles are within 2%"""
+        perf = self.bot.command_perf
+        rows = sorted(perf.commands.items(),
+                      key=lambda r: r[1].latency.quantile(0.95),
+                      reverse=True)
+        if not rows:
+            await self.bot.say("No command has been used yet.")
+            return
+        table = format_stats(rows[:max(count, 1)], "command")
+        for page in pagify(table, shorten_by=16):
+            await self.bot.say(box(page))
+
+    @perf.command(name="servers")
+    @checks.is_owner()
+    async def perf_servers(self, *, command: str):
+        """Shows how long a command takes in every server"""
+        stats = self.bot.command_perf.by_server(command)
+        if not stats:
+            await self.bot.say("`{}` hasn't been used since Red started."
+                               "".format(command))
+            return
+        rows = []
+        for sid, s in sorted(stats.items(), key=lambda r: r[1].calls,
+                             reverse=True):
+            server = self.bot.get_server(sid) if sid else None
+            if sid is None:
+                name = "Private messages"
+            else:
+                name = server.name if server else sid
+            rows.append((name, s))
+        for page in pagify(format_stats(rows, "server"), shorten_by=16):
+            await self.bot.say(box(page))
+
+    @perf.command(name="slow")
+    @checks.is_owner()
+    async def perf_slow(self, threshold_ms: float=None):
+        """Shows the last slow commands, or sets how slow they are
+
+        A threshold of 0 stops logging them"""
+        perf = self.bot.command_perf
+        if threshold_ms is not None:
+            perf.slow_threshold = max(threshold_ms, 0) / 1000
+            if perf.slow_threshold:
+                await self.bot.say("Commands taking {:.0f}ms or more will "
+                                   "be logged.".format(threshold_ms))
+            else:
+                await self.bot.say("Slow commands won't be logged anymore.")
+            return
+        if not perf.slow:
+            await self.bot.say("No slow command so far. The threshold is "
+                               "{:.0f}ms.".format(perf.slow_threshold * 1000))
+            return
+        lines = []
+        for name, message, elapsed in reversed(perf.slow):
+            where = message.server.name if message.server else "DM"
+            lines.append("{:>8.0f}ms {} ({}, {})".format(
+                elapsed * 1000, name, where, message.timestamp.strftime(
+                    "%Y-%m-%d %H:%M:%S")))
+        for page in pagify("\n".join(lines), shorten_by=16):
+            await self.bot.say(box(page))
+
+    @perf.command(name="reset")
+    @checks.is_owner()
+    async def perf_reset(self):
+        """Forgets the latencies recorded so far"""
+        self.bot.command_perf.reset()
+        await self.bot.say("Command latencies reset.")
+
+    @commands.group(invoke_without_command=True)
+    @checks.is_owner()
+    async def stalls(self, count: int=10):
+        """Shows where the event loop got blocked the longest
+
+        Use stalls stack <number> to see the stack of one of them"""
+        watchdog = self.bot.watchdog
+        if not watchdog.running:
+            await self.bot.say("The watchdog is off. Start Red with "
+                               "--stall-threshold to turn it on.")
+            return
+        sites = watchdog.top(max(count, 1))
+        if not sites:
+            await self.bot.say("The event loop hasn't been blocked for more "
+                               "than {:.0f}ms yet."
+                               "".format(watchdog.threshold * 1000))
+            return
+        lines = ["{} stalls over {:.0f}ms, the longest took {:.2f}s\n"
+                 "".format(watchdog.stalls, watchdog.threshold * 1000,
+                           watchdog.max_lag)]
+        for i, site in enumerate(sites, 1):
+            lines.append("{}. {}\n   {} stalls, {:.2f}s in total, {:.2f}s "
+                         "at most".format(i, site.name, site.stalls,
+                                          site.total, site.max))
+        for page in pagify("\n".join(lines), shorten_by=16):
+            await self.bot.say(box(page))
+
+    @stalls.command(name="stack")
+    @checks.is_owner()
+    async def stalls_stack(self, number: int):
+        """Shows the stack of the longest stall of a call site"""
+        sites = self.bot.watchdog.top(number)
+        if number < 1 or len(sites) < number:
+            await self.bot.say("There's no call site with that number.")
+            return
+        site = sites[number - 1]
+        for page in pagify(site.stack, shorten_by=16):
+            await self.bot.say(box(page, lang="py"))
+
+    @stalls.command(name="reset")
+    @checks.is_owner()
+    async def stalls_reset(self):
+        """Forgets the stalls recorded so far"""
+        self.bot.watchdog.reset()
+        await self.bot.say("Stalls reset.")
+
     def _populate_list(self, _list):
         """Used for both whitelist / blacklist
 
@@ -940,21 +1101,45 @@ class Owner:
         return []
 
     def _load_cog(self, cogname):
+        self._setup_cog(self._import_cog(cogname))
+
+    def _import_cog(self, cogname):
+        """Imports the cog's module, or reloads it if it was before"""
         if not self._does_cogfile_exist(cogname):
             raise CogNotFoundError(cogname)
+        lazy.remove_stubs(cogname)
         try:
-            mod_obj = importlib.import_module(cogname)
-            importlib.reload(mod_obj)
-            self.bot.load_extension(mod_obj.__name__)
+            with profiler.phase(cogname + " import"):
+                if cogname in sys.modules:
+                    return importlib.reload(sys.modules[cogname])
+                return importlib.import_module(cogname)
         except SyntaxError as e:
             raise CogLoadError(*e.args)
-        except:
-            raise
+
+    def _setup_cog(self, mod_obj):
+        """Runs the setup of a cog imported with _import_cog"""
+        missing = [d for d in self._cog_dependencies(mod_obj)
+                   if d not in self.bot.extensions]
+        if missing:
+            raise CogLoadError("{} requires {} to be loaded first"
+                               "".format(mod_obj.__name__,
+                                         ", ".join(missing)))
+        before = lazy.manifest.snapshot(self.bot)
+        with profiler.phase(mod_obj.__name__ + " setup"):
+            self.bot.load_extension(mod_obj.__name__)
+        lazy.manifest.record(self.bot, mod_obj.__name__, before)
+
+    def _cog_dependencies(self, mod_obj):
+        """The cogs a cog's module declares in DEPENDS, as extensions"""
+        return [d if d.startswith("cogs.") else "cogs." + d
+                for d in getattr(mod_obj, "DEPENDS", ())]
 
     def _unload_cog(self, cogname, reloading=False):
         if not reloading and cogname == "cogs.owner":
             raise OwnerUnloadWithoutReloadError(
                 "Can't unload the owner plugin :P")
+        if lazy.remove_stubs(cogname):
+            return
         try:
             self.bot.unload_extension(cogname)
         except:
@@ -1051,8 +1236,9 @@ class Owner:
 
         return fmt.format(d=days, h=hours, m=minutes, s=seconds)
 
-    def save_global_ignores(self):
+    def save_global_ignores(self, which):
         dataIO.save_json("data/red/global_ignores.json", self.global_ignores)
+        bus.publish(GlobalIgnoresChanged(which))
 
     def save_disabled_commands(self):
         dataIO.save_json("data/red/disabled_commands.json", self.disabled_commands)
@@ -1074,11 +1260,11 @@ def _import_old_data(data):
 
 
 def check_files():
-    if not os.path.isfile("data/red/disabled_commands.json"):
+    if not dataIO.exists("data/red/disabled_commands.json"):
         print("Creating empty disabled_commands.json...")
         dataIO.save_json("data/red/disabled_commands.json", [])
 
-    if not os.path.isfile("data/red/global_ignores.json"):
+    if not dataIO.exists("data/red/global_ignores.json"):
         print("Creating empty global_ignores.json...")
         data = {"blacklist": [], "whitelist": []}
         try:
@@ -1,5 +1,7 @@
 from discord.ext import commands
 from .utils.dataIO import dataIO
+from .utils.profiling import profiler
+from .utils.scheduler import BACKGROUND
 from .utils.chat_formatting import escape_mass_mentions
 from .utils import checks
 from collections import defaultdict
@@ -14,6 +16,13 @@ import logging
 import json
 
 
+DATA_FILES = ("data/streams/twitch.json",
+              "data/streams/hitbox.json",
+              "data/streams/beam.json",
+              "data/streams/picarto.json",
+              "data/streams/settings.json")
+
+
 class StreamsError(Exception):
     pass
 
@@ -41,10 +50,10 @@ class Streams:
 
     def __init__(self, bot):
         self.bot = bot
-        self.twitch_streams = dataIO.load_json("data/streams/twitch.json")
-        self.hitbox_streams = dataIO.load_json("data/streams/hitbox.json")
-        self.mixer_streams = dataIO.load_json("data/streams/beam.json")
-        self.picarto_streams = dataIO.load_json("data/streams/picarto.json")
+        self.twitch_streams = dataIO.load_tracked("data/streams/twitch.json")
+        self.hitbox_streams = dataIO.load_tracked("data/streams/hitbox.json")
+        self.mixer_streams = dataIO.load_tracked("data/streams/beam.json")
+        self.picarto_streams = dataIO.load_tracked("data/streams/picarto.json")
         settings = dataIO.load_json("data/streams/settings.json")
         self.settings = defaultdict(dict, settings)
         self.messages_cache = defaultdict(list)
@@ -602,17 +611,18 @@ class Streams:
                             can_speak = channel.permissions_for(channel.server.me).send_messages
                             message = mention + " {} is live!".format(stream["NAME"])
                             if channel and can_speak:
-                                m = await self.bot.send_message(channel, message, embed=embed)
+                                m = await self.bot.send_message(channel, message, embed=embed,
+                                                                priority=BACKGROUND)
                                 messages_sent.append(m)
                         self.messages_cache[key] = messages_sent
 
                     await asyncio.sleep(0.5)
 
             if save:
-                dataIO.save_json("data/streams/twitch.json", self.twitch_streams)
-                dataIO.save_json("data/streams/hitbox.json", self.hitbox_streams)
-                dataIO.save_json("data/streams/beam.json", self.mixer_streams)
-                dataIO.save_json("data/streams/picarto.json", self.picarto_streams)
+                dataIO.mark_dirty("data/streams/twitch.json", self.twitch_streams)
+                dataIO.mark_dirty("data/streams/hitbox.json", self.hitbox_streams)
+                dataIO.mark_dirty("data/streams/beam.json", self.mixer_streams)
+                dataIO.mark_dirty("data/streams/picarto.json", self.picarto_streams)
 
             await asyncio.sleep(CHECK_DELAY)
 
@@ -623,7 +633,9 @@ class Streams:
             is_enabled = settings.get("AUTODELETE", True)
             try:
                 if is_enabled:
-                    await self.bot.delete_message(message)
+                    await self.bot.scheduler.submit(self.bot.delete_message,
+                                                    message,
+                                                    priority=BACKGROUND)
             except:
                 pass
 
@@ -651,7 +663,7 @@ class Streams:
                     stream["ID"] = result["_id"]
 
         # We might as well delete the invalid / renamed ones
-        self.twitch_streams = [s for s in self.twitch_streams if "ID" in s]
+        self.twitch_streams[:] = [s for s in self.twitch_streams if "ID" in s]
 
         dataIO.save_json("data/streams/twitch.json", self.twitch_streams)
 
@@ -684,8 +696,9 @@ def check_files():
 def setup(bot):
     logger = logging.getLogger('aiohttp.client')
     logger.setLevel(50)  # Stops warning spam
-    check_folders()
-    check_files()
+    with profiler.phase("check_files"):
+        check_folders()
+        check_files()
     n = Streams(bot)
     loop = asyncio.get_event_loop()
     loop.create_task(n.stream_checker())
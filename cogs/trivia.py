@@ -1,6 +1,8 @@
 from discord.ext import commands
 from random import choice
 from .utils.dataIO import dataIO
+from .utils.profiling import profiler
+from .utils.metrics import metrics
 from .utils import checks
 from .utils.chat_formatting import box
 from collections import Counter, defaultdict, namedtuple
@@ -16,8 +18,12 @@ DEFAULTS = {"MAX_SCORE"    : 10,
             "BOT_PLAYS"    : False,
             "REVEAL_ANSWER": True}
 
+DATA_FILES = ("data/trivia/settings.json",)
+
 TriviaLine = namedtuple("TriviaLine", "question answers")
 
+GAMES = metrics.counter("red_trivia_games_total", "Trivia sessions started")
+
 
 class Trivia:
     """General commands."""
@@ -27,6 +33,8 @@ class Trivia:
         self.file_path = "data/trivia/settings.json"
         settings = dataIO.load_json(self.file_path)
         self.settings = defaultdict(lambda: DEFAULTS.copy(), settings)
+        metrics.gauge("red_trivia_sessions", "Ongoing trivia sessions",
+                      func=lambda: len(self.trivia_sessions))
 
     @commands.group(pass_context=True, no_pm=True)
     @checks.mod_or_permissions(administrator=True)
@@ -107,6 +115,9 @@ class Trivia:
                 settings = self.settings[server.id]
                 t = TriviaSession(self.bot, trivia_list, message, settings)
                 self.trivia_sessions.append(t)
+                GAMES.inc()
+                self.bot.pipeline.subscribe(self.on_answer,
+                                            channel=t.channel.id)
                 await t.new_question()
         else:
             await self.bot.say("A trivia session is already ongoing in this channel.")
@@ -188,15 +199,21 @@ class Trivia:
                 return t
         return None
 
-    async def on_message(self, message):
-        if message.author != self.bot.user:
-            session = self.get_trivia_by_channel(message.channel)
+    async def on_answer(self, ctx):
+        if ctx.author != self.bot.user:
+            session = self.get_trivia_by_channel(ctx.channel)
             if session:
-                await session.check_answer(message)
+                await session.check_answer(ctx.message, ctx.lowered)
 
     async def on_trivia_end(self, instance):
         if instance in self.trivia_sessions:
             self.trivia_sessions.remove(instance)
+            self.bot.pipeline.unsubscribe(self.on_answer,
+                                          channel=instance.channel.id)
+
+    def __unload(self):
+        self.bot.pipeline.unsubscribe(self.on_answer)
+        metrics.unregister("red_trivia_sessions")
 
     def save_settings(self):
         dataIO.save_json(self.file_path, self.settings)
@@ -283,7 +300,7 @@ class TriviaSession():
             t += "+ {}\t{}\n".format(user, score)
         await self.bot.say(box(t, lang="diff"))
 
-    async def check_answer(self, message):
+    async def check_answer(self, message, content=None):
         if message.author == self.bot.user:
             return
         elif self.current_line is None:
@@ -291,10 +308,12 @@ class TriviaSession():
 
         self.timeout = time.perf_counter()
         has_guessed = False
+        if content is None:
+            content = message.content.lower()
 
         for answer in self.current_line.answers:
             answer = answer.lower()
-            guess = message.content.lower()
+            guess = content
             if " " not in answer:  # Exact matching, issue #331
                 guess = guess.split(" ")
                 for word in guess:
@@ -321,12 +340,13 @@ def check_folders():
 
 
 def check_files():
-    if not os.path.isfile("data/trivia/settings.json"):
+    if not dataIO.exists("data/trivia/settings.json"):
         print("Creating empty settings.json...")
         dataIO.save_json("data/trivia/settings.json", {})
 
 
 def setup(bot):
-    check_folders()
-    check_files()
+    with profiler.phase("check_files"):
+        check_folders()
+        check_files()
     bot.add_cog(Trivia(bot))
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+
+#
+# A small in-process bus on which settings changes are published, so that
+# cogs can cache what they derive from them and drop it only when needed.
+#
+# Usage:
+#   from cogs.utils.bus import bus, RolesChanged
+#
+#   bus.subscribe(RolesChanged, self.on_roles_changed)  # In __init__
+#   bus.unsubscribe(RolesChanged, self.on_roles_changed)  # In __unload
+#
+# Subscribers are called right away with the event. Coroutine functions
+# are scheduled on the event loop instead.
+#
+
+log = logging.getLogger("red")
+
+
+class Event:
+    """Base class of the events published on the bus"""
+    __slots__ = ()
+
+    def __repr__(self):
+        values = ("{}={!r}".format(k, getattr(self, k)) for k in self.__slots__)
+        return "<{} {}>".format(type(self).__name__, " ".join(values))
+
+
+class RolesChanged(Event):
+    """The admin or mod role of a server has changed
+
+    server_id is None if the default roles have changed"""
+    __slots__ = ("server_id",)
+
+    def __init__(self, server_id):
+        self.server_id = server_id
+
+
+class PrefixesChanged(Event):
+    """The prefixes of a server have changed
+
+    server_id is None if the global prefixes have changed"""
+    __slots__ = ("server_id",)
+
+    def __init__(self, server_id):
+        self.server_id = server_id
+
+
+class GlobalIgnoresChanged(Event):
+    """Users were added to or removed from the blacklist or whitelist
+
+    which is "blacklist" or "whitelist\""""
+    __slots__ = ("which",)
+
+    def __init__(self, which):
+        self.which = which
+
+
+class IgnoreListChanged(Event):
+    """Servers or channels were added to or removed from Mod's ignore list
+
+    kind is "SERVERS" or "CHANNELS\""""
+    __slots__ = ("kind",)
+
+    def __init__(self, kind):
+        self.kind = kind
+
+
+class CommandToggled(Event):
+    """A command has been disabled or enabled again"""
+    __slots__ = ("command", "enabled")
+
+    def __init__(self, command, enabled):
+        self.command = command
+        self.enabled = enabled
+
+
+class EventBus:
+
+    def __init__(self):
+        self._subscribers = {}
+        self.published = 0
+
+    def subscribe(self, event_type, callback):
+        """Calls callback with every event of event_type (or subclass)"""
+        self._subscribers.setdefault(event_type, []).append(callback)
+
+    def unsubscribe(self, event_type, callback):
+        try:
+            self._subscribers[event_type].remove(callback)
+        except (KeyError, ValueError):
+            pass
+
+    def publish(self, event):
+        self.published += 1
+        for event_type in type(event).__mro__:
+            for callback in tuple(self._subscribers.get(event_type, ())):
+                try:
+                    if asyncio.iscoroutinefunction(callback):
+                        asyncio.ensure_future(callback(event))
+                    else:
+                        callback(event)
+                except Exception:
+                    log.exception("Subscriber {!r} failed on {!r}"
+                                  "".format(callback, event))
+
+
+bus = EventBus()
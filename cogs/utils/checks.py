@@ -1,6 +1,7 @@
 from discord.ext import commands
 import discord.utils
 from __main__ import settings
+from .bus import bus, RolesChanged
 
 #
 # This is a modified version of checks.py, originally made by Rapptz
@@ -13,6 +14,9 @@ def is_owner_check(ctx):
     _id = ctx.message.author.id
     return _id == settings.owner or _id in ctx.bot.settings.co_owners
 
+# How a check was made: the stubs of lazy cogs are given the same checks
+is_owner_check.recipe = ("is_owner", {})
+
 def is_owner():
     return commands.check(is_owner_check)
 
@@ -26,6 +30,24 @@ def is_owner():
 # the permissions required for them.
 # Of course, the owner will always be able to execute commands.
 
+_role_names = {}  # Server id -> lowercased (admin role, mod role)
+
+def _on_roles_changed(event):
+    if event.server_id is None:
+        _role_names.clear()
+    else:
+        _role_names.pop(event.server_id, None)
+
+bus.subscribe(RolesChanged, _on_roles_changed)
+
+def get_role_names(server):
+    sid = server.id if server is not None else None
+    names = _role_names.get(sid)
+    if names is None:
+        names = tuple(r.lower() for r in settings.get_server_roles(server))
+        _role_names[sid] = names
+    return names
+
 def check_permissions(ctx, perms):
     if is_owner_check(ctx):
         return True
@@ -51,19 +73,18 @@ def role_or_permissions(ctx, check, **perms):
 
 def mod_or_permissions(**perms):
     def predicate(ctx):
-        server = ctx.message.server
-        mod_role = settings.get_server_mod(server).lower()
-        admin_role = settings.get_server_admin(server).lower()
-        return role_or_permissions(ctx, lambda r: r.name.lower() in (mod_role,admin_role), **perms)
+        names = get_role_names(ctx.message.server)
+        return role_or_permissions(ctx, lambda r: r.name.lower() in names, **perms)
 
+    predicate.recipe = ("mod_or_permissions", perms)
     return commands.check(predicate)
 
 def admin_or_permissions(**perms):
     def predicate(ctx):
-        server = ctx.message.server
-        admin_role = settings.get_server_admin(server)
-        return role_or_permissions(ctx, lambda r: r.name.lower() == admin_role.lower(), **perms)
+        admin_role = get_role_names(ctx.message.server)[0]
+        return role_or_permissions(ctx, lambda r: r.name.lower() == admin_role, **perms)
 
+    predicate.recipe = ("admin_or_permissions", perms)
     return commands.check(predicate)
 
 def serverowner_or_permissions(**perms):
@@ -77,6 +98,7 @@ def serverowner_or_permissions(**perms):
             return True
 
         return check_permissions(ctx,perms)
+    predicate.recipe = ("serverowner_or_permissions", perms)
     return commands.check(predicate)
 
 def serverowner():
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+
+#
+# Merges the plain text messages sent to the same destination within a
+# short window into one message, so bursts of small messages take one
+# API call instead of one each.
+#
+# Enabled with --coalesce-window. Every sender of a merged message gets
+# the same Message back, so a message that is edited or deleted later on
+# has to be sent on its own:
+#   msg = await self.bot.say("Working on it...", coalesce=False)
+#   await self.bot.edit_message(msg, "Done.")
+# Messages sent with delete_after are sent on their own automatically.
+#
+
+log = logging.getLogger("red")
+
+MESSAGE_LIMIT = 2000
+
+
+class Batch:
+    __slots__ = ("destination", "pieces", "futures", "length", "timer")
+
+    def __init__(self, destination):
+        self.destination = destination
+        self.pieces = []
+        self.futures = []
+        self.length = -1  # No separator before the first piece
+        self.timer = None
+
+    def add(self, content, future):
+        self.pieces.append(content)
+        self.futures.append(future)
+        self.length += len(content) + 1
+
+    def fits(self, content, limit):
+        return self.length + len(content) + 1 <= limit
+
+
+class MessageCoalescer:
+
+    def __init__(self, send, window=0, limit=MESSAGE_LIMIT):
+        self._send = send  # Coroutine function taking destination, content
+        self.window = window  # Seconds, 0 disables coalescing
+        self.limit = limit
+        self._batches = {}  # Destination id: batch being filled
+        self._sending = {}  # Destination id: last batch being sent
+        self.merged = 0  # Messages that didn't need an API call of their own
+
+    def accepts(self, content, tts=False, embed=None):
+        """Whether a message can be merged with others"""
+        return (self.window > 0 and not tts and embed is None and
+                isinstance(content, str) and
+                0 < len(content) <= self.limit)
+
+    async def send(self, destination, content):
+        """Sends content along with the other messages sent to destination
+        within the window and returns the Message they were sent as"""
+        key = _key(destination)
+        batch = self._batches.get(key)
+        if batch is not None and not batch.fits(content, self.limit):
+            self._flush(key)
+            batch = None
+        if batch is None:
+            batch = self._batches[key] = Batch(destination)
+            loop = asyncio.get_event_loop()
+            batch.timer = loop.call_later(self.window, self._flush, key)
+        else:
+            self.merged += 1
+        future = asyncio.Future()
+        batch.add(content, future)
+        return await future
+
+    async def flush(self, destination):
+        """Sends what's waiting for destination and waits until it's sent,
+        so a message sent next comes after it"""
+        key = _key(destination)
+        self._flush(key)
+        task = self._sending.get(key)
+        if task is not None:
+            await asyncio.wait([task])
+
+    def _flush(self, key):
+        batch = self._batches.pop(key, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        previous = self._sending.get(key)
+        task = asyncio.ensure_future(self._deliver(batch, previous))
+        self._sending[key] = task
+
+        def done(task):
+            if self._sending.get(key) is task:
+                del self._sending[key]
+        task.add_done_callback(done)
+
+    async def _deliver(self, batch, previous):
+        if previous is not None:  # Batches are sent in order
+            await asyncio.wait([previous])
+        try:
+            message = await self._send(batch.destination,
+                                       "\n".join(batch.pieces))
+        except Exception as e:
+            log.debug("Coalesced message to {} failed: {!r}"
+                      "".format(_key(batch.destination), e))
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_result(message)
+
+
+def _key(destination):
+    return getattr(destination, "id", destination)
@@ -1,50 +1,922 @@
 import json
 import os
 import logging
-from random import randint
+import asyncio
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import Future as ConcurrentFuture, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from urllib.parse import quote, unquote
+from uuid import uuid4
+
+from .jsonindex import KeyIndex
+from .tracked import Tracked, track
+from .metrics import metrics
+
+SAVE_TIME = metrics.histogram("red_data_save_seconds",
+                              "Time spent writing data files")
 
 class InvalidFileIO(Exception):
     pass
 
+class WriteBehind():
+    """Coalesces repeated saves of the same file
+
+    Files marked as dirty are saved at most `delay` seconds after the
+    first time they were marked, no matter how many times they get
+    marked in the meantime. This bounds how much data can be lost in
+    case of a crash. A delay of 0 disables write-behind entirely."""
+
+    def __init__(self, dataio, delay=0, max_pending=100):
+        self.dataio = dataio
+        self.delay = delay
+        self.max_pending = max_pending
+        self.flushed = 0
+        self.coalesced = 0
+        self._pending = OrderedDict()
+        self._handle = None
+        self._loop = None  # The loop the timer runs on
+
+    @property
+    def enabled(self):
+        return self.delay > 0
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def mark(self, filename, data):
+        if not self.enabled:
+            if self.dataio.in_loop():
+                self.dataio.save_json_async(filename, data)
+                return True
+            return self.dataio.save_json(filename, data)
+
+        if not self.dataio.in_loop():
+            loop = self._loop
+            if loop is not None and loop.is_running():
+                # From another thread, _pending belongs to the loop's
+                loop.call_soon_threadsafe(self.mark, filename, data)
+                return True
+            # No timer would run, e.g. while cogs are set up before
+            # the loop is started
+            self._pending.pop(filename, None)
+            return self.dataio.save_json(filename, data)
+
+        if filename in self._pending:
+            self.coalesced += 1
+        self._pending[filename] = data
+
+        if len(self._pending) >= self.max_pending:
+            # Saved by the background thread when called from the loop
+            self.flush(background=True)
+        elif self._handle is None:
+            self._schedule()
+        return True
+
+    def flush(self, filename=None, background=False):
+        """Saves the pending files now
+
+        If filename is passed only that file is saved. If background is
+        True the files are saved with save_json_async"""
+        if filename is not None:
+            if filename not in self._pending:
+                return
+            self._save(filename, self._pending.pop(filename))
+            return
+
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        while self._pending:
+            filename, data = self._pending.popitem(last=False)
+            self._save(filename, data, background)
+
+    def discard(self, filename):
+        """Forgets a pending save without saving it"""
+        self._pending.pop(filename, None)
+
+    def _save(self, filename, data, background=False):
+        if background and self.dataio.in_loop():
+            self.dataio.save_json_async(filename, data)
+            self.flushed += 1
+            return
+        try:
+            self.dataio.save_json(filename, data)
+        except Exception:
+            self.dataio.logger.exception("Write-behind save of {} has failed"
+                                         "".format(filename))
+        else:
+            self.flushed += 1
+
+    def _schedule(self):
+        self._loop = asyncio.get_event_loop()
+        self._handle = self._loop.call_later(self.delay, self._on_timer)
+
+    def _on_timer(self):
+        self._handle = None
+        self.flush(background=True)
+
+class ReadCache():
+    """Keeps the contents of recently read json files in memory
+
+    Entries are checked against the file's mtime, size and inode every
+    time they are used, so files that have been changed by anything
+    other than dataIO are read again. The document parsed to check
+    whether a file is valid is handed to the next load of that file
+    instead of being parsed again."""
+
+    def __init__(self, max_size=2**25):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()  # Background saves update it too
+
+    def read(self, filename):
+        """Returns the cache entry of filename, reading it if needed"""
+        try:
+            st = os.stat(filename)
+        except FileNotFoundError:
+            self.discard(filename)
+            raise
+        signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None and entry.signature == signature:
+                self.hits += 1
+                self._entries.move_to_end(filename)
+                return entry
+        self.misses += 1
+        with open(filename, encoding='utf-8', mode="r") as f:
+            text = f.read()
+        return self.put(filename, text, signature)
+
+    def put(self, filename, text, signature=None, valid=None):
+        if signature is None:
+            st = os.stat(filename)
+            signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+        entry = CacheEntry(signature, text, valid)
+        with self._lock:
+            self._discard(filename)
+            if len(text) > self.max_size:
+                return entry
+            self._entries[filename] = entry
+            self._size += len(text)
+            while self._size > self.max_size:
+                _, old = self._entries.popitem(last=False)
+                self._size -= len(old.text)
+        return entry
+
+    def discard(self, filename):
+        with self._lock:
+            self._discard(filename)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _discard(self, filename):
+        entry = self._entries.pop(filename, None)
+        if entry is not None:
+            self._size -= len(entry.text)
+
+class CacheEntry():
+    __slots__ = ("signature", "text", "valid", "parsed", "index")
+
+    def __init__(self, signature, text, valid=None):
+        self.signature = signature
+        self.text = text
+        self.valid = valid
+        self.parsed = None
+        self.index = None
+
+    def key_index(self):
+        if self.index is None:
+            self.index = KeyIndex(self.text)
+        return self.index
+
+    def parse(self, keep=False):
+        """Parses the text, or hands over the document parsed earlier
+
+        If keep is True the parsed document is held for the next call"""
+        if self.parsed is not None:
+            data, self.parsed = self.parsed, None
+        else:
+            try:
+                data = json.loads(self.text)
+            except ValueError:
+                self.valid = False
+                raise
+            self.valid = True
+        if keep:
+            self.parsed = data
+        return data
+
+class JournaledDocument(MutableMapping):
+    """A json object whose changes are appended to a journal
+
+    Instead of rewriting the whole file, every change is written as a
+    small record to <filename>.journal. The full file is only saved
+    again on compaction, when the journal grows past max_journal_size
+    bytes or the last compaction is older than compact_interval
+    seconds. Loading replays the journal on top of the saved file.
+    Within the event loop the file is saved in the background, and the
+    records it covers are dropped from the journal once it's written.
+
+    Only assignments and deletions are journaled: a nested value that
+    is changed in place has to be assigned again (or changed through
+    set_path) for the change to be saved."""
+
+    SET = "s"
+    DELETE = "d"
+
+    def __init__(self, dataio, filename, max_journal_size=2**20,
+                 compact_interval=3600):
+        self.dataio = dataio
+        self.filename = filename
+        self.journal_path = filename + ".journal"
+        self.max_journal_size = max_journal_size
+        self.compact_interval = compact_interval
+        if dataio.exists(filename):
+            self._data = dataio.load_json(filename)
+        else:
+            self._data = {}
+        intact = self._replay()
+        self._journal = open(self.journal_path, encoding="utf-8", mode="a")
+        self._journal_size = self._journal.tell()
+        self._last_compaction = time.monotonic()
+        self._compacting = False
+        if not intact or self._journal_size > self.max_journal_size:
+            self.compact()
+
+    def __getitem__(self, key):
+        return self._data[self._key(key)]
+
+    def __setitem__(self, key, value):
+        self.set_path((key,), value)
+
+    def __delitem__(self, key):
+        if self._key(key) not in self._data:
+            raise KeyError(key)
+        self.delete_path((key,))
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self._key(key) in self._data
+
+    def set_path(self, path, value):
+        """Sets a nested value, creating the missing objects on the way"""
+        path = [self._key(k) for k in path]
+        self._apply(self.SET, path, value)
+        self._append([self.SET, path, value])
+
+    def delete_path(self, path):
+        """Deletes a nested value if it exists"""
+        path = [self._key(k) for k in path]
+        self._apply(self.DELETE, path)
+        self._append([self.DELETE, path])
+
+    def compact(self):
+        """Saves the whole document and empties the journal
+
+        Called from within the event loop, the document is saved with
+        save_json_async and the journal is emptied once it's written"""
+        self._last_compaction = time.monotonic()
+        if not self.dataio.in_loop():
+            self.dataio.save_json(self.filename, self._data)
+            self._drop_records(self._journal_size)
+            return
+        if self._compacting:
+            return
+        self._compacting = True
+        future = self.dataio.save_json_async(self.filename, self._data)
+        future.add_done_callback(partial(self._compacted, self._journal_size))
+
+    def close(self):
+        self._journal.close()
+
+    def _append(self, record):
+        line = json.dumps(record, separators=(',', ':')) + "\n"
+        with self.dataio._write_lock:
+            self.dataio._record(self.journal_path)
+            self._journal.write(line)
+            self._journal.flush()
+            if self.dataio.fsync != "none":
+                os.fsync(self._journal.fileno())
+        self._journal_size += len(line)
+
+        elapsed = time.monotonic() - self._last_compaction
+        if (self._journal_size > self.max_journal_size or
+                elapsed > self.compact_interval):
+            self.compact()
+
+    def _compacted(self, covered, future):
+        self._compacting = False
+        if future.cancelled() or not future.result():
+            return  # The journal is kept, it's compacted again later
+        if not self._journal.closed:
+            self._drop_records(covered)
+
+    def _drop_records(self, covered):
+        """Removes the first `covered` bytes of records from the journal,
+        keeping the ones appended since"""
+        with self.dataio._write_lock:
+            self.dataio._record(self.journal_path)
+            self._journal.close()
+            with open(self.journal_path, mode="rb") as f:
+                f.seek(covered)
+                rest = f.read()
+            if rest:
+                tmp_file = self.journal_path + ".tmp"
+                with open(tmp_file, mode="wb") as f:
+                    f.write(rest)
+                    if self.dataio.fsync != "none":
+                        f.flush()
+                        os.fsync(f.fileno())
+                os.replace(tmp_file, self.journal_path)
+                mode = "a"
+            else:
+                mode = "w"
+            self._journal = open(self.journal_path, encoding="utf-8",
+                                 mode=mode)
+        self._journal_size = len(rest)
+
+    def _apply(self, op, path, value=None):
+        parent = self._data
+        for key in path[:-1]:
+            if not isinstance(parent.get(key), dict):
+                if op == self.DELETE:
+                    return
+                parent[key] = {}
+            parent = parent[key]
+        if op == self.SET:
+            parent[path[-1]] = value
+        else:
+            parent.pop(path[-1], None)
+
+    def _replay(self):
+        """Returns False if the journal had to be truncated"""
+        try:
+            f = open(self.journal_path, encoding="utf-8", mode="r")
+        except FileNotFoundError:
+            return True
+        with f:
+            for n, line in enumerate(f, 1):
+                try:
+                    op, path, *value = json.loads(line)
+                except ValueError:  # Interrupted write, nothing follows it
+                    self.dataio.logger.warning("Discarding journal of {} "
+                                               "from line {} onwards"
+                                               "".format(self.filename, n))
+                    return False
+                self._apply(op, path, *value)
+        return True
+
+    @staticmethod
+    def _key(key):
+        # Same conversion json.dumps applies to non-string keys
+        return key if isinstance(key, str) else json.dumps(key)
+
+class ShardedDocument(MutableMapping):
+    """A json object split into one file per top-level key
+
+    Meant for data kept per server, e.g. data/economy/bank/<id>.json.
+    A shard is loaded the first time its key is accessed and dropped
+    from memory once it hasn't been accessed for idle_timeout seconds,
+    so only the servers in use are kept in memory. Shards are tracked
+    and save() only writes the ones that have changed.
+
+    Don't hold on to a shard across awaits for longer than idle_timeout:
+    once evicted, changes made to it are no longer saved."""
+
+    def __init__(self, dataio, folder, idle_timeout=None):
+        self.dataio = dataio
+        self.folder = folder
+        if idle_timeout is None:
+            idle_timeout = dataio.shard_idle_timeout
+        self.idle_timeout = idle_timeout
+        self.evicted = 0
+        if dataio._engine_for(self.path("_")) is None:
+            os.makedirs(folder, exist_ok=True)
+        self._keys = set(unquote(n[:-5]) for n in dataio.list_json(folder))
+        self._shards = {}
+        self._last_used = {}
+        self._last_sweep = time.monotonic()
+
+    def __getitem__(self, key):
+        try:
+            shard = self._shards[key]
+        except KeyError:
+            if key not in self._keys:
+                raise
+            shard = self.dataio.load_tracked(self.path(key))
+            self._shards[key] = shard
+        self._touch(key)
+        return shard
+
+    def __setitem__(self, key, value):
+        value = track(value)
+        if isinstance(value, Tracked):
+            value.changes.add()
+        self._keys.add(key)
+        self._shards[key] = value
+        self._touch(key)
+
+    def __delitem__(self, key):
+        self._keys.remove(key)
+        self._shards.pop(key, None)
+        self._last_used.pop(key, None)
+        self.dataio.delete(self.path(key))
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    @property
+    def loaded(self):
+        return len(self._shards)
+
+    def peek(self, key):
+        """Returns a shard without keeping it in memory
+
+        Meant for going through every key: a shard that wasn't loaded
+        is read as plain json and dropped afterwards, so changes made
+        to it are not saved"""
+        shard = self._shards.get(key)
+        if shard is not None:
+            return shard
+        if key not in self._keys:
+            raise KeyError(key)
+        return self.dataio.load_json(self.path(key))
+
+    def path(self, key):
+        return os.path.join(self.folder, quote(str(key), safe="") + ".json")
+
+    def save(self):
+        """Saves the loaded shards that have changed"""
+        for key, shard in self._shards.items():
+            if not isinstance(shard, Tracked) or shard.dirty:
+                self.dataio.mark_dirty(self.path(key), shard)
+
+    def evict_idle(self):
+        """Saves and drops the shards that haven't been used recently"""
+        now = time.monotonic()
+        self._last_sweep = now
+        for key, last_used in list(self._last_used.items()):
+            if now - last_used > self.idle_timeout:
+                shard = self._shards.pop(key)
+                del self._last_used[key]
+                if not isinstance(shard, Tracked) or shard.dirty:
+                    self.dataio.mark_dirty(self.path(key), shard)
+                self.evicted += 1
+
+    def _touch(self, key):
+        now = time.monotonic()
+        self._last_used[key] = now
+        if now - self._last_sweep > min(self.idle_timeout, 60):
+            self.evict_idle()
+
 class DataIO():
+    FSYNC_POLICIES = ("none", "file", "dir")
+
     def __init__(self):
         self.logger = logging.getLogger("red")
+        self.write_behind = WriteBehind(self)
+        self.read_cache = ReadCache()
+        self.fsync = "none"
+        self.engine = None
+        self.shard_idle_timeout = 3600
+        self.skipped_saves = 0
+        self._executor = None
+        self._readers = None
+        self._write_lock = threading.RLock()
+        self._writes = {}  # filename: (token, future, changed)
+        self._recorders = []  # Sets of files written, see record_writes
+        # Called as listener(filename, changed) after every save. changed
+        # is the set of top-level keys saved, or None if it's unknown
+        self.save_listeners = []
+
+    def use_engine(self, engine):
+        """Stores the files the engine handles through it instead
+        of the filesystem. Passing None goes back to plain files"""
+        self.flush()
+        self.engine = engine
 
     def save_json(self, filename, data):
-        """Atomically saves json file"""
-        rnd = randint(1000, 9999)
-        path, ext = os.path.splitext(filename)
-        tmp_file = "{}-{}.tmp".format(path, rnd)
-        self._save_json(tmp_file, data)
+        """Atomically saves json file
+
+        The data is serialized and verified in memory, then written to
+        a uniquely named tmp file that replaces the original one.
+        Depending on the fsync policy the tmp file ("file") and its
+        directory ("dir") are flushed to disk as well
+
+        Tracked data that hasn't changed since it was loaded or last
+        saved is not saved again"""
+        self._wait_async(filename)
+        changed = None
+        if isinstance(data, Tracked):
+            if not data.dirty:
+                self.skipped_saves += 1
+                return True
+            if not data.changes.everything:
+                changed = frozenset(data.changes.keys)
+        with self._write_lock, SAVE_TIME.time():
+            saved = self._write_json(filename, data, changed)
+        if saved:
+            if isinstance(data, Tracked):
+                data.mark_clean()
+            for listener in self.save_listeners:
+                listener(filename, changed)
+        return saved
+
+    def save_json_async(self, filename, data):
+        """Saves json file in a background thread
+
+        The data is copied before returning, so it can be changed right
+        away. Saves run one at a time in the order they are made, and
+        a save that is still waiting is dropped if a newer one of the
+        same file comes in. Returns a future with the result save_json
+        would have returned, which doesn't need to be awaited"""
+        loop = asyncio.get_event_loop()
+        changed = None
+        if isinstance(data, Tracked):
+            if not data.dirty:
+                self.skipped_saves += 1
+                future = asyncio.Future(loop=loop)
+                future.set_result(True)
+                return future
+            if not data.changes.everything:
+                changed = frozenset(data.changes.keys)
+            data.mark_clean()
+        snapshot = pickle.loads(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+
+        previous = self._writes.get(filename)
+        if previous is not None and not previous[1].done():
+            # The previous save may get dropped, this one has to cover it
+            if changed is not None and previous[2] is not None:
+                changed = changed | previous[2]
+            else:
+                changed = None
+        token = object()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        # Registered before the worker can look for it
+        future = ConcurrentFuture()
+        self._writes[filename] = (token, future, changed)
+        self._executor.submit(self._run_write, future, filename, snapshot,
+                              changed, token)
+        result = asyncio.Future(loop=loop)
+        future = asyncio.wrap_future(future, loop=loop)
+        future.add_done_callback(partial(self._async_done, filename, data,
+                                         changed, token, result))
+        return result
+
+    def in_loop(self):
+        """Whether it's called from within the running event loop"""
         try:
-            self._read_json(tmp_file)
-        except json.decoder.JSONDecodeError:
-            self.logger.exception("Attempted to write file {} but JSON "
-                                  "integrity check on tmp file has failed. "
-                                  "The original file is unaltered."
+            loop = asyncio.get_event_loop()
+        except RuntimeError:  # Not in the main thread
+            return False
+        return loop.is_running()
+
+    def _run_write(self, future, *args):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = self._write_async(*args)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def _write_async(self, filename, data, changed, token):
+        """Returns whether the save succeeded and if it was written"""
+        if self._writes.get(filename, (None,))[0] is not token:
+            return True, False  # A newer save of this file is queued
+        try:
+            with self._write_lock, SAVE_TIME.time():
+                return self._write_json(filename, data, changed), True
+        except Exception:
+            self.logger.exception("Background save of {} has failed"
                                   "".format(filename))
+            return False, False
+
+    def _async_done(self, filename, data, changed, token, result, future):
+        if self._writes.get(filename, (None,))[0] is token:
+            del self._writes[filename]
+        saved, written = future.result()
+        if not saved and isinstance(data, Tracked):
+            data.changes.add()  # Saved again on the next save
+        if written and saved:
+            for listener in self.save_listeners:
+                listener(filename, changed)
+        if not result.cancelled():
+            result.set_result(saved)
+
+    def _wait_async(self, filename=None):
+        """Blocks until the background saves of filename are done"""
+        if filename is None:
+            writes = list(self._writes.values())
+        else:
+            writes = [self._writes.get(filename)]
+        for write in writes:
+            if write is not None:
+                write[1].result()
+
+    def _write_json(self, filename, data, changed):
+        self._record(filename)
+        engine = self._engine_for(filename)
+        if engine is not None:
+            return engine.save(filename, data, changed=changed)
+        buffer = self._encode_json(data)
+        text = buffer.decode("utf-8")
+        try:
+            json.loads(text)
+        except ValueError:
+            self.logger.exception("Attempted to write file {} but JSON "
+                                  "integrity check on the serialized data "
+                                  "has failed. The original file is "
+                                  "unaltered.".format(filename))
             return False
-        os.replace(tmp_file, filename)
+        self._write_text(filename, text, buffer)
         return True
 
+    def _write_text(self, filename, text, buffer=None):
+        """Atomically replaces filename, returns its new cache entry"""
+        if buffer is None:
+            buffer = text.encode("utf-8")
+        path, ext = os.path.splitext(filename)
+        tmp_file = "{}-{}.tmp".format(path, uuid4().hex)
+        try:
+            with open(tmp_file, mode="xb") as f:
+                f.write(buffer)
+                if self.fsync != "none":
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_file, filename)
+        except:
+            self.read_cache.discard(filename)
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+            raise
+        if self.fsync == "dir":
+            self._fsync_dir(os.path.dirname(filename))
+        return self.read_cache.put(filename, text, valid=True)
+
+    def mark_dirty(self, filename, data):
+        """Schedules json file to be saved
+
+        Repeated saves of the same file are coalesced if write-behind
+        is enabled, otherwise the file is saved right away"""
+        return self.write_behind.mark(filename, data)
+
+    def flush(self):
+        """Saves every file that has been marked as dirty and waits
+        for the background saves to be done"""
+        self.write_behind.flush()
+        self._wait_async()
+
+    @contextmanager
+    def quiesce(self, flush=True):
+        """Saves every pending file, then holds off any other write
+        until the with block is exited
+
+        Pass flush=False outside of the event loop's thread: the files
+        marked as dirty are left alone, only the background saves
+        already queued are waited for"""
+        if flush:
+            self.flush()
+        else:
+            self._wait_async()
+        with self._write_lock:
+            yield
+
+    @contextmanager
+    def record_writes(self):
+        """Collects the names of the files written or deleted while in
+        the with block, journals included, into the set it yields"""
+        written = set()
+        with self._write_lock:
+            self._recorders.append(written)
+        try:
+            yield written
+        finally:
+            with self._write_lock:
+                self._recorders.remove(written)
+
+    def _record(self, filename):
+        # Called with the write lock held, so a write is recorded before
+        # anyone else can acquire it
+        for written in self._recorders:
+            written.add(filename)
+
+    def load_journaled(self, filename, **kwargs):
+        """Loads json file as a JournaledDocument
+
+        Changes made to the returned document are saved on their own,
+        appending them to a journal"""
+        self.write_behind.flush(filename)
+        return JournaledDocument(self, filename, **kwargs)
+
+    def load_tracked(self, filename, default_factory=None):
+        """Loads json file into tracked dicts and lists
+
+        Saving the returned data is skipped if it hasn't been changed.
+        default_factory works like defaultdict's"""
+        return track(self.load_json(filename), default_factory)
+
+    def load_sharded(self, folder, legacy=None, **kwargs):
+        """Loads a folder of per-key json files as a ShardedDocument
+
+        If the single json file legacy exists it's split into the
+        folder first (see shard_json)"""
+        if legacy is not None and self.exists(legacy):
+            self.shard_json(legacy, folder)
+        return ShardedDocument(self, folder, **kwargs)
+
+    def shard_json(self, filename, folder):
+        """Splits a json object into one file per top-level key
+
+        A copy of the original file is kept as <filename>.bak"""
+        data = self.load_json(filename)
+        if self._engine_for(os.path.join(folder, "_.json")) is None:
+            os.makedirs(folder, exist_ok=True)
+        for key, value in data.items():
+            name = quote(str(key), safe="") + ".json"
+            self.save_json(os.path.join(folder, name), value)
+        with open(filename + ".bak", mode="wb") as f:
+            f.write(self._encode_json(data))
+        self.delete(filename)
+        self.logger.info("Split {} into {} files in {}"
+                         "".format(filename, len(data), folder))
+
+    def list_json(self, folder):
+        """Returns the names of the json files in folder"""
+        engine = self._engine_for(os.path.join(folder, "_.json"))
+        if engine is not None:
+            folder = os.path.normpath(folder).replace(os.sep, "/")
+            return [p.rsplit("/", 1)[1] for p in engine.paths()
+                    if p.rsplit("/", 1)[0] == folder]
+        if not os.path.isdir(folder):
+            return []
+        return [n for n in os.listdir(folder) if n.endswith(".json") and
+                os.path.isfile(os.path.join(folder, n))]
+
+    def delete(self, filename):
+        """Deletes json file, dropping its pending save if any"""
+        self.write_behind.discard(filename)
+        self._wait_async(filename)
+        self.read_cache.discard(filename)
+        engine = self._engine_for(filename)
+        with self._write_lock:
+            self._record(filename)
+            if engine is not None:
+                return engine.delete(filename)
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+
+    def preload(self, filenames):
+        """Reads and validates json files in background threads, so
+        that loading them afterwards is served from the read cache
+
+        Returns a future per file. Files that don't exist or are kept
+        by the storage engine are skipped"""
+        if self._readers is None:
+            self._readers = ThreadPoolExecutor(max_workers=4)
+        return [self._readers.submit(self._preload, filename)
+                for filename in filenames
+                if self._engine_for(filename) is None]
+
+    def _preload(self, filename):
+        try:
+            self.read_cache.read(filename).parse(keep=True)
+        except (FileNotFoundError, ValueError):
+            pass
+
     def load_json(self, filename):
         """Loads json file"""
+        self.write_behind.flush(filename)
+        self._wait_async(filename)
+        engine = self._engine_for(filename)
+        if engine is not None:
+            return engine.load(filename)
         return self._read_json(filename)
 
     def is_valid_json(self, filename):
         """Verifies if json file exists / is readable"""
+        self._wait_async(filename)
+        engine = self._engine_for(filename)
+        if engine is not None:
+            return engine.exists(filename)
         try:
-            self._read_json(filename)
-            return True
+            entry = self.read_cache.read(filename)
+            if entry.valid is None:
+                entry.parse(keep=True)
+            return entry.valid
         except FileNotFoundError:
             return False
         except json.decoder.JSONDecodeError:
             return False
 
+    def exists(self, filename):
+        """Verifies if json file exists, without reading it"""
+        engine = self._engine_for(filename)
+        if engine is not None:
+            return engine.exists(filename)
+        return os.path.isfile(filename)
+
+    def get_value(self, filename, key):
+        """Returns a single top-level key of a json file
+
+        Only the key's value is parsed, the file is scanned up to where
+        the key is found and the offsets are kept for later calls"""
+        self.write_behind.flush(filename)
+        self._wait_async(filename)
+        engine = self._engine_for(filename)
+        if engine is not None:
+            return engine.get_value(filename, key)
+        entry = self.read_cache.read(filename)
+        try:
+            return entry.key_index().get(key)
+        except ValueError:  # Let json explain what's wrong with it
+            return entry.parse()[key]
+
+    def set_value(self, filename, key, value):
+        """Sets a single top-level key of a json file
+
+        The new value is spliced into the file's text instead of
+        decoding and encoding the whole document again"""
+        self.write_behind.flush(filename)
+        self._wait_async(filename)
+        engine = self._engine_for(filename)
+        if engine is not None:
+            with self._write_lock:
+                self._record(filename)
+                return engine.set_value(filename, key, value)
+        entry = self.read_cache.read(filename)
+        encoded = self._encode_json(value).decode("utf-8")
+        if not isinstance(key, str):
+            key = json.dumps(key)  # Stored as json.dumps would store it
+        try:
+            json.loads(encoded)
+            index = entry.key_index().replace(key,
+                                              encoded.replace("\n", "\n    "))
+        except ValueError:
+            data = entry.parse()
+            data[key] = value
+            return self.save_json(filename, data)
+        with self._write_lock:
+            self._record(filename)
+            self._write_text(filename, index.text).index = index
+        for listener in self.save_listeners:
+            listener(filename, frozenset((key,)))
+        return True
+
+    def _engine_for(self, filename):
+        if self.engine is not None and self.engine.handles(filename):
+            return self.engine
+        return None
+
     def _read_json(self, filename):
-        with open(filename, encoding='utf-8', mode="r") as f:
-            data = json.load(f)
-        return data
+        return self.read_cache.read(filename).parse()
+
+    def _encode_json(self, data):
+        return json.dumps(data, indent=4, sort_keys=True,
+                          separators=(',', ' : ')).encode("utf-8")
+
+    def _fsync_dir(self, path):
+        try:
+            fd = os.open(path or ".", os.O_RDONLY)
+        except OSError:  # Directories can't be opened on Windows
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
 
     def _save_json(self, filename, data):
         with open(filename, encoding='utf-8', mode="w") as f:
@@ -65,15 +937,20 @@ class DataIO():
                 " parameters")
 
 def get_value(filename, key):
-    with open(filename, encoding='utf-8', mode="r") as f:
-        data = json.load(f)
-    return data[key]
+    return dataIO.get_value(filename, key)
 
 def set_value(filename, key, value):
-    data = fileIO(filename, "load")
-    data[key] = value
-    fileIO(filename, "save", data)
+    dataIO.set_value(filename, key, value)
     return True
 
 dataIO = DataIO()
 fileIO = dataIO._legacy_fileio # backwards compatibility
+metrics.counter("red_data_cache_hits_total",
+                "Data files read from the read cache",
+                func=lambda: dataIO.read_cache.hits)
+metrics.counter("red_data_cache_misses_total",
+                "Data files read from disk",
+                func=lambda: dataIO.read_cache.misses)
+metrics.counter("red_data_skipped_saves_total",
+                "Saves of tracked data that hadn't changed",
+                func=lambda: dataIO.skipped_saves)
@@ -0,0 +1,44 @@
+import argparse
+import asyncio
+import logging
+
+#
+# Picks the event loop implementation Red runs on, before anything
+# creates a loop. uvloop is optional and isn't available on Windows:
+#   pip install uvloop
+#   python red.py --loop uvloop
+#
+
+log = logging.getLogger("red")
+
+LOOPS = ("asyncio", "uvloop")
+
+
+def requested_loop(argv=None):
+    """The --loop passed on the command line, read ahead of the rest of
+    the arguments since the loop has to exist before the bot"""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--loop", choices=LOOPS, default="asyncio")
+    args, _ = parser.parse_known_args(argv)
+    return args.loop
+
+
+def use_loop(name):
+    """Makes name the event loop implementation and returns a new loop
+    of it, set as the current one"""
+    if name == "uvloop":
+        try:
+            import uvloop
+        except ImportError:
+            raise RuntimeError("uvloop is not installed. Install it with "
+                               "pip install uvloop, or use --loop asyncio")
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    elif name == "asyncio":
+        asyncio.set_event_loop_policy(None)
+    else:
+        raise ValueError("Unknown event loop {!r}, choose one of {}"
+                         "".format(name, ", ".join(LOOPS)))
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    log.debug("Using the {} event loop".format(name))
+    return loop
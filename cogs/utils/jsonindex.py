@@ -0,0 +1,159 @@
+import json
+import re
+from json.decoder import scanstring
+
+#
+# Finds the top-level keys of a json object in its text without parsing
+# the values, so a single key can be read or replaced without decoding
+# and re-encoding the whole document.
+#
+
+WHITESPACE = re.compile(r"\s*")
+STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+STRUCTURE = re.compile(r'[\[\]{}"]')
+SCALAR = re.compile(r"[^\s,\]}]+")
+
+
+def skip_value(text, idx):
+    """Returns the index right after the json value starting at idx"""
+    c = text[idx:idx + 1]
+    if c == '"':
+        m = STRING.match(text, idx)
+        if m is None:
+            raise ValueError("Unterminated string at {}".format(idx))
+        return m.end()
+    if c not in ("{", "["):
+        m = SCALAR.match(text, idx)
+        if m is None:
+            raise ValueError("Expected a value at {}".format(idx))
+        return m.end()
+
+    depth = 0
+    while True:
+        m = STRUCTURE.search(text, idx)
+        if m is None:
+            raise ValueError("Unterminated value")
+        c = m.group()
+        if c == '"':
+            s = STRING.match(text, m.start())
+            if s is None:
+                raise ValueError("Unterminated string at {}".format(idx))
+            idx = s.end()
+            continue
+        idx = m.end()
+        if c in ("{", "["):
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return idx
+
+
+def scan_keys(text):
+    """Yields (key, key_start, value_start, value_end) for every
+    top-level key of the json object in text, in order"""
+    idx = WHITESPACE.match(text).end()
+    if text[idx:idx + 1] != "{":
+        raise ValueError("Not a json object")
+    idx = WHITESPACE.match(text, idx + 1).end()
+    if text[idx:idx + 1] == "}":
+        return
+    while True:
+        if text[idx:idx + 1] != '"':
+            raise ValueError("Expected a key at {}".format(idx))
+        key_start = idx
+        key, idx = scanstring(text, idx + 1)
+        idx = WHITESPACE.match(text, idx).end()
+        if text[idx:idx + 1] != ":":
+            raise ValueError("Expected ':' at {}".format(idx))
+        start = WHITESPACE.match(text, idx + 1).end()
+        end = skip_value(text, start)
+        yield key, key_start, start, end
+        idx = WHITESPACE.match(text, end).end()
+        c = text[idx:idx + 1]
+        if c == "}":
+            return
+        if c != ",":
+            raise ValueError("Expected ',' or '}}' at {}".format(idx))
+        idx = WHITESPACE.match(text, idx + 1).end()
+
+
+class KeyIndex:
+    """Offsets of the top-level keys of a json object's text
+
+    The text is only scanned as far as needed to find the key being
+    looked up, the rest is scanned on later lookups. Unlike json.loads
+    the first occurrence of a duplicated key is the one used."""
+
+    def __init__(self, text, spans=None):
+        self.text = text
+        if spans is None:
+            self._spans = {}
+            self._scanner = scan_keys(text)
+        else:
+            self._spans = spans
+            self._scanner = None
+
+    @property
+    def complete(self):
+        return self._scanner is None
+
+    def span(self, key):
+        """Returns (key_start, value_start, value_end) of key or None"""
+        span = self._spans.get(key)
+        while span is None and self._scanner is not None:
+            try:
+                k, *span = next(self._scanner)
+            except StopIteration:
+                self._scanner = None
+                return None
+            self._spans.setdefault(k, span)
+            if k != key:
+                span = None
+        return span
+
+    def scan_all(self):
+        if self._scanner is not None:
+            for k, *span in self._scanner:
+                self._spans.setdefault(k, span)
+            self._scanner = None
+
+    def get(self, key):
+        span = self.span(key)
+        if span is None:
+            raise KeyError(key)
+        return json.loads(self.text[span[1]:span[2]])
+
+    def replace(self, key, value):
+        """Returns a new KeyIndex of the text with key set to value
+
+        value is the already encoded json. Keys are kept sorted when
+        a new one is inserted"""
+        self.scan_all()
+        text = self.text
+        span = self._spans.get(key)
+        if span is not None:
+            start, end = span[1], span[2]
+            new_text = text[:start] + value + text[end:]
+            shift = len(value) - (end - start)
+            spans = {}
+            for k, (ks, vs, ve) in self._spans.items():
+                if ks > start:
+                    spans[k] = [ks + shift, vs + shift, ve + shift]
+                else:
+                    spans[k] = [ks, vs, ve]
+            spans[key] = [span[0], start, start + len(value)]
+            return KeyIndex(new_text, spans)
+
+        if not self._spans:
+            return KeyIndex("{{\n    {} : {}\n}}".format(json.dumps(key),
+                                                         value))
+        entry = "{} : {}".format(json.dumps(key), value)
+        following = [s for k, s in self._spans.items() if k > key]
+        if following:
+            at = min(s[0] for s in following)
+            insert = entry + ",\n    "
+        else:
+            at = max(s[2] for s in self._spans.values())
+            insert = ",\n    " + entry
+        return KeyIndex(text[:at] + insert + text[at:])
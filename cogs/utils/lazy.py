@@ -0,0 +1,263 @@
+import asyncio
+import inspect
+import logging
+import os
+import sys
+
+from discord.ext import commands
+
+from .dataIO import dataIO
+
+#
+# Lets cogs be loaded the first time they're needed rather than at boot.
+#
+# When a cog is loaded the commands, event listeners and message pipeline
+# subscriptions it registers are written down in a manifest. On the next
+# boots a lazy cog isn't imported, stubs of them are registered from the
+# manifest instead. The first time one of them is invoked the cog is
+# loaded and the message (or event) is handed over to it.
+#
+# Stubs get the same checks as the commands they stand in for, so only
+# who could use a command can get its cog loaded. Checks that aren't
+# made by cogs/utils/checks.py can't be written down: commands with
+# those can only be used by the owner until their cog is loaded.
+#
+# A cog module can list events that don't need it to be loaded, because
+# its listeners ignore them until one of its commands has been used:
+#   LAZY_IGNORED_EVENTS = ("on_voice_state_update",)
+#
+
+log = logging.getLogger("red")
+
+MANIFEST_PATH = "data/red/cog_manifest.json"
+MANIFEST_VERSION = 2  # Entries written with another version are stale
+
+
+class CommandManifest:
+    """The commands, event listeners and message subscriptions of every
+    cog that has been loaded, kept until the cog's file changes"""
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            try:
+                self._data = dataIO.load_json(self.path)
+            except (FileNotFoundError, ValueError):
+                self._data = {}
+        return self._data
+
+    def get(self, extension):
+        """Returns the entry of extension, or None if it's missing or
+        the cog's file has changed since"""
+        entry = self.data.get(extension)
+        if (entry is None or entry.get("version") != MANIFEST_VERSION or
+                entry["signature"] != _signature(extension)):
+            return None
+        return entry
+
+    @staticmethod
+    def snapshot(bot):
+        """What's registered on the bot, to pass to record"""
+        return (set(bot.commands.values()),
+                {name: list(funcs) for name, funcs in
+                 bot.extra_events.items()},
+                list(bot.pipeline.subscriptions))
+
+    def record(self, bot, extension, before):
+        """Writes down what was registered on the bot since before"""
+        old_commands, old_events, old_subscriptions = before
+        module = sys.modules.get(extension)
+        ignored = getattr(module, "LAZY_IGNORED_EVENTS", ())
+        new_commands = set(bot.commands.values()) - old_commands
+        events = sorted(name for name, funcs in bot.extra_events.items()
+                        if name not in ignored and
+                        any(f not in old_events.get(name, ())
+                            for f in funcs))
+        messages = []
+        for sub in bot.pipeline.subscriptions:
+            filters = {"prefixed": sub.prefixed,
+                       "server_only": sub.server_only}
+            if sub not in old_subscriptions and filters not in messages:
+                messages.append(filters)
+        entry = {"version": MANIFEST_VERSION,
+                 "signature": _signature(extension),
+                 "commands": [_describe(c) for c in
+                              sorted(new_commands, key=lambda c: c.name)],
+                 "events": events,
+                 "messages": messages}
+        if self.data.get(extension) != entry:
+            self.data[extension] = entry
+            dataIO.save_json(self.path, self.data)
+
+
+class LazyCog:
+    """Stands in for a cog that hasn't been loaded yet"""
+
+    def __init__(self, bot, extension, entry):
+        self.bot = bot
+        self.extension = extension
+        self.entry = entry
+        self.commands = []
+        self.listeners = []
+        self.subscribers = []
+        self._loading = None
+
+    def install(self):
+        instances = {}
+        for info in self.entry["commands"]:
+            name = info["cog"] or "LazyCog"
+            if name not in instances:
+                # Help lists the stubs under the cog's own name
+                instances[name] = type(name, (LazyStub,), {})(self)
+            command = _make_stub(info, instances[name])
+            self.bot.add_command(command)
+            self.commands.append(command)
+        for event in self.entry["events"]:
+            listener = self._make_listener(event)
+            self.bot.add_listener(listener, event)
+            self.listeners.append((listener, event))
+        for filters in self.entry.get("messages", ()):
+            subscriber = self._make_subscriber()
+            self.bot.pipeline.subscribe(subscriber, **filters)
+            self.subscribers.append(subscriber)
+
+    def uninstall(self):
+        for command in self.commands:
+            if self.bot.commands.get(command.name) is command:
+                self.bot.remove_command(command.name)
+        for listener, event in self.listeners:
+            self.bot.remove_listener(listener, event)
+        for subscriber in self.subscribers:
+            self.bot.pipeline.unsubscribe(subscriber)
+        self.commands.clear()
+        self.listeners.clear()
+        self.subscribers.clear()
+
+    def ensure_loaded(self):
+        """Loads the real cog in its place, once"""
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(self._load())
+        return self._loading
+
+    async def _load(self):
+        log.info("Loading {} on first use".format(self.extension))
+        owner = self.bot.get_cog("Owner")
+        owner._load_cog(self.extension)  # Removes the stubs
+        await owner.disable_commands()
+
+    def _make_listener(self, event):
+        async def listener(*args, **kwargs):
+            await self.ensure_loaded()
+            # The stubs and the real listeners are never registered at
+            # the same time, so the real ones missed this event
+            module = sys.modules.get(self.extension)
+            for func in list(self.bot.extra_events.get(event, ())):
+                if inspect.getmodule(func) is module:
+                    asyncio.ensure_future(func(*args, **kwargs))
+        return listener
+
+    def _make_subscriber(self):
+        async def subscriber(ctx):
+            await self.ensure_loaded()
+            pipeline = self.bot.pipeline
+            module = sys.modules.get(self.extension)
+            pipeline.deliver(ctx, [s for s in pipeline.subscriptions
+                                   if inspect.getmodule(s.callback) is
+                                   module])
+        return subscriber
+
+
+class LazyStub:
+    """Instance of the stub commands, named after the cog"""
+
+    def __init__(self, lazy_cog):
+        self.lazy_cog = lazy_cog
+
+
+async def _invoke_stub(stub, ctx, *, args=None):
+    await stub.lazy_cog.ensure_loaded()
+    # Processed again, this time by the real command
+    await ctx.bot.process_commands(ctx.message)
+
+
+async def _invoke_group_stub(stub, ctx):
+    # Takes no arguments, they would swallow the subcommand's name
+    if ctx.invoked_subcommand is None:  # Otherwise the subcommand's stub
+        await _invoke_stub(stub, ctx)   # takes care of it
+
+
+def _describe(command):
+    """What's needed to make a stub of command, subcommands included"""
+    info = {"name": command.name,
+            "aliases": list(command.aliases),
+            "help": command.help,
+            "brief": command.brief,
+            "hidden": command.hidden,
+            "cog": command.cog_name,
+            "no_pm": command.no_pm,
+            "checks": [list(getattr(c, "recipe", ("is_owner", {})))
+                       for c in command.checks]}
+    if isinstance(command, commands.GroupMixin):
+        info["subcommands"] = [_describe(c) for c in
+                               sorted(set(command.commands.values()),
+                                      key=lambda c: c.name)]
+    return info
+
+
+def _make_stub(info, instance):
+    from . import checks  # Needs the bot's settings to be set up
+
+    kwargs = dict(aliases=info["aliases"], help=info["help"],
+                  brief=info["brief"], hidden=info["hidden"],
+                  no_pm=info["no_pm"], pass_context=True)
+    if "subcommands" in info:
+        command = commands.Group(name=info["name"],
+                                 callback=_invoke_group_stub, **kwargs)
+        for sub in info["subcommands"]:
+            command.add_command(_make_stub(sub, instance))
+    else:
+        command = commands.Command(info["name"], _invoke_stub, **kwargs)
+    for name, perms in info["checks"]:
+        getattr(checks, name)(**perms)(command)
+    command.instance = instance
+    return command
+
+
+def install_stubs(bot, extension):
+    """Registers the stubs of extension in place of the real cog
+
+    Returns False if the cog has to be loaded instead, because it
+    has never been loaded or its file has changed since"""
+    entry = manifest.get(extension)
+    if entry is None:
+        return False
+    lazy_cog = LazyCog(bot, extension, entry)
+    lazy_cog.install()
+    stubs[extension] = lazy_cog
+    return True
+
+
+def remove_stubs(extension):
+    """Returns True if extension had stubs registered"""
+    lazy_cog = stubs.pop(extension, None)
+    if lazy_cog is None:
+        return False
+    lazy_cog.uninstall()
+    return True
+
+
+def _signature(extension):
+    path = extension.replace(".", os.sep) + ".py"
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+manifest = CommandManifest()
+stubs = {}  # Extension -> LazyCog of the cogs that haven't been loaded yet
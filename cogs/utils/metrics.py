@@ -0,0 +1,276 @@
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+#
+# Counters, gauges and latency histograms of Red and its cogs, which
+# --metrics-port serves in Prometheus' text format on localhost.
+#
+# Usage:
+#   from .utils.metrics import metrics
+#   WON = metrics.counter("red_trivia_games_total", "Trivia games played")
+#   WON.inc()
+#   # Worked out whenever the metrics are read
+#   metrics.gauge("red_audio_queued_songs", "Songs waiting to be played",
+#                 func=self._queued_songs)
+#   with metrics.histogram("red_x_seconds", "Time spent on x").time():
+#       x()
+#
+# Registering a metric again returns the existing one, with func replaced,
+# so reloaded cogs keep their counts. Cogs remove the metrics whose func
+# refers to them with metrics.unregister(name) when they're unloaded.
+# Counters without a func are saved when Red quits and restarts.
+#
+
+log = logging.getLogger("red")
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+                   5, 10)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), func=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Returns the value, or a dict of label values tuple: value
+        self.func = func
+        self._values = {}  # Label values tuple: value
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError("{} takes the labels {}".format(
+                self.name, ", ".join(self.labelnames) or "none"))
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def collect(self):
+        """Returns the samples of the metric as (suffix, labels, value)"""
+        if self.func is None:
+            values = self._values
+        else:
+            values = self.func()
+            if not isinstance(values, dict):
+                values = {(): values}
+        return [("", OrderedDict(zip(self.labelnames, key)), value)
+                for key, value in sorted(values.items())]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only go up")
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        counts = self._values.get(key)
+        if counts is None:
+            # One count per bucket, then the sum and the count
+            counts = self._values[key] = [0] * len(self.buckets) + [0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the seconds spent in the with block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def get(self, **labels):
+        """Returns the sum and the count of the observations"""
+        counts = self._values.get(self._key(labels))
+        return (counts[-2], counts[-1]) if counts else (0, 0)
+
+    def collect(self):
+        samples = []
+        for key, counts in sorted(self._values.items()):
+            labels = OrderedDict(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, counts):
+                samples.append(("_bucket", _with_le(labels, bound), count))
+            samples.append(("_bucket", _with_le(labels, math.inf),
+                            counts[-1]))
+            samples.append(("_sum", labels, counts[-2]))
+            samples.append(("_count", labels, counts[-1]))
+        return samples
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._metrics = OrderedDict()
+        self._saved = {}  # Counter name: values restored from a save
+
+    def counter(self, name, documentation, labelnames=(), func=None):
+        return self._register(Counter, name, documentation, labelnames,
+                              func=func)
+
+    def gauge(self, name, documentation, labelnames=(), func=None):
+        return self._register(Gauge, name, documentation, labelnames,
+                              func=func)
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames,
+                              buckets=buckets)
+
+    def unregister(self, name):
+        self._metrics.pop(name, None)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def _register(self, cls, name, documentation, labelnames, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is not None:
+            if type(metric) is not cls:
+                raise ValueError("{} is already registered as a {}"
+                                 "".format(name, metric.type))
+            if "func" in kwargs:
+                metric.func = kwargs["func"]
+            return metric
+        metric = cls(name, documentation, labelnames, **kwargs)
+        if cls is Counter and name in self._saved:
+            metric._values = {tuple(k): v for k, v in self._saved.pop(name)}
+        self._metrics[name] = metric
+        return metric
+
+    def render(self):
+        """Returns every metric in Prometheus' text format"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            try:
+                samples = metric.collect()
+            except Exception:
+                log.exception("Error collecting the metric {}"
+                              "".format(metric.name))
+                continue
+            lines.append("# HELP {} {}".format(
+                metric.name, _escape(metric.documentation, False)))
+            lines.append("# TYPE {} {}".format(metric.name, metric.type))
+            for suffix, labels, value in samples:
+                if labels:
+                    labels = "{" + ",".join(
+                        '{}="{}"'.format(k, _escape(v, True))
+                        for k, v in labels.items()) + "}"
+                else:
+                    labels = ""
+                lines.append("{}{}{} {}".format(metric.name, suffix, labels,
+                                                _format_value(value)))
+        return "\n".join(lines) + "\n"
+
+    def dump(self):
+        """The values of the counters that are kept across restarts"""
+        data = {name: [[list(k), v] for k, v in values]
+                for name, values in self._saved.items()}
+        for metric in self._metrics.values():
+            if isinstance(metric, Counter) and metric.func is None:
+                data[metric.name] = [[list(k), v]
+                                     for k, v in metric._values.items()]
+        return data
+
+    def restore(self, data):
+        """Adds the counts of dump's data to the counters, including the
+        ones that are registered later on"""
+        for name, values in data.items():
+            metric = self._metrics.get(name)
+            if isinstance(metric, Counter) and metric.func is None:
+                for key, value in values:
+                    key = tuple(key)
+                    metric._values[key] = metric._values.get(key, 0) + value
+            else:
+                self._saved[name] = values
+
+    async def serve(self, port, host="127.0.0.1"):
+        """Serves render's output over HTTP at /metrics"""
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 10)
+            while True:  # Skips the headers
+                line = await asyncio.wait_for(reader.readline(), 10)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[1].split("?")[0] == "/metrics":
+                status = "200 OK"
+                body = self.render().encode("utf-8")
+            else:
+                status = "404 Not Found"
+                body = b"Not found, try /metrics\n"
+            writer.write("HTTP/1.0 {}\r\n"
+                         "Content-Type: text/plain; version=0.0.4; "
+                         "charset=utf-8\r\n"
+                         "Content-Length: {}\r\n\r\n"
+                         "".format(status, len(body)).encode("latin-1"))
+            writer.write(body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def _with_le(labels, bound):
+    labels = OrderedDict(labels)
+    labels["le"] = bound
+    return labels
+
+
+def _escape(text, quoted):
+    text = str(text) if not isinstance(text, float) else _format_value(text)
+    text = text.replace("\\", "\\\\").replace("\n", "\\n")
+    if quoted:
+        text = text.replace('"', '\\"')
+    return text
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+metrics = MetricsRegistry()
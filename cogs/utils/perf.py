@@ -0,0 +1,156 @@
+import logging
+import math
+from collections import OrderedDict, deque
+
+from .metrics import metrics
+
+#
+# How long commands take, from the moment their message is received to
+# the end of their callback, checks and converters included.
+#
+# Latencies are kept in sketches: histograms whose buckets grow by 2%,
+# so percentiles are within 2% of the exact value while a command takes
+# at most a few hundred buckets however many times it's used.
+#
+
+log = logging.getLogger("red")
+
+COMMAND_TIME = metrics.histogram("red_command_seconds",
+                                 "Time from receiving a command's message "
+                                 "to the end of the command", ("command",))
+COMMAND_ERRORS = metrics.counter("red_command_errors_total",
+                                 "Commands that ended with an error",
+                                 ("command",))
+
+
+class LatencySketch:
+    __slots__ = ("buckets", "count", "total", "max")
+
+    GROWTH = 1.02
+    SMALLEST = 1e-5  # Seconds, anything faster is counted as this
+
+    def __init__(self):
+        self.buckets = {}  # Index: count
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        index = math.ceil(math.log(max(seconds, self.SMALLEST) /
+                                   self.SMALLEST, self.GROWTH))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """The latency under which q (0 to 1) of the samples are"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                # Middle of the bucket, its bounds are GROWTH apart
+                value = self.SMALLEST * self.GROWTH ** (index - 0.5)
+                return min(value, self.max)
+        return self.max
+
+
+class CommandStats:
+    __slots__ = ("latency", "errors")
+
+    def __init__(self):
+        self.latency = LatencySketch()
+        self.errors = 0
+
+    @property
+    def calls(self):
+        return self.latency.count
+
+    def as_dict(self):
+        latency = self.latency
+        return {"calls": self.calls,
+                "errors": self.errors,
+                "error_rate": self.errors / self.calls if self.calls else 0.0,
+                "p50_ms": latency.quantile(0.5) * 1000,
+                "p95_ms": latency.quantile(0.95) * 1000,
+                "p99_ms": latency.quantile(0.99) * 1000,
+                "max_ms": latency.max * 1000}
+
+
+class CommandProfiler:
+
+    def __init__(self, slow_threshold=0, max_server_stats=5000):
+        self.slow_threshold = slow_threshold  # Seconds, 0 disables the log
+        self.commands = {}  # Qualified name: CommandStats
+        # (qualified name, server id): CommandStats, least recently used
+        # first. Private messages are under the server id None
+        self.servers = OrderedDict()
+        self.max_server_stats = max_server_stats
+        self.slow = deque(maxlen=20)  # Last slow commands
+
+    def record(self, name, message, elapsed, failed=False):
+        stats = self.commands.get(name)
+        if stats is None:
+            stats = self.commands[name] = CommandStats()
+        server_id = message.server.id if message.server else None
+        key = (name, server_id)
+        server_stats = self.servers.pop(key, None)
+        if server_stats is None:
+            server_stats = CommandStats()
+            if len(self.servers) >= self.max_server_stats:
+                self.servers.popitem(last=False)
+        self.servers[key] = server_stats
+
+        for s in (stats, server_stats):
+            s.latency.add(elapsed)
+            if failed:
+                s.errors += 1
+        COMMAND_TIME.observe(elapsed, command=name)
+        if failed:
+            COMMAND_ERRORS.inc(command=name)
+
+        if self.slow_threshold and elapsed >= self.slow_threshold:
+            self.slow.append((name, message, elapsed))
+            log.warning("Slow command: {} took {:.0f}ms (server {}, "
+                        "channel {}, message {!r})".format(
+                            name, elapsed * 1000, server_id,
+                            message.channel.id, message.content[:100]))
+
+    def by_server(self, name):
+        """The stats of command name in every server it was used in"""
+        return {sid: stats for (n, sid), stats in self.servers.items()
+                if n == name}
+
+    def reset(self):
+        self.commands.clear()
+        self.servers.clear()
+        self.slow.clear()
+
+
+def invoked_name(ctx):
+    """The qualified name of the command ctx invoked, down to the
+    subcommand"""
+    command = ctx.command
+    words = ctx.message.content[len(ctx.prefix):].split()[1:]
+    for word in words:
+        subcommands = getattr(command, "commands", None)
+        if not subcommands or word not in subcommands:
+            break
+        command = subcommands[word]
+    return command.qualified_name
+
+
+def format_stats(rows, label):
+    """Formats (label, CommandStats) rows as a table"""
+    width = max([len(str(r[0])) for r in rows] + [len(label)])
+    lines = ["{:<{}} {:>7} {:>5} {:>8} {:>8} {:>8}".format(
+        label, width, "calls", "err%", "p50 ms", "p95 ms", "p99 ms")]
+    for name, stats in rows:
+        s = stats.as_dict()
+        lines.append("{:<{}} {:>7} {:>5.1f} {:>8.1f} {:>8.1f} {:>8.1f}".format(
+            str(name), width, s["calls"], s["error_rate"] * 100,
+            s["p50_ms"], s["p95_ms"], s["p99_ms"]))
+    return "\n".join(lines)
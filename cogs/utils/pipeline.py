@@ -0,0 +1,138 @@
+import asyncio
+import logging
+
+#
+# Hands every message to the cogs that can act on it, along with what's
+# commonly derived from it, worked out once for all of them.
+#
+# Usage:
+#   # Every message sent in a server that starts with a prefix
+#   self.bot.pipeline.subscribe(self.on_prefixed, prefixed=True,
+#                               server_only=True)
+#   # Only the messages of one channel, e.g. while a game runs in it
+#   self.bot.pipeline.subscribe(self.on_answer, channel=channel.id)
+#   self.bot.pipeline.unsubscribe(self.on_answer, channel=channel.id)
+#
+# Callbacks are coroutine functions taking a MessageContext. Cogs
+# unsubscribe their callbacks when they're unloaded.
+#
+
+log = logging.getLogger("red")
+
+
+class MessageContext:
+    """A message and what's derived from it, computed on first use"""
+
+    def __init__(self, bot, message):
+        self.bot = bot
+        self.message = message
+        self.author = message.author
+        self.channel = message.channel
+        self.server = message.server
+        self.content = message.content
+        self.is_private = message.channel.is_private
+        self._prefix = False  # Not looked up yet, None is no prefix
+        self._allowed = None
+        self._lowered = None
+
+    @property
+    def prefix(self):
+        """The prefix the message starts with, or None"""
+        if self._prefix is False:
+            self._prefix = self.bot.settings.get_matched_prefix(self.message)
+        return self._prefix
+
+    @property
+    def invoked(self):
+        """The content after the prefix, or None without one"""
+        prefix = self.prefix
+        return self.content[len(prefix):] if prefix is not None else None
+
+    @property
+    def lowered(self):
+        """The content in lowercase, for case insensitive matching"""
+        if self._lowered is None:
+            self._lowered = self.content.lower()
+        return self._lowered
+
+    @property
+    def allowed(self):
+        """Whether the author is allowed to use Red here (user_allowed)"""
+        if self._allowed is None:
+            self._allowed = self.bot.user_allowed(self.message)
+        return self._allowed
+
+
+class Subscription:
+    __slots__ = ("callback", "channel", "prefixed", "server_only")
+
+    def __init__(self, callback, channel=None, prefixed=False,
+                 server_only=False):
+        self.callback = callback
+        self.channel = channel
+        self.prefixed = prefixed
+        self.server_only = server_only
+
+    def matches(self, ctx):
+        if self.channel is not None and self.channel != ctx.channel.id:
+            return False
+        if self.server_only and ctx.is_private:
+            return False
+        if self.prefixed and ctx.prefix is None:
+            return False
+        return True
+
+
+class MessagePipeline:
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.subscriptions = []
+        self._channels = {}  # Channel id: subscriptions scoped to it
+        self.delivered = 0
+
+    def subscribe(self, callback, channel=None, prefixed=False,
+                  server_only=False):
+        """Calls callback with the context of every message that
+        matches: sent in channel (an id) if given, that starts with a
+        prefix if prefixed, that isn't a private message if server_only"""
+        sub = Subscription(callback, channel, prefixed, server_only)
+        if channel is None:
+            self.subscriptions.append(sub)
+        else:
+            self._channels.setdefault(channel, []).append(sub)
+        return sub
+
+    def unsubscribe(self, callback, channel=None):
+        """Removes the subscriptions of callback, only the one scoped to
+        channel if given"""
+        self.subscriptions = [s for s in self.subscriptions
+                              if s.callback != callback]
+        channels = [channel] if channel is not None else list(self._channels)
+        for channel in channels:
+            subs = [s for s in self._channels.get(channel, ())
+                    if s.callback != callback]
+            if subs:
+                self._channels[channel] = subs
+            else:
+                self._channels.pop(channel, None)
+
+    def dispatch(self, message):
+        """Delivers message to its subscribers and returns its context"""
+        ctx = MessageContext(self.bot, message)
+        self.deliver(ctx, self._channels.get(ctx.channel.id, ()))
+        self.deliver(ctx, self.subscriptions)
+        return ctx
+
+    def deliver(self, ctx, subscriptions):
+        for sub in tuple(subscriptions):
+            if sub.matches(ctx):
+                self.delivered += 1
+                asyncio.ensure_future(self._run(sub.callback, ctx))
+
+    async def _run(self, callback, ctx):
+        try:
+            await callback(ctx)
+        except Exception:
+            log.exception("Error in message subscriber {!r}"
+                          "".format(callback))
@@ -0,0 +1,217 @@
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+#
+# Records how long each phase of Red's boot takes, and how much memory it
+# allocates when tracemalloc is tracing (--profile-startup or the
+# PYTHONTRACEMALLOC environment variable turn it on).
+#
+# Usage:
+#   with profiler.phase("check_files"):
+#       check_files()
+#
+# Phases started inside another one are named after it, for example
+# "cogs.mod setup > check_files". Once the boot is over phases are no
+# longer recorded, so cogs loaded later on aren't profiled.
+#
+
+log = logging.getLogger("red")
+
+OUTPUT_ENV = "RED_PROFILE_OUTPUT"  # Set on the boots run by profile_boots
+
+
+class Phase:
+
+    def __init__(self, name, parent):
+        self.name = name
+        self.parent = parent
+        self.elapsed = None
+        self.cpu = None
+        self.allocated = None
+        self._started = time.perf_counter()
+        self._cpu_started = time.process_time()
+        self._memory = _traced_memory()
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self._started
+        self.cpu = time.process_time() - self._cpu_started
+        memory = _traced_memory()
+        if self._memory is not None and memory is not None:
+            self.allocated = memory - self._memory
+
+    def as_dict(self):
+        return {"name": self.name,
+                "parent": self.parent.name if self.parent else None,
+                "ms": self.elapsed * 1000,
+                "cpu_ms": self.cpu * 1000,
+                "alloc_kb": (self.allocated / 1024
+                             if self.allocated is not None else None)}
+
+
+class BootProfiler:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.phases = []
+        self._running = {}
+        self._stack = []
+        self._tracing = False
+
+    @property
+    def booting(self):
+        return self.finished is None
+
+    @property
+    def profiled_boot(self):
+        """True in the boots run by profile_boots"""
+        return OUTPUT_ENV in os.environ
+
+    @contextmanager
+    def phase(self, name):
+        """Records the time spent in the with block"""
+        if not self.booting:
+            yield
+            return
+        parent = self._stack[-1] if self._stack else None
+        if parent is not None:
+            name = "{} > {}".format(parent.name, name)
+        phase = Phase(name, parent)
+        self._stack.append(phase)
+        try:
+            yield phase
+        finally:
+            self._stack.pop()
+            phase.stop()
+            self.phases.append(phase)
+
+    def start(self, name):
+        """Starts a phase that ends somewhere else, with stop(name)"""
+        if self.booting:
+            self._running[name] = Phase(name, None)
+
+    def stop(self, name):
+        phase = self._running.pop(name, None)
+        if phase is not None and self.booting:
+            phase.stop()
+            self.phases.append(phase)
+
+    def trace_allocations(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+
+    def finish(self):
+        """Ends the boot, logs the report and returns the results"""
+        if not self.booting:
+            return None
+        self.finished = time.perf_counter()
+        if self._tracing:
+            tracemalloc.stop()
+        results = self.results()
+        log.debug("Boot profile:\n" + format_report(results))
+        path = os.environ.get(OUTPUT_ENV)
+        if path:
+            with open(path, encoding="utf-8", mode="w") as f:
+                json.dump(results, f)
+        return results
+
+    def results(self):
+        end = self.finished if self.finished is not None else \
+            time.perf_counter()
+        return {"total_ms": (end - self.started) * 1000,
+                "phases": [p.as_dict() for p in self.phases]}
+
+
+def format_report(results):
+    """Returns the phases of results as a table, slowest first"""
+    phases = sorted(results["phases"], key=lambda p: p["ms"], reverse=True)
+    width = max([len(p["name"]) for p in phases] + [5])
+    lines = ["{:<{}} {:>9} {:>9} {:>10}".format("phase", width, "ms",
+                                               "cpu ms", "alloc KB")]
+    for p in phases:
+        alloc = p["alloc_kb"]
+        lines.append("{:<{}} {:>9.1f} {:>9.1f} {:>10}".format(
+            p["name"], width, p["ms"], p["cpu_ms"],
+            "-" if alloc is None else "{:.0f}".format(alloc)))
+    lines.append("{:<{}} {:>9.1f}".format("total", width,
+                                          results["total_ms"]))
+    return "\n".join(lines)
+
+
+def profile_boots(runs, argv=None):
+    """Runs Red's boot `runs` times in new processes and returns the
+    timings of every phase, summarized over the runs
+
+    argv is expected to contain --dry-run, so every boot quits before
+    logging in"""
+    if argv is None:
+        argv = sys.argv
+    env = dict(os.environ, PYTHONTRACEMALLOC="1")
+    boots = []
+    for n in range(runs):
+        fd, path = tempfile.mkstemp(prefix="red-boot-", suffix=".json")
+        os.close(fd)
+        env[OUTPUT_ENV] = path
+        try:
+            p = subprocess.run([sys.executable] + argv, env=env,
+                               stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+            if p.returncode != 0:
+                raise RuntimeError("Boot {} exited with code {}:\n{}".format(
+                    n + 1, p.returncode,
+                    p.stdout.decode("utf-8", "replace")))
+            with open(path, encoding="utf-8", mode="r") as f:
+                boots.append(json.load(f))
+        finally:
+            os.remove(path)
+    return summarize(boots)
+
+
+def summarize(boots):
+    """Returns the median of every phase over the results of boots"""
+    phases = {}
+    for boot in boots:
+        for p in boot["phases"]:
+            phases.setdefault(p["name"], []).append(p)
+
+    summary = []
+    for name, samples in phases.items():
+        ms = [p["ms"] for p in samples]
+        alloc = [p["alloc_kb"] for p in samples if p["alloc_kb"] is not None]
+        summary.append({"name": name,
+                        "parent": samples[0]["parent"],
+                        "runs": len(samples),
+                        "ms": statistics.median(ms),
+                        "min_ms": min(ms),
+                        "max_ms": max(ms),
+                        "cpu_ms": statistics.median(p["cpu_ms"]
+                                                    for p in samples),
+                        "alloc_kb": statistics.median(alloc) if alloc
+                                    else None})
+    totals = [b["total_ms"] for b in boots]
+    return {"runs": len(boots),
+            "python": sys.version.split()[0],
+            "total_ms": statistics.median(totals),
+            "min_total_ms": min(totals),
+            "max_total_ms": max(totals),
+            "phases": summary,
+            "boots": boots}
+
+
+def _traced_memory():
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    return None
+
+
+profiler = BootProfiler()
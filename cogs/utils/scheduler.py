@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import weakref
+from collections import deque
+
+from .metrics import metrics
+
+#
+# Orders Red's outgoing API requests by how urgent they are, so
+# moderation doesn't wait behind notifications when the rate limits are
+# tight.
+#
+# Usage:
+#   await self.bot.scheduler.submit(self.bot.ban, member, 1,
+#                                   priority=CRITICAL)
+#
+# submit runs the coroutine function in a task of its own; every request
+# it makes to the API is queued with its priority. Requests are the
+# scheduler's jobs: the ones in the same rate limit bucket run one at a
+# time in the order they were queued, and a bucket that discord.py found
+# exhausted is skipped until it's reset. The others run concurrently up
+# to --api-concurrency. When a slot is free the most urgent request goes
+# first, so a helper that makes many requests (purge_from, say) only
+# holds a slot while one of them is in flight.
+#
+
+log = logging.getLogger("red")
+
+CRITICAL = 0     # Moderation: bans, deleting filtered messages, purges
+INTERACTIVE = 1  # Replies to commands, the default
+BACKGROUND = 2   # Notifications, now playing messages, presence changes
+
+PRIORITIES = {CRITICAL: "critical",
+              INTERACTIVE: "interactive",
+              BACKGROUND: "background"}
+
+WAITED = metrics.histogram("red_api_wait_seconds",
+                           "Time API calls spent queued in the scheduler",
+                           ("priority",))
+
+
+class Job:
+    __slots__ = ("func", "args", "kwargs", "route", "future", "queued")
+
+    def __init__(self, func, args, kwargs, route):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.route = route
+        self.future = asyncio.Future()
+        self.queued = asyncio.get_event_loop().time()
+
+
+class PriorityStats:
+
+    def __init__(self):
+        self.queued = 0
+        self.running = 0
+        self.done = 0
+        self.failed = 0
+        self.waited = 0.0  # Seconds spent queued by the jobs started
+        self.max_wait = 0.0
+
+    def as_dict(self):
+        started = self.running + self.done + self.failed
+        return {"queued": self.queued,
+                "running": self.running,
+                "done": self.done,
+                "failed": self.failed,
+                "avg_wait_ms": (self.waited / started * 1000
+                                if started else 0.0),
+                "max_wait_ms": self.max_wait * 1000}
+
+
+class RequestScheduler:
+
+    def __init__(self, concurrency=10):
+        self.concurrency = concurrency
+        self._queues = {p: deque() for p in PRIORITIES}
+        self._stats = {p: PriorityStats() for p in PRIORITIES}
+        self._routes = set()  # Routes with a job running
+        self._running = 0
+        self._tasks = weakref.WeakKeyDictionary()  # Task: its priority
+        self._locks = {}  # discord.py's rate limit locks, by bucket
+        self._exhausted = set()  # Buckets waited for, see _wait_bucket
+
+    async def submit(self, func, *args, priority=INTERACTIVE, **kwargs):
+        """Calls the coroutine function func with args and kwargs and
+        returns what it returns. The API requests it makes are queued
+        with priority"""
+        if priority not in PRIORITIES:
+            raise ValueError("Unknown priority {!r}".format(priority))
+        task = asyncio.ensure_future(func(*args, **kwargs))
+        self._tasks[task] = priority
+        return await task
+
+    def wrap(self, request, locks=None):
+        """Returns request, discord.py's HTTPClient.request, queued by
+        the scheduler. locks are the client's rate limit locks"""
+        if locks is not None:
+            self._locks = locks
+
+        async def scheduled(route, **kwargs):
+            task = _current_task()
+            priority = self._tasks.get(task, INTERACTIVE)
+            return await self.queue(request, route, priority=priority,
+                                    route=route.bucket, **kwargs)
+        return scheduled
+
+    async def queue(self, func, *args, priority=INTERACTIVE, route=None,
+                    **kwargs):
+        """Calls the coroutine function func, which should make a single
+        API request, once it's its turn and returns what it returns.
+        route is the request's rate limit bucket"""
+        if priority not in PRIORITIES:
+            raise ValueError("Unknown priority {!r}".format(priority))
+        job = Job(func, args, kwargs, route)
+        self._queues[priority].append(job)
+        self._stats[priority].queued += 1
+        self._pump()
+        return await job.future
+
+    def stats(self):
+        """Queue depth and wait times of every priority class"""
+        return {name: self._stats[p].as_dict()
+                for p, name in PRIORITIES.items()}
+
+    def _pump(self):
+        for priority in sorted(self._queues):
+            queue = self._queues[priority]
+            stats = self._stats[priority]
+            for job in list(queue):
+                if self._running >= self.concurrency > 0:
+                    return
+                if job.future.done():  # Cancelled while queued
+                    queue.remove(job)
+                    stats.queued -= 1
+                elif job.route is None or not self._busy(job.route):
+                    queue.remove(job)
+                    stats.queued -= 1
+                    self._start(job, priority, stats)
+
+    def _busy(self, route):
+        if route in self._routes or route in self._exhausted:
+            return True
+        lock = self._locks.get(route)
+        if lock is not None and lock.locked():
+            # Held past its last request until the bucket is reset
+            self._exhausted.add(route)
+            asyncio.ensure_future(self._wait_bucket(route, lock))
+            return True
+        return False
+
+    async def _wait_bucket(self, route, lock):
+        try:
+            async with lock:
+                pass
+        finally:
+            self._exhausted.discard(route)
+            self._pump()
+
+    def _start(self, job, priority, stats):
+        wait = asyncio.get_event_loop().time() - job.queued
+        WAITED.observe(wait, priority=PRIORITIES[priority])
+        stats.waited += wait
+        stats.max_wait = max(stats.max_wait, wait)
+        stats.running += 1
+        self._running += 1
+        if job.route is not None:
+            self._routes.add(job.route)
+        asyncio.ensure_future(self._run(job, stats))
+
+    async def _run(self, job, stats):
+        try:
+            result = await job.func(*job.args, **job.kwargs)
+        except Exception as e:
+            stats.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            stats.done += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            stats.running -= 1
+            self._running -= 1
+            self._routes.discard(job.route)
+            self._pump()
+
+
+def _current_task():
+    try:
+        return asyncio.Task.current_task()
+    except AttributeError:  # Python 3.9+
+        return asyncio.current_task()
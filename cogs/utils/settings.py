@@ -1,7 +1,12 @@
+from .bus import bus, PrefixesChanged, RolesChanged
 from .dataIO import dataIO
+from .eventloop import LOOPS
+from collections import ChainMap, OrderedDict
 from copy import deepcopy
+from types import MappingProxyType
 import discord
 import os
+import re
 import argparse
 
 
@@ -25,6 +30,10 @@ class Settings:
                         }
         self._memory_only = False
 
+        if parse_args:
+            args = self.parse_cmd_arguments()
+            self.setup_storage(args)
+
         if not dataIO.is_valid_json(self.path):
             self.bot_settings = deepcopy(self.default_settings)
             self.save_settings()
@@ -44,8 +53,9 @@ class Settings:
 
         if "LOGIN_TYPE" in self.bot_settings:
             self.update_old_settings_v2()
+        self.build_index()
         if parse_args:
-            self.parse_cmd_arguments()
+            self.apply_cmd_arguments(args)
 
     def parse_cmd_arguments(self):
         parser = argparse.ArgumentParser(description="Red - Discord Bot")
@@ -87,9 +97,92 @@ class Settings:
         parser.add_argument("--debug",
                             action="store_true",
                             help="Enables debug mode")
-
-        args = parser.parse_args()
-
+        parser.add_argument("--write-behind",
+                            type=float, default=0, metavar="SECONDS",
+                            help="Coalesces repeated saves of the same data "
+                                 "file, delaying them by up to SECONDS. "
+                                 "Changes made in that window can be lost "
+                                 "if Red crashes")
+        parser.add_argument("--fsync",
+                            choices=dataIO.FSYNC_POLICIES, default="none",
+                            help="Flushes saved data files (file) and their "
+                                 "folders (dir) to disk before replacing "
+                                 "them. Safer against power losses, but "
+                                 "slower")
+        parser.add_argument("--storage",
+                            choices=("json", "sqlite"), default="json",
+                            help="Where data files are kept. sqlite requires "
+                                 "converting the data folder first with "
+                                 "python -m cogs.utils.sqlite_engine import")
+        parser.add_argument("--snapshot-interval",
+                            type=float, default=0, metavar="HOURS",
+                            help="Takes a snapshot of the data folder every "
+                                 "HOURS into the snapshots folder. Owners "
+                                 "can also take one with the snapshot "
+                                 "command")
+        parser.add_argument("--shard-timeout",
+                            type=float, default=3600, metavar="SECONDS",
+                            help="Per-server data that hasn't been used for "
+                                 "SECONDS is unloaded from memory until "
+                                 "it's needed again")
+        parser.add_argument("--lazy-cogs", nargs="+", default=[],
+                            metavar="COG",
+                            help="Cogs that are only loaded the first time "
+                                 "one of their commands is used. Until "
+                                 "then they take no memory or boot time. "
+                                 "Can be multiple")
+        parser.add_argument("--coalesce-window",
+                            type=float, default=0, metavar="MS",
+                            help="Merges the plain text messages Red sends "
+                                 "to the same channel within MS "
+                                 "milliseconds, up to 2000 characters, "
+                                 "into one message. Saves API calls and "
+                                 "rate limits on busy bots")
+        parser.add_argument("--api-concurrency",
+                            type=int, default=10, metavar="N",
+                            help="Most API requests Red makes at once, the "
+                                 "most urgent ones going first when there "
+                                 "are more. 0 for no limit")
+        parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                            help="Serves Red's metrics in Prometheus' text "
+                                 "format at http://127.0.0.1:PORT/metrics")
+        parser.add_argument("--slow-commands",
+                            type=float, default=0, metavar="MS",
+                            help="Logs the commands that take longer than "
+                                 "MS milliseconds, from receiving their "
+                                 "message to their end")
+        parser.add_argument("--stall-threshold",
+                            type=float, default=500, metavar="MS",
+                            help="Logs what the event loop was doing when "
+                                 "it gets blocked for longer than MS "
+                                 "milliseconds. 0 turns the watchdog off")
+        parser.add_argument("--loop", choices=LOOPS, default="asyncio",
+                            help="Event loop Red runs on. uvloop is faster "
+                                 "but has to be installed separately and "
+                                 "isn't available on Windows")
+        parser.add_argument("--profile-startup",
+                            type=int, nargs="?", const=1, default=0,
+                            metavar="RUNS",
+                            help="Prints how long each phase of the boot "
+                                 "took and how much memory it allocated. "
+                                 "With --dry-run the boot is run RUNS times "
+                                 "and the results are printed as json")
+        parser.add_argument("--profile-output", metavar="FILE",
+                            help="Saves the json results of "
+                                 "--profile-startup to FILE instead")
+
+        return parser.parse_args()
+
+    def setup_storage(self, args):
+        """Configures dataIO before any data file is loaded"""
+        dataIO.write_behind.delay = max(args.write_behind, 0)
+        dataIO.fsync = args.fsync
+        dataIO.shard_idle_timeout = args.shard_timeout
+        if args.storage == "sqlite":
+            from .sqlite_engine import SQLiteEngine
+            dataIO.use_engine(SQLiteEngine())
+
+    def apply_cmd_arguments(self, args):
         if args.owner:
             self.owner = args.owner
         if args.prefix:
@@ -105,10 +198,33 @@ class Settings:
         self._no_cogs = args.no_cogs
         self.debug = args.debug
         self._dry_run = args.dry_run
+        self.snapshot_interval = args.snapshot_interval
+        self.lazy_cogs = {c if c.startswith("cogs.") else "cogs." + c
+                          for c in args.lazy_cogs}
+        self.profile_startup = max(args.profile_startup, 0)
+        self.profile_output = args.profile_output
+        self.coalesce_window = max(args.coalesce_window, 0) / 1000
+        self.api_concurrency = max(args.api_concurrency, 0)
+        self.metrics_port = args.metrics_port
+        self.slow_commands = max(args.slow_commands, 0) / 1000
+        self.stall_threshold = max(args.stall_threshold, 0) / 1000
+        self.event_loop = args.loop
         self.co_owners = args.co_owner
 
         self.save_settings()
 
+    def build_index(self):
+        """Indexes the servers' settings. Has to be called again if
+        bot_settings is replaced"""
+        self._servers = {k: v for k, v in self.bot_settings.items()
+                         if str(k).isdigit()}
+        self._servers_view = MappingProxyType(self._servers)
+        self._default_view = MappingProxyType(self.bot_settings["default"])
+        self._views = {}
+        self._roles = {}
+        self._matchers = {}
+        self._matched = OrderedDict()
+
     def check_folders(self):
         folders = ("data", os.path.dirname(self.path), "cogs", "cogs/utils")
         for folder in folders:
@@ -130,6 +246,8 @@ class Settings:
                                         "ADMIN_ROLE": admin,
                                         "PREFIXES": []
                                         }
+        if hasattr(self, "_servers"):
+            self.build_index()
         self.save_settings()
 
     def update_old_settings_v2(self):
@@ -200,6 +318,10 @@ class Settings:
     def prefixes(self, value):
         assert isinstance(value, list)
         self.bot_settings["PREFIXES"] = value
+        if hasattr(self, "_matchers"):
+            self._matchers.clear()
+            self._matched.clear()
+            bus.publish(PrefixesChanged(None))
 
     @property
     def default_admin(self):
@@ -212,6 +334,8 @@ class Settings:
         if "default" not in self.bot_settings:
             self.update_old_settings()
         self.bot_settings["default"]["ADMIN_ROLE"] = value
+        self._roles.clear()
+        bus.publish(RolesChanged(None))
 
     @property
     def default_mod(self):
@@ -224,76 +348,152 @@ class Settings:
         if "default" not in self.bot_settings:
             self.update_old_settings_v1()
         self.bot_settings["default"]["MOD_ROLE"] = value
+        self._roles.clear()
+        bus.publish(RolesChanged(None))
 
     @property
     def servers(self):
-        ret = {}
-        server_ids = list(
-            filter(lambda x: str(x).isdigit(), self.bot_settings))
-        for server in server_ids:
-            ret.update({server: self.bot_settings[server]})
-        return ret
+        """Read-only view of the settings of every configured server"""
+        return self._servers_view
 
     def get_server(self, server):
         if server is None:
             return self.bot_settings["default"].copy()
         assert isinstance(server, discord.Server)
-        return self.bot_settings.get(server.id,
-                                     self.bot_settings["default"]).copy()
+        return self._servers.get(server.id,
+                                 self.bot_settings["default"]).copy()
 
-    def get_server_admin(self, server):
+    def server_view(self, server):
+        """Returns a read-only view of the server's settings, with the
+        default ones filling in what isn't set
+
+        Unlike get_server nothing is copied, the view is cached and
+        follows later changes"""
         if server is None:
-            return self.default_admin
+            return self._default_view
         assert isinstance(server, discord.Server)
-        if server.id not in self.bot_settings:
-            return self.default_admin
-        return self.bot_settings[server.id].get("ADMIN_ROLE", "")
+        if server.id not in self._servers:
+            return self._default_view
+        view = self._views.get(server.id)
+        if view is None:
+            view = MappingProxyType(ChainMap(self._servers[server.id],
+                                             self.bot_settings["default"]))
+            self._views[server.id] = view
+        return view
+
+    def get_server_roles(self, server):
+        """Returns the server's (admin role, mod role) names"""
+        sid = server.id if server is not None else None
+        if sid not in self._servers:
+            sid = None
+        roles = self._roles.get(sid)
+        if roles is None:
+            if sid is None:
+                roles = (self.default_admin, self.default_mod)
+            else:
+                settings = self._servers[sid]
+                roles = (settings.get("ADMIN_ROLE", ""),
+                         settings.get("MOD_ROLE", ""))
+            self._roles[sid] = roles
+        return roles
+
+    def get_server_admin(self, server):
+        if server is not None:
+            assert isinstance(server, discord.Server)
+        return self.get_server_roles(server)[0]
 
     def set_server_admin(self, server, value):
         if server is None:
             return
         assert isinstance(server, discord.Server)
-        if server.id not in self.bot_settings:
+        if server.id not in self._servers:
             self.add_server(server.id)
-        self.bot_settings[server.id]["ADMIN_ROLE"] = value
+        self._servers[server.id]["ADMIN_ROLE"] = value
+        self._roles.pop(server.id, None)
         self.save_settings()
+        bus.publish(RolesChanged(server.id))
 
     def get_server_mod(self, server):
-        if server is None:
-            return self.default_mod
-        assert isinstance(server, discord.Server)
-        if server.id not in self.bot_settings:
-            return self.default_mod
-        return self.bot_settings[server.id].get("MOD_ROLE", "")
+        if server is not None:
+            assert isinstance(server, discord.Server)
+        return self.get_server_roles(server)[1]
 
     def set_server_mod(self, server, value):
         if server is None:
             return
         assert isinstance(server, discord.Server)
-        if server.id not in self.bot_settings:
+        if server.id not in self._servers:
             self.add_server(server.id)
-        self.bot_settings[server.id]["MOD_ROLE"] = value
+        self._servers[server.id]["MOD_ROLE"] = value
+        self._roles.pop(server.id, None)
         self.save_settings()
+        bus.publish(RolesChanged(server.id))
 
     def get_server_prefixes(self, server):
-        if server is None or server.id not in self.bot_settings:
+        if server is None or server.id not in self._servers:
             return self.prefixes
-        return self.bot_settings[server.id].get("PREFIXES", [])
+        return self._servers[server.id].get("PREFIXES", [])
 
     def set_server_prefixes(self, server, prefixes):
         if server is None:
             return
         assert isinstance(server, discord.Server)
-        if server.id not in self.bot_settings:
+        if server.id not in self._servers:
             self.add_server(server.id)
-        self.bot_settings[server.id]["PREFIXES"] = prefixes
+        self._servers[server.id]["PREFIXES"] = prefixes
+        self._matchers.pop(server.id, None)
+        self._matched.clear()
         self.save_settings()
+        bus.publish(PrefixesChanged(server.id))
 
     def get_prefixes(self, server):
         """Returns server's prefixes if set, otherwise global ones"""
         p = self.get_server_prefixes(server)
         return p if p else self.prefixes
 
+    def match_prefix(self, server, content):
+        """Returns the server's prefix content starts with, or None
+
+        The longest one wins if more than one matches"""
+        sid = server.id if server is not None else None
+        if sid not in self._servers:
+            sid = None
+        match = self._matchers.get(sid)
+        if match is None:
+            prefixes = sorted(set(self.get_prefixes(server)), key=len,
+                              reverse=True)
+            if prefixes:
+                match = re.compile("|".join(map(re.escape, prefixes))).match
+            else:
+                match = lambda content: None
+            self._matchers[sid] = match
+        m = match(content)
+        return m.group() if m is not None else None
+
+    def get_matched_prefix(self, message):
+        """Returns the prefix message starts with, or None
+
+        The result is remembered so everything looking for the prefix
+        of the same message shares it"""
+        key = (message.id, message.content)
+        try:
+            return self._matched[key]
+        except KeyError:
+            pass
+        prefix = self.match_prefix(message.server, message.content)
+        self._matched[key] = prefix
+        if len(self._matched) > 1000:
+            self._matched.popitem(last=False)
+        return prefix
+
     def add_server(self, sid):
         self.bot_settings[sid] = self.bot_settings["default"].copy()
+        self._servers[sid] = self.bot_settings[sid]
+        self._views.pop(sid, None)
+        self._roles.pop(sid, None)
+        self._matchers.pop(sid, None)
+        self._matched.clear()
         self.save_settings()
+        # The server no longer falls back to the default settings
+        bus.publish(RolesChanged(sid))
+        bus.publish(PrefixesChanged(sid))
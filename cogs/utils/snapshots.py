@@ -0,0 +1,281 @@
+import asyncio
+import datetime
+import fnmatch
+import logging
+import os
+import shutil
+import sqlite3
+import tarfile
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from functools import partial
+
+#
+# Point-in-time copies of the data folder, taken while Red is running.
+#
+# Snapshots are taken in a worker thread. The data folder is copied
+# while the cogs keep writing to it; files that haven't changed since the
+# previous snapshot are hard-linked to it, so only the files that did
+# change are copied. dataIO records what it writes in the meantime, and
+# writes are then held off only long enough to copy those files again.
+# That window is also where the SQLite database is pinned with a read
+# transaction, which the online backup copies from afterwards without
+# holding anyone off. The snapshot is finally compressed to
+# snapshots/<name>.tar.gz in a background thread.
+#
+
+log = logging.getLogger("red")
+
+default_folder = "snapshots"
+default_exclude = ("data/audio/cache/*",)  # Downloaded songs
+
+# Engine: (total changes, path of the database's last backup)
+_backups = weakref.WeakKeyDictionary()
+# Paths of the snapshots being compressed, they're not pruned until done
+_compressing = set()
+_compressing_lock = threading.Lock()
+
+
+class Snapshot:
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.archive = None
+        self.linked = 0
+        self.copied = 0
+        self.elapsed = 0
+        self.held = 0  # Seconds the writes were held off for
+        # Set to the archive's path once it's written
+        self.compressed = Future()
+
+
+async def take_snapshot_async(dataio, **kwargs):
+    """Takes a snapshot with take_snapshot in a worker thread
+
+    The files marked as dirty are saved first, in the background"""
+    loop = asyncio.get_event_loop()
+    dataio.write_behind.flush(background=True)
+    return await loop.run_in_executor(None, partial(take_snapshot, dataio,
+                                                    **kwargs))
+
+
+def take_snapshot(dataio, root="data", folder=default_folder,
+                  exclude=default_exclude, compress=True, keep=5):
+    """Takes a snapshot of root into folder and returns it
+
+    The data is consistent as long as it's only written through dataIO.
+    The newest `keep` snapshots are kept, older ones are deleted. Meant
+    to be run outside of the event loop: see take_snapshot_async"""
+    started = time.monotonic()
+    previous = latest_snapshot(folder)
+    name = datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(folder, name)
+    n = 1
+    while os.path.exists(path):
+        n += 1
+        path = os.path.join(folder, "{}-{}".format(name, n))
+    snapshot = Snapshot(path)
+
+    skipped = set()
+    engine = dataio.engine
+    if engine is not None:
+        db = os.path.normpath(engine.db_path)
+        skipped.update((db, db + "-wal", db + "-shm", db + "-journal"))
+
+    def wanted(src):
+        return not (src.endswith(".tmp") or
+                    os.path.normpath(src) in skipped or
+                    any(fnmatch.fnmatch(src.replace(os.sep, "/"), p)
+                        for p in exclude))
+
+    with dataio.record_writes() as written:
+        for dirpath, dirnames, filenames in os.walk(root):
+            rel = os.path.relpath(dirpath, root)
+            os.makedirs(os.path.normpath(os.path.join(path, rel)))
+            for filename in filenames:
+                src = os.path.join(dirpath, filename)
+                if not wanted(src):
+                    continue
+                dst = os.path.normpath(os.path.join(path, rel, filename))
+                base = None
+                if previous is not None:
+                    base = os.path.join(previous, rel, filename)
+                _snapshot_file(snapshot, src, dst, base)
+
+        if engine is not None:
+            rel = os.path.relpath(engine.db_path, root)
+            if rel.startswith(os.pardir):
+                rel = os.path.basename(engine.db_path)
+            db_dst = os.path.join(path, rel)
+        with dataio.quiesce(flush=False):
+            held = time.monotonic()
+            # What was written since the copy started, copied again
+            for src in written:
+                rel = os.path.relpath(src, root)
+                if rel.startswith(os.pardir) or not wanted(src):
+                    continue
+                dst = os.path.normpath(os.path.join(path, rel))
+                if os.path.isfile(dst):
+                    # It may be linked to the previous snapshot
+                    os.remove(dst)
+                if os.path.isfile(src):
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    _snapshot_file(snapshot, src, dst, None)
+            if engine is not None:
+                reader, changes = _pin_database(engine, db_dst)
+            snapshot.held = time.monotonic() - held
+
+    if engine is not None:
+        _backup_database(engine, reader, changes, db_dst, snapshot)
+
+    snapshot.elapsed = time.monotonic() - started
+    _prune(folder, keep)
+
+    if compress:
+        with _compressing_lock:
+            _compressing.add(os.path.normpath(snapshot.path))
+        thread = threading.Thread(target=_compress, args=(snapshot,),
+                                  daemon=True)
+        thread.start()
+    else:
+        snapshot.compressed.set_result(None)
+    return snapshot
+
+
+async def snapshot_every(dataio, hours, **kwargs):
+    """Takes a snapshot every `hours` hours, forever"""
+    while True:
+        await asyncio.sleep(hours * 3600)
+        try:
+            snapshot = await take_snapshot_async(dataio, **kwargs)
+            log.info("Snapshot {} taken in {:.2f}s, writes held off for "
+                     "{:.3f}s ({} files linked, {} copied)"
+                     "".format(snapshot.name, snapshot.elapsed,
+                               snapshot.held, snapshot.linked,
+                               snapshot.copied))
+            await asyncio.wrap_future(snapshot.compressed)
+        except Exception:
+            log.exception("Scheduled snapshot failed")
+
+
+def latest_snapshot(folder=default_folder):
+    """Returns the path of the newest snapshot or None"""
+    snapshots = _list(folder)
+    return os.path.join(folder, snapshots[-1]) if snapshots else None
+
+
+def _snapshot_file(snapshot, src, dst, base):
+    try:
+        st = os.stat(src)
+    except FileNotFoundError:  # Deleted since it was listed
+        return
+    if base is not None:
+        try:
+            bst = os.stat(base)
+        except OSError:
+            pass
+        else:
+            if (bst.st_size, bst.st_mtime_ns) == (st.st_size,
+                                                   st.st_mtime_ns):
+                try:
+                    os.link(base, dst)
+                except OSError:  # No hard links on this filesystem
+                    pass
+                else:
+                    snapshot.linked += 1
+                    return
+    try:
+        shutil.copy2(src, dst)
+    except FileNotFoundError:
+        return
+    snapshot.copied += 1
+
+
+def _pin_database(engine, dst):
+    """Returns a connection whose read transaction sees the database as
+    it is now, or None if there's nothing left to copy, and the number
+    of changes made to it. Called with the writes held off"""
+    with engine._lock:
+        changes = engine.conn.total_changes
+    last = _backups.get(engine)
+    if last is not None and last[0] == changes and os.path.isfile(last[1]):
+        return None, changes  # Unchanged since its last backup
+    if not hasattr(sqlite3.Connection, "backup"):  # Python < 3.7
+        engine.backup(dst)
+    else:
+        reader = sqlite3.connect(engine.db_path, isolation_level=None,
+                                 check_same_thread=False)
+        reader.execute("BEGIN")
+        reader.execute("SELECT COUNT(*) FROM documents").fetchone()
+        return reader, changes
+    _backups[engine] = (changes, dst)
+    return None, changes
+
+
+def _backup_database(engine, reader, changes, dst, snapshot):
+    if reader is not None:
+        target = sqlite3.connect(dst)
+        try:
+            # A few pages at a time, writers aren't blocked by the reader
+            reader.backup(target, pages=1024)
+        finally:
+            target.close()
+            reader.execute("ROLLBACK")
+            reader.close()
+        _backups[engine] = (changes, dst)
+        snapshot.copied += 1
+    elif not os.path.isfile(dst):
+        last = _backups[engine][1]
+        try:
+            os.link(last, dst)
+        except OSError:
+            shutil.copyfile(last, dst)
+            snapshot.copied += 1
+        else:
+            snapshot.linked += 1
+        _backups[engine] = (changes, dst)
+    else:
+        snapshot.copied += 1
+
+
+def _compress(snapshot):
+    archive = snapshot.path + ".tar.gz"
+    part = archive + ".part"
+    try:
+        with tarfile.open(part, mode="w:gz") as tar:
+            tar.add(snapshot.path, arcname=snapshot.name)
+        os.replace(part, archive)
+    except Exception as e:
+        try:
+            os.remove(part)
+        except OSError:
+            pass
+        snapshot.compressed.set_exception(e)
+    else:
+        snapshot.archive = archive
+        snapshot.compressed.set_result(archive)
+    finally:
+        with _compressing_lock:
+            _compressing.discard(os.path.normpath(snapshot.path))
+
+
+def _list(folder):
+    if not os.path.isdir(folder):
+        return []
+    return sorted(n for n in os.listdir(folder)
+                  if os.path.isdir(os.path.join(folder, n)))
+
+
+def _prune(folder, keep):
+    for name in _list(folder)[:-keep]:
+        with _compressing_lock:
+            if os.path.normpath(os.path.join(folder, name)) in _compressing:
+                continue  # Pruned next time, once it's archived
+        shutil.rmtree(os.path.join(folder, name), ignore_errors=True)
+        try:
+            os.remove(os.path.join(folder, name + ".tar.gz"))
+        except OSError:
+            pass
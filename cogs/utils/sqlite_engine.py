@@ -0,0 +1,280 @@
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+
+from .dataIO import dataIO
+
+#
+# Stores Red's json documents in a single SQLite database instead of
+# one file each. Documents are keyed by the path the cogs already use
+# (e.g. data/economy/bank.json) so they don't need to know about it.
+#
+# Usage:
+#   python red.py --storage sqlite
+#
+#   python -m cogs.utils.sqlite_engine import   (data/ -> database)
+#   python -m cogs.utils.sqlite_engine export   (database -> data/)
+#
+
+default_db_path = "data/red.sqlite3"
+default_exclude = ("data/downloader/*/*",)  # Files from downloaded repos
+
+
+class SQLiteEngine:
+    """Keeps json documents in a SQLite database
+
+    Every top-level key of a document is stored as its own row, so
+    saving a document only writes the keys that have changed since
+    the last time it was loaded or saved. Single keys can also be
+    read and written without touching the rest of the document."""
+
+    OBJECT = "object"
+    VALUE = "value"
+
+    def __init__(self, db_path=default_db_path, root="data",
+                 exclude=default_exclude):
+        self.db_path = db_path
+        self.root = self._normalize(root)
+        self.exclude = exclude
+        self._lock = threading.RLock()
+        self._digests = {}
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS documents ("
+                              "path TEXT PRIMARY KEY, "
+                              "kind TEXT NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS entries ("
+                              "path TEXT NOT NULL, "
+                              "key TEXT NOT NULL, "
+                              "value TEXT NOT NULL, "
+                              "PRIMARY KEY (path, key))")
+
+    def handles(self, filename):
+        """Whether filename is stored in the database"""
+        path = self._normalize(filename)
+        if not path.endswith(".json"):
+            return False
+        if not path.startswith(self.root + "/"):
+            return False
+        return not any(fnmatch.fnmatch(path, p) for p in self.exclude)
+
+    def exists(self, filename):
+        return self._kind(self._normalize(filename)) is not None
+
+    def paths(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT path FROM documents "
+                                     "ORDER BY path").fetchall()
+        return [r[0] for r in rows]
+
+    def load(self, filename):
+        path = self._normalize(filename)
+        with self._lock:
+            kind = self._kind(path)
+            if kind is None:
+                raise FileNotFoundError(filename)
+            rows = self.conn.execute("SELECT key, value FROM entries "
+                                     "WHERE path = ?", (path,)).fetchall()
+            self._digests[path] = {k: self._digest(v) for k, v in rows}
+        if kind == self.VALUE:
+            return json.loads(rows[0][1]) if rows else None
+        return {k: json.loads(v) for k, v in rows}
+
+    def save(self, filename, data, changed=None):
+        """Saves a document
+
+        If changed is passed, only those top-level keys are assumed to
+        be different from what is stored and the others are skipped"""
+        path = self._normalize(filename)
+        if isinstance(data, dict):
+            kind = self.OBJECT
+        else:
+            kind = self.VALUE
+            changed = None
+
+        with self._lock, self.conn:
+            if self._kind(path) != kind:
+                self.conn.execute("DELETE FROM entries WHERE path = ?",
+                                  (path,))
+                self._digests[path] = {}
+                changed = None
+            elif path not in self._digests:
+                self._load_digests(path)
+            stored = self._digests[path]
+
+            if kind == self.VALUE:
+                entries = {"": self._encode(data)}
+            elif changed is None:
+                entries = {self._key(k): self._encode(v)
+                           for k, v in data.items()}
+            else:
+                entries = {self._key(k): self._encode(data[k])
+                           for k in changed if k in data}
+
+            updated = []
+            for key, value in entries.items():
+                digest = self._digest(value)
+                if stored.get(key) != digest:
+                    updated.append((path, key, value))
+                    stored[key] = digest
+            if changed is None:
+                removed = [(path, k) for k in stored if k not in entries]
+            else:
+                removed = [(path, self._key(k)) for k in changed
+                           if k not in data and self._key(k) in stored]
+
+            self.conn.execute("INSERT OR REPLACE INTO documents (path, kind) "
+                              "VALUES (?, ?)", (path, kind))
+            self.conn.executemany("INSERT OR REPLACE INTO entries "
+                                  "(path, key, value) VALUES (?, ?, ?)",
+                                  updated)
+            self.conn.executemany("DELETE FROM entries WHERE path = ? "
+                                  "AND key = ?", removed)
+            for _, key in removed:
+                del stored[key]
+        return True
+
+    def get_value(self, filename, key):
+        path = self._normalize(filename)
+        with self._lock:
+            if self._kind(path) != self.OBJECT:
+                raise FileNotFoundError(filename)
+            row = self.conn.execute("SELECT value FROM entries WHERE "
+                                    "path = ? AND key = ?",
+                                    (path, self._key(key))).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def set_value(self, filename, key, value):
+        path = self._normalize(filename)
+        key = self._key(key)
+        value = self._encode(value)
+        with self._lock, self.conn:
+            if self._kind(path) != self.OBJECT:
+                raise FileNotFoundError(filename)
+            self.conn.execute("INSERT OR REPLACE INTO entries "
+                              "(path, key, value) VALUES (?, ?, ?)",
+                              (path, key, value))
+            if path in self._digests:
+                self._digests[path][key] = self._digest(value)
+        return True
+
+    def delete(self, filename):
+        path = self._normalize(filename)
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM entries WHERE path = ?", (path,))
+            self.conn.execute("DELETE FROM documents WHERE path = ?", (path,))
+            self._digests.pop(path, None)
+
+    def backup(self, path):
+        """Copies the database to path"""
+        with self._lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            shutil.copyfile(self.db_path, path)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def _kind(self, path):
+        with self._lock:
+            row = self.conn.execute("SELECT kind FROM documents WHERE "
+                                    "path = ?", (path,)).fetchone()
+        return row[0] if row else None
+
+    def _load_digests(self, path):
+        rows = self.conn.execute("SELECT key, value FROM entries "
+                                 "WHERE path = ?", (path,)).fetchall()
+        self._digests[path] = {k: self._digest(v) for k, v in rows}
+
+    @staticmethod
+    def _normalize(filename):
+        return os.path.normpath(filename).replace(os.sep, "/")
+
+    @staticmethod
+    def _key(key):
+        # Same conversion json.dumps applies to non-string keys
+        return key if isinstance(key, str) else json.dumps(key)
+
+    @staticmethod
+    def _encode(value):
+        return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+    @staticmethod
+    def _digest(value):
+        return hashlib.md5(value.encode("utf-8")).digest()
+
+
+def import_data(engine, root="data"):
+    """Copies every json file under root into the database"""
+    imported = 0
+    previous, dataIO.engine = dataIO.engine, None  # Read the actual files
+    try:
+        for folder, _, files in os.walk(root):
+            for name in sorted(files):
+                path = os.path.join(folder, name)
+                if not engine.handles(path):
+                    continue
+                try:
+                    data = dataIO.load_json(path)
+                except ValueError:
+                    print("Skipping {}: invalid json".format(path))
+                    continue
+                engine.save(path, data)
+                imported += 1
+    finally:
+        dataIO.engine = previous
+    return imported
+
+
+def export_data(engine):
+    """Writes every document in the database back to its json file"""
+    exported = 0
+    previous, dataIO.engine = dataIO.engine, None  # Write the actual files
+    try:
+        for path in engine.paths():
+            folder = os.path.dirname(path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            dataIO.save_json(path, engine.load(path))
+            exported += 1
+    finally:
+        dataIO.engine = previous
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts Red's data "
+                                                 "folder from and to SQLite")
+    parser.add_argument("action", choices=("import", "export"),
+                        help="import: json files -> database, "
+                             "export: database -> json files")
+    parser.add_argument("--db", default=default_db_path,
+                        help="Database path (default: {})"
+                             "".format(default_db_path))
+    parser.add_argument("--data", default="data",
+                        help="Data folder (default: data)")
+    args = parser.parse_args()
+
+    engine = SQLiteEngine(args.db, root=args.data)
+    try:
+        if args.action == "import":
+            n = import_data(engine, args.data)
+            print("Imported {} files into {}. Start Red with "
+                  "--storage sqlite to use it.".format(n, args.db))
+        else:
+            n = export_data(engine)
+            print("Exported {} files from {}.".format(n, args.db))
+    finally:
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
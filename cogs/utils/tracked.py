@@ -0,0 +1,233 @@
+#
+# Dicts and lists that remember whether they have been changed since
+# they were loaded or last saved. dataIO skips saving tracked data that
+# hasn't changed, and only re-encodes the top-level keys that did when
+# the storage engine supports it.
+#
+# Usage:
+#   self.settings = dataIO.load_tracked("data/mycog/settings.json")
+#   self.settings["SERVERS"][sid]["VOLUME"] = 50  # Marks "SERVERS"
+#   dataIO.save_json("data/mycog/settings.json", self.settings)
+#
+# Dicts and lists assigned to a tracked container are copied into
+# tracked ones, so changes made afterwards through the original object
+# are not seen. Get it back from the container before changing it.
+#
+
+
+_WHOLE = object()  # Top-level key of values nested in a top-level list
+
+
+class ChangeSet:
+    """The top-level keys of a document that have been changed
+
+    everything is True if the document has been changed as a whole,
+    like a top-level list being appended to"""
+
+    def __init__(self):
+        self.keys = set()
+        self.everything = False
+
+    @property
+    def dirty(self):
+        return self.everything or bool(self.keys)
+
+    def add(self, key=None):
+        if key is None:
+            self.everything = True
+        else:
+            self.keys.add(key)
+
+    def clear(self):
+        self.keys.clear()
+        self.everything = False
+
+    def __repr__(self):
+        if self.everything:
+            return "<ChangeSet everything>"
+        return "<ChangeSet keys={}>".format(sorted(self.keys, key=str))
+
+
+class Tracked:
+    """Common base of TrackedDict and TrackedList"""
+
+    def _setup(self, changes, top):
+        self._changes = changes if changes is not None else ChangeSet()
+        self._top = top
+
+    @property
+    def changes(self):
+        return self._changes
+
+    @property
+    def dirty(self):
+        return self._changes.dirty
+
+    def mark_clean(self):
+        self._changes.clear()
+
+    def _changed(self, key=None):
+        # Nested containers report the top-level key they live under
+        if self._top is None:
+            self._changes.add(key)
+        elif self._top is _WHOLE:
+            self._changes.add()
+        else:
+            self._changes.add(self._top)
+
+    def _child(self, key):
+        if self._top is not None:
+            return self._top
+        return _WHOLE if isinstance(self, list) else key
+
+    def _wrap(self, value, top):
+        if isinstance(value, Tracked) and value._changes is self._changes:
+            if value._top == top:
+                return value
+        if isinstance(value, dict):
+            return TrackedDict(value, _changes=self._changes, _top=top)
+        if isinstance(value, list):
+            return TrackedList(value, _changes=self._changes, _top=top)
+        return value
+
+
+class TrackedDict(Tracked, dict):
+    """A dict that tracks changes made to it and to its nested values
+
+    default_factory works like defaultdict's"""
+
+    def __init__(self, data=(), default_factory=None, *,
+                 _changes=None, _top=None):
+        self._setup(_changes, _top)
+        self.default_factory = default_factory
+        dict.__init__(self)
+        for key, value in dict(data).items():
+            dict.__setitem__(self, key, self._wrap(value, self._child(key)))
+
+    def __missing__(self, key):
+        if self.default_factory is None:
+            raise KeyError(key)
+        self[key] = self.default_factory()
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        if not (key in self and dict.__getitem__(self, key) == value):
+            self._changed(key)
+        dict.__setitem__(self, key, self._wrap(value, self._child(key)))
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._changed(key)
+
+    def pop(self, key, *default):
+        if key in self:
+            self._changed(key)
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self._changed(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        for key in self:
+            self._changed(key)
+        dict.clear(self)
+
+    def __reduce__(self):
+        # Copies and pickles come out as plain dicts
+        return (dict, (dict(self),))
+
+    def __repr__(self):
+        return "TrackedDict({})".format(dict.__repr__(self))
+
+
+class TrackedList(Tracked, list):
+    """A list that tracks changes made to it and to its nested values"""
+
+    def __init__(self, data=(), *, _changes=None, _top=None):
+        self._setup(_changes, _top)
+        list.__init__(self, self._wrap_all(data))
+
+    def _wrap_all(self, values):
+        return [self._wrap(v, self._child(None)) for v in values]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = self._wrap_all(value)
+        else:
+            value = self._wrap(value, self._child(None))
+        list.__setitem__(self, index, value)
+        self._changed()
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self._changed()
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def __imul__(self, n):
+        list.__imul__(self, n)
+        self._changed()
+        return self
+
+    def append(self, value):
+        list.append(self, self._wrap(value, self._child(None)))
+        self._changed()
+
+    def extend(self, values):
+        list.extend(self, self._wrap_all(values))
+        self._changed()
+
+    def insert(self, index, value):
+        list.insert(self, index, self._wrap(value, self._child(None)))
+        self._changed()
+
+    def remove(self, value):
+        list.remove(self, value)
+        self._changed()
+
+    def pop(self, *index):
+        value = list.pop(self, *index)
+        self._changed()
+        return value
+
+    def clear(self):
+        list.clear(self)
+        self._changed()
+
+    def sort(self, *args, **kwargs):
+        list.sort(self, *args, **kwargs)
+        self._changed()
+
+    def reverse(self):
+        list.reverse(self)
+        self._changed()
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+    def __repr__(self):
+        return "TrackedList({})".format(list.__repr__(self))
+
+
+def track(data, default_factory=None):
+    """Wraps json data in tracked containers
+
+    Anything that isn't a dict or a list is returned as it is"""
+    if isinstance(data, dict):
+        return TrackedDict(data, default_factory)
+    if isinstance(data, list):
+        return TrackedList(data)
+    return data
@@ -0,0 +1,146 @@
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from .metrics import metrics
+
+#
+# Finds what blocks the event loop. The loop bumps a heartbeat every
+# INTERVAL seconds; a thread watches it and, when the loop has been stuck
+# for longer than the threshold, takes the loop thread's stack. Stalls
+# are counted by call site: the innermost frame of a cog (or of Red's
+# core) in that stack, since what blocks is usually a library call that
+# the cog shouldn't have made on the loop.
+#
+
+log = logging.getLogger("red")
+
+INTERVAL = 0.1
+RED_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+UTILS = os.path.join(RED_ROOT, "cogs", "utils")
+
+STALLS = metrics.histogram("red_loop_stall_seconds",
+                           "Time the event loop was blocked for, counting "
+                           "the stalls over the threshold",
+                           buckets=(0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+
+
+class CallSite:
+    __slots__ = ("name", "stalls", "total", "max", "stack")
+
+    def __init__(self, name):
+        self.name = name
+        self.stalls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.stack = None  # Formatted stack of the longest stall
+
+    def add(self, duration, stack):
+        self.stalls += 1
+        self.total += duration
+        if duration >= self.max:
+            self.max = duration
+            self.stack = stack
+
+
+class LoopWatchdog:
+
+    def __init__(self, loop, threshold=0.5):
+        self.loop = loop
+        self.threshold = threshold
+        self.sites = {}  # Call site name: CallSite
+        self.stalls = 0
+        self.max_lag = 0.0
+        self._beat = None
+        self._loop_thread = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    @property
+    def lag(self):
+        """How late the loop is on its heartbeat"""
+        if self._beat is None:
+            return 0.0
+        return max(time.monotonic() - self._beat - INTERVAL, 0.0)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Starts watching the loop, must be called from its thread"""
+        if self.running:
+            return
+        self._loop_thread = threading.get_ident()
+        self._stopped.clear()
+        self._heartbeat()
+        self._thread = threading.Thread(target=self._watch, daemon=True,
+                                        name="Loop watchdog")
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def top(self, count=10):
+        """The call sites the loop was blocked the longest in"""
+        return sorted(self.sites.values(), key=lambda s: s.total,
+                      reverse=True)[:count]
+
+    def reset(self):
+        self.sites.clear()
+        self.stalls = 0
+        self.max_lag = 0.0
+
+    def _heartbeat(self):
+        if self._stopped.is_set():
+            return
+        self._beat = time.monotonic()
+        self.loop.call_later(INTERVAL, self._heartbeat)
+
+    def _watch(self):
+        stall = None  # Beat the ongoing stall started at, and its stack
+        while not self._stopped.wait(INTERVAL):
+            beat = self._beat
+            lag = time.monotonic() - beat - INTERVAL
+            if stall is not None and stall[0] != beat:
+                # The loop is running again
+                self._record(stall[1], stall[2], beat - stall[0] - INTERVAL)
+                stall = None
+            if lag >= self.threshold and stall is None:
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None:
+                    stack = traceback.extract_stack(frame)
+                    stall = (beat, _call_site(stack), stack)
+                    del frame
+
+    def _record(self, site, stack, duration):
+        self.stalls += 1
+        self.max_lag = max(self.max_lag, duration)
+        STALLS.observe(duration)
+        call_site = self.sites.get(site)
+        if call_site is None:
+            call_site = self.sites[site] = CallSite(site)
+        formatted = "".join(traceback.format_list(stack))
+        call_site.add(duration, formatted)
+        log.warning("The event loop was blocked for {:.2f}s in {}:\n{}"
+                    "".format(duration, site, formatted))
+
+
+def _call_site(stack):
+    """The innermost frame of a cog, or else of Red, or else the innermost
+    frame of stack, as file:line in function"""
+    def is_red(f):
+        return (f.filename.startswith(RED_ROOT) and
+                "site-packages" not in f.filename)
+
+    red = [f for f in stack if is_red(f)]
+    callers = [f for f in red if not f.filename.startswith(UTILS)]
+    frame = (callers or red or stack)[-1]
+    filename = frame.filename
+    if filename.startswith(RED_ROOT):
+        filename = os.path.relpath(filename, RED_ROOT)
+    return "{}:{} in {}".format(filename, frame.lineno, frame.name)
@@ -62,6 +62,10 @@ def parse_cli_arguments():
     parser.add_argument("--repair",
                         help="Issues a git reset --hard",
                         action="store_true")
+    parser.add_argument("--loop",
+                        help="Event loop Red runs on (uvloop must be "
+                             "installed separately)",
+                        choices=("asyncio", "uvloop"))
     return parser.parse_args()
 
 
@@ -356,7 +360,7 @@ def maintenance_menu():
         clear_screen()
 
 
-def run_red(autorestart):
+def run_red(autorestart, loop=None):
     interpreter = sys.executable
 
     if interpreter is None: # This should never happen
@@ -369,6 +373,8 @@ def run_red(autorestart):
             exit(1)
 
     cmd = (interpreter, "red.py")
+    if loop:
+        cmd += ("--loop", loop)
 
     while True:
         try:
@@ -527,9 +533,9 @@ def main():
         print("\n0. Quit")
         choice = user_choice()
         if choice == "1":
-            run_red(autorestart=True)
+            run_red(autorestart=True, loop=args.loop)
         elif choice == "2":
-            run_red(autorestart=False)
+            run_red(autorestart=False, loop=args.loop)
         elif choice == "3":
             update_menu()
         elif choice == "4":
@@ -570,4 +576,4 @@ if __name__ == '__main__':
         main()
     elif args.start:
         print("Starting Red...")
-        run_red(autorestart=args.auto_restart)
+        run_red(autorestart=args.auto_restart, loop=args.loop)
@@ -6,11 +6,17 @@ import logging
 import logging.handlers
 import traceback
 import datetime
+import time
 import subprocess
+import json
+import concurrent.futures
+
+from cogs.utils.profiling import profiler, profile_boots, format_report
 
 try:
-    from discord.ext import commands
-    import discord
+    with profiler.phase("import discord"):
+        from discord.ext import commands
+        import discord
 except ImportError:
     print("Discord.py is not installed.\n"
           "Consult the guide for your operating system "
@@ -20,8 +26,19 @@ except ImportError:
 
 from cogs.utils.settings import Settings
 from cogs.utils.dataIO import dataIO
+from cogs.utils.snapshots import snapshot_every
+from cogs.utils import lazy
+from cogs.utils.pipeline import MessagePipeline
+from cogs.utils.coalesce import MessageCoalescer
+from cogs.utils.scheduler import RequestScheduler, INTERACTIVE
+from cogs.utils.metrics import metrics
+from cogs.utils.perf import CommandProfiler, invoked_name
+from cogs.utils.watchdog import LoopWatchdog
+from cogs.utils.eventloop import requested_loop, use_loop
+from cogs.utils.bus import (bus, GlobalIgnoresChanged, IgnoreListChanged,
+                            RolesChanged)
 from cogs.utils.chat_formatting import inline
-from collections import Counter
+from collections import Counter, OrderedDict
 from io import TextIOWrapper
 
 #
@@ -39,28 +56,46 @@ from io import TextIOWrapper
 
 description = "Red - A multifunction Discord bot by Twentysix"
 
+METRICS_PATH = "data/red/metrics.json"
+
 
 class Bot(commands.Bot):
     def __init__(self, *args, **kwargs):
 
         def prefix_manager(bot, message):
             """
-            Returns prefixes of the message's server if set.
-            If none are set or if the message's server is None
-            it will return the global prefixes instead.
+            Returns the prefix the message starts with, out of the
+            prefixes of the message's server if set, or the global
+            prefixes otherwise. Returns no prefix if none matches.
 
             Requires a Bot instance and a Message object to be
             passed as arguments.
             """
-            return bot.settings.get_prefixes(message.server)
+            prefix = bot.settings.get_matched_prefix(message)
+            return [prefix] if prefix is not None else []
 
         self.counter = Counter()
         self.uptime = datetime.datetime.utcnow()  # Refreshed before login
         self._message_modifiers = []
-        self.settings = Settings()
+        self._allowed = OrderedDict()  # Message id: user_allowed's result
+        self.pipeline = MessagePipeline(self)
+        for event in (GlobalIgnoresChanged, IgnoreListChanged, RolesChanged):
+            bus.subscribe(event, self._forget_allowed)
+        with profiler.phase("settings"):
+            self.settings = Settings()
+        self.scheduler = RequestScheduler(self.settings.api_concurrency)
+        self.coalescer = MessageCoalescer(self._send_message,
+                                          self.settings.coalesce_window)
+        self.command_perf = CommandProfiler(self.settings.slow_commands)
+        # Message id: when on_message got it, until a command ends for it
+        self._received = OrderedDict()
+        register_metrics(self)
+        if self.settings.profile_startup:
+            profiler.trace_allocations()
         self._intro_displayed = False
         self._shutdown_mode = None
-        self.logger = set_logger(self)
+        with profiler.phase("set_logger"):
+            self.logger = set_logger(self)
         self._last_exception = None
         self.oauth_url = ""
         if 'self_bot' in kwargs:
@@ -70,26 +105,49 @@ class Bot(commands.Bot):
             if self.settings.self_bot:
                 kwargs['pm_help'] = False
         super().__init__(*args, command_prefix=prefix_manager, **kwargs)
-
-    async def send_message(self, *args, **kwargs):
-        if self._message_modifiers:
-            if "content" in kwargs:
-                pass
-            elif len(args) == 2:
-                args = list(args)
-                kwargs["content"] = args.pop()
-            else:
-                return await super().send_message(*args, **kwargs)
-
-            content = kwargs['content']
+        self.http.request = self.scheduler.wrap(self.http.request,
+                                                self.http._locks)
+        self.watchdog = LoopWatchdog(self.loop, self.settings.stall_threshold)
+
+    async def send_message(self, destination, content=None, *,
+                           coalesce=True, priority=INTERACTIVE, **kwargs):
+        """Sends a message after running it through the message modifiers
+
+        Plain text messages can be merged with the others sent to the
+        same destination shortly after (--coalesce-window). Pass
+        coalesce=False for messages that are edited or deleted later on.
+        priority is the scheduler's class of the message"""
+        if content is not None:
             for m in self._message_modifiers:
                 try:
                     content = str(m(content))
                 except:   # Faulty modifiers should not
                     pass  # break send_message
-            kwargs['content'] = content
 
-        return await super().send_message(*args, **kwargs)
+        coalescer = self.coalescer
+        if coalescer.window:
+            if (coalesce and priority == INTERACTIVE and
+                    coalescer.accepts(content, **kwargs)):
+                return await coalescer.send(destination, content)
+            await coalescer.flush(destination)  # Keeps the messages in order
+        return await self._send_message(destination, content,
+                                        priority=priority, **kwargs)
+
+    # Messages deleted after delete_after are sent on their own, deleting
+    # a merged one would delete what was merged with it too
+    def say(self, *args, **kwargs):
+        return super().say(*args, **_alone_if_deleted(kwargs))
+
+    def whisper(self, *args, **kwargs):
+        return super().whisper(*args, **_alone_if_deleted(kwargs))
+
+    def reply(self, content, *args, **kwargs):
+        return super().reply(content, *args, **_alone_if_deleted(kwargs))
+
+    def _send_message(self, destination, content=None, *,
+                      priority=INTERACTIVE, **kwargs):
+        return self.scheduler.submit(super().send_message, destination,
+                                     content, priority=priority, **kwargs)
 
     async def shutdown(self, *, restart=False):
         """Gracefully quits Red with exit code 0
@@ -97,6 +155,7 @@ class Bot(commands.Bot):
         If restart is True, the exit code will be 26 instead
         The launcher automatically restarts Red when that happens"""
         self._shutdown_mode = not restart
+        dataIO.flush()
         await self.logout()
 
     def add_message_modifier(self, func):
@@ -141,6 +200,21 @@ class Bot(commands.Bot):
                 await self.send_message(ctx.message.channel, page)
 
     def user_allowed(self, message):
+        """Returns whether Red should respond to message
+
+        The result is remembered so that everything checking the same
+        message shares it, until the lists it depends on change"""
+        try:
+            return self._allowed[message.id]
+        except KeyError:
+            pass
+        allowed = self._user_allowed(message)
+        self._allowed[message.id] = allowed
+        if len(self._allowed) > 1000:
+            self._allowed.popitem(last=False)
+        return allowed
+
+    def _user_allowed(self, message):
         author = message.author
 
         if author.bot:
@@ -150,39 +224,54 @@ class Bot(commands.Bot):
             return self.settings.self_bot
 
         mod_cog = self.get_cog('Mod')
-        global_ignores = self.get_cog('Owner').global_ignores
+        ignored = self.get_cog('Owner').ignored
 
         if self.settings.owner == author.id:
             return True
 
-        if author.id in global_ignores["blacklist"]:
+        if author.id in ignored["blacklist"]:
             return False
 
-        if global_ignores["whitelist"]:
-            if author.id not in global_ignores["whitelist"]:
+        if ignored["whitelist"]:
+            if author.id not in ignored["whitelist"]:
                 return False
 
         if not message.channel.is_private:
-            server = message.server
-            names = (self.settings.get_server_admin(
-                server), self.settings.get_server_mod(server))
-            results = map(
-                lambda name: discord.utils.get(author.roles, name=name),
-                names)
-            for r in results:
-                if r is not None:
-                    return True
+            names = self.settings.get_server_roles(message.server)
+            if any(r.name in names for r in author.roles):
+                return True
 
         if mod_cog is not None:
             if not message.channel.is_private:
-                if message.server.id in mod_cog.ignore_list["SERVERS"]:
+                if message.server.id in mod_cog.ignored["SERVERS"]:
                     return False
 
-                if message.channel.id in mod_cog.ignore_list["CHANNELS"]:
+                if message.channel.id in mod_cog.ignored["CHANNELS"]:
                     return False
 
         return True
 
+    def _forget_allowed(self, event):
+        self._allowed.clear()
+
+    # Called by dispatch as soon as a command ends
+    def handle_command_completion(self, command, ctx):
+        self._command_ended(ctx, failed=False)
+
+    def handle_command_error(self, error, ctx):
+        self._command_ended(ctx, failed=True)
+
+    def _command_ended(self, ctx, failed):
+        if ctx.command is None:
+            return  # Not found, a cog like Alias may still reroute it
+        # Popped so a message processed again, by a lazy cog's stub,
+        # is only counted once
+        received = self._received.pop(ctx.message.id, None)
+        if received is not None:
+            elapsed = time.perf_counter() - received
+            self.command_perf.record(invoked_name(ctx), ctx.message,
+                                     elapsed, failed)
+
     async def pip_install(self, name, *, timeout=None):
         """
         Installs a pip package in the local 'lib' folder in a thread safe
@@ -219,6 +308,12 @@ class Bot(commands.Bot):
         return await asyncio.wait_for(response, timeout=timeout)
 
 
+def _alone_if_deleted(kwargs):
+    if kwargs.get("delete_after") is not None:
+        kwargs.setdefault("coalesce", False)
+    return kwargs
+
+
 class Formatter(commands.HelpFormatter):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -235,10 +330,11 @@ class Formatter(commands.HelpFormatter):
             self._paginator.add_line(shortened)
 
 
-def initialize(bot_class=Bot, formatter_class=Formatter):
+def initialize(bot_class=Bot, formatter_class=Formatter, loop=None):
     formatter = formatter_class(show_check_failure=False)
 
-    bot = bot_class(formatter=formatter, description=description, pm_help=None)
+    bot = bot_class(formatter=formatter, description=description, pm_help=None,
+                    loop=loop)
 
     import __main__
     __main__.send_cmd_help = bot.send_cmd_help  # Backwards
@@ -288,11 +384,13 @@ def initialize(bot_class=Bot, formatter_class=Formatter):
             return
         bot._intro_displayed = True
 
+        profiler.stop("connect")
         owner_cog = bot.get_cog('Owner')
-        total_cogs = len(owner_cog._list_cogs())
-        users = len(set(bot.get_all_members()))
-        servers = len(bot.servers)
-        channels = len([c for c in bot.get_all_channels()])
+        with profiler.phase("on_ready counts"):
+            total_cogs = len(owner_cog._list_cogs())
+            users = len(set(bot.get_all_members()))
+            servers = len(bot.servers)
+            channels = len([c for c in bot.get_all_channels()])
 
         login_time = datetime.datetime.utcnow() - bot.uptime
         login_time = login_time.seconds + login_time.microseconds/1E6
@@ -331,6 +429,10 @@ def initialize(bot_class=Bot, formatter_class=Formatter):
 
         await bot.get_cog('Owner').disable_commands()
 
+        results = profiler.finish()
+        if results is not None and bot.settings.profile_startup:
+            print("\n" + format_report(results))
+
     @bot.event
     async def on_resumed():
         bot.counter["session_resumed"] += 1
@@ -341,8 +443,16 @@ def initialize(bot_class=Bot, formatter_class=Formatter):
 
     @bot.event
     async def on_message(message):
+        received = time.perf_counter()
         bot.counter["messages_read"] += 1
-        if bot.user_allowed(message):
+        ctx = bot.pipeline.dispatch(message)
+        if ctx.allowed:
+            if ctx.prefix is not None:
+                # Left for the messages that never become a command
+                # to push out
+                bot._received[message.id] = received
+                if len(bot._received) > 1000:
+                    bot._received.popitem(last=False)
             await bot.process_commands(message)
 
     @bot.event
@@ -393,6 +503,44 @@ def initialize(bot_class=Bot, formatter_class=Formatter):
     return bot
 
 
+def register_metrics(bot):
+    metrics.counter("red_events_total", "Events counted in bot.counter",
+                    ("event",),
+                    func=lambda: {(k,): v for k, v in bot.counter.items()})
+    metrics.counter("red_pipeline_deliveries_total",
+                    "Messages handed to the cogs' message subscribers",
+                    func=lambda: bot.pipeline.delivered)
+    metrics.counter("red_coalesced_messages_total",
+                    "Messages merged into another one instead of being "
+                    "sent on their own", func=lambda: bot.coalescer.merged)
+    metrics.gauge("red_api_queued", "API calls waiting in the scheduler",
+                  ("priority",),
+                  func=lambda: {(name, ): s["queued"] for name, s
+                                in bot.scheduler.stats().items()})
+    metrics.gauge("red_loop_lag_seconds", "How late the event loop is on "
+                  "the watchdog's heartbeat", func=lambda: bot.watchdog.lag)
+    metrics.gauge("red_servers", "Servers Red is in",
+                  func=lambda: len(bot.servers))
+    metrics.gauge("red_uptime_seconds", "Seconds since Red logged in",
+                  func=lambda: (datetime.datetime.utcnow() -
+                                bot.uptime).total_seconds())
+
+
+def load_metrics(bot):
+    """Restores the counters saved by save_metrics"""
+    if not dataIO.is_valid_json(METRICS_PATH):
+        return
+    data = dataIO.load_json(METRICS_PATH)
+    bot.counter.update(data.get("events", {}))
+    metrics.restore(data.get("counters", {}))
+
+
+def save_metrics(bot):
+    """Saves the counters, so they keep counting after a restart"""
+    dataIO.save_json(METRICS_PATH, {"events": dict(bot.counter),
+                                    "counters": metrics.dump()})
+
+
 def check_folders():
     folders = ("data", "data/red", "cogs", "cogs/utils")
     for folder in folders:
@@ -541,7 +689,8 @@ def load_cogs(bot):
     except:
         registry = {}
 
-    bot.load_extension('cogs.owner')
+    with profiler.phase("cogs.owner"):
+        bot.load_extension('cogs.owner')
     owner_cog = bot.get_cog('Owner')
     if owner_cog is None:
         print("The owner cog is missing. It contains core functions without "
@@ -550,7 +699,7 @@ def load_cogs(bot):
 
     if bot.settings._no_cogs:
         bot.logger.debug("Skipping initial cogs loading (--no-cogs)")
-        if not os.path.isfile("data/red/cogs.json"):
+        if not dataIO.exists("data/red/cogs.json"):
             dataIO.save_json("data/red/cogs.json", {})
         return
 
@@ -561,18 +710,40 @@ def load_cogs(bot):
         for ext in defaults:
             registry["cogs." + ext] = True
 
+    def load_failed(extension, e):
+        print("{}: {}".format(e.__class__.__name__, str(e)))
+        bot.logger.exception(e)
+        failed.append(extension)
+        registry[extension] = False
+
+    # Every cog is imported first. The data files a cog declares in
+    # DATA_FILES are read in the background as soon as it's imported,
+    # while the next ones are, and are ready by the time its setup runs.
+    # Setups run after those of the cogs declared in DEPENDS
+    imported = []
     for extension in extensions:
         if extension.lower() == "cogs.owner":
             continue
         to_load = registry.get(extension, False)
+        if to_load and extension in bot.settings.lazy_cogs:
+            with profiler.phase(extension + " stubs"):
+                if lazy.install_stubs(bot, extension):
+                    continue
         if to_load:
             try:
-                owner_cog._load_cog(extension)
+                mod_obj = owner_cog._import_cog(extension)
             except Exception as e:
-                print("{}: {}".format(e.__class__.__name__, str(e)))
-                bot.logger.exception(e)
-                failed.append(extension)
-                registry[extension] = False
+                load_failed(extension, e)
+            else:
+                files = getattr(mod_obj, "DATA_FILES", ())
+                imported.append((mod_obj, dataIO.preload(files)))
+
+    for mod_obj, reads in sort_by_dependencies(imported, owner_cog):
+        try:
+            concurrent.futures.wait(reads)
+            owner_cog._setup_cog(mod_obj)
+        except Exception as e:
+            load_failed(mod_obj.__name__, e)
 
     dataIO.save_json("data/red/cogs.json", registry)
 
@@ -580,27 +751,87 @@ def load_cogs(bot):
         print("\nFailed to load: {}\n".format(" ".join(failed)))
 
 
-def main(bot):
+def sort_by_dependencies(imported, owner_cog):
+    """Orders the (module, reads) of imported so that every cog comes
+    after its dependencies, otherwise keeping their order. Cogs in a
+    dependency cycle are left at the end, where their setup fails"""
+    pending = OrderedDict((mod_obj.__name__, (mod_obj, reads))
+                          for mod_obj, reads in imported)
+    ordered = []
+    done = set()
+    while pending:
+        for name, (mod_obj, reads) in pending.items():
+            deps = owner_cog._cog_dependencies(mod_obj)
+            if all(d in done or d not in pending for d in deps):
+                break
+        else:  # Cycle
+            ordered.extend(pending.values())
+            break
+        ordered.append(pending.pop(name))
+        done.add(name)
+    return ordered
+
+
+def profile_startup(bot):
+    """Boots Red the requested number of times and reports the median
+    time spent in every phase"""
+    runs = bot.settings.profile_startup
+    print("Profiling {} boots...".format(runs))
+    results = profile_boots(runs)
+    print(format_report(results))
+    output = bot.settings.profile_output
+    if output:
+        with open(output, encoding="utf-8", mode="w") as f:
+            json.dump(results, f, indent=4)
+        print("Results saved to " + output)
+    else:
+        print(json.dumps(results))
+
+
+async def main(bot):
+    if (bot.settings._dry_run and bot.settings.profile_startup and
+            not profiler.profiled_boot):
+        profile_startup(bot)
+        bot._shutdown_mode = True
+        exit(0)
+
     check_folders()
+    load_metrics(bot)
     if not bot.settings.no_prompt:
         interactive_setup(bot.settings)
-    load_cogs(bot)
+    with profiler.phase("load_cogs"):
+        load_cogs(bot)
 
     if bot.settings._dry_run:
+        profiler.finish()
         print("Quitting: dry run")
         bot._shutdown_mode = True
         exit(0)
 
+    if bot.settings.snapshot_interval > 0:
+        bot.loop.create_task(snapshot_every(dataIO,
+                                            bot.settings.snapshot_interval))
+
+    if bot.watchdog.threshold:
+        bot.watchdog.start()
+
+    if bot.settings.metrics_port:
+        await metrics.serve(bot.settings.metrics_port)
+        print("Serving metrics at http://127.0.0.1:{}/metrics"
+              "".format(bot.settings.metrics_port))
+
     print("Logging into Discord...")
     bot.uptime = datetime.datetime.utcnow()
 
     if bot.settings.login_credentials:
-        yield from bot.login(*bot.settings.login_credentials,
-                             bot=not bot.settings.self_bot)
+        with profiler.phase("login"):
+            await bot.login(*bot.settings.login_credentials,
+                            bot=not bot.settings.self_bot)
     else:
         print("No credentials available to login.")
         raise RuntimeError()
-    yield from bot.connect()
+    profiler.start("connect")
+    await bot.connect()
 
 
 if __name__ == '__main__':
@@ -608,8 +839,12 @@ if __name__ == '__main__':
                                encoding=sys.stdout.encoding,
                                errors="replace",
                                line_buffering=True)
-    bot = initialize()
-    loop = asyncio.get_event_loop()
+    try:
+        loop = use_loop(requested_loop())
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+    bot = initialize(loop=loop)
     try:
         loop.run_until_complete(main(bot))
     except discord.LoginFailure:
@@ -634,6 +869,9 @@ if __name__ == '__main__':
                              exc_info=e)
         loop.run_until_complete(bot.logout())
     finally:
+        if not bot.settings._dry_run:
+            save_metrics(bot)
+        dataIO.flush()
         loop.close()
         if bot._shutdown_mode is True:
             exit(0)
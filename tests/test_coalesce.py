@@ -0,0 +1,125 @@
+import asyncio
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cogs.utils.coalesce import MessageCoalescer  # noqa: E402
+from test_red import BotTestCase, discord  # noqa: E402
+
+
+class MessageCoalescerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.sent = []
+        self.coalescer = MessageCoalescer(self.send, window=0.01, limit=20)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    async def send(self, destination, content):
+        self.sent.append((destination, content))
+        return len(self.sent)
+
+    def run_all(self, *coros):
+        # Started in order, gather doesn't keep it on every version
+        tasks = [asyncio.ensure_future(c) for c in coros]
+        return self.loop.run_until_complete(asyncio.gather(*tasks))
+
+    def test_messages_to_the_same_destination_are_merged(self):
+        send = self.coalescer.send
+        results = self.run_all(send("a", "one"), send("b", "two"),
+                               send("a", "three"))
+        self.assertEqual(self.sent, [("a", "one\nthree"), ("b", "two")])
+        self.assertEqual(results, [1, 2, 1])
+        self.assertEqual(self.coalescer.merged, 1)
+
+    def test_batches_stay_under_the_limit(self):
+        send = self.coalescer.send
+        self.run_all(send("a", "x" * 10), send("a", "y" * 9),
+                     send("a", "z" * 10))
+        self.assertEqual(self.sent, [("a", "x" * 10 + "\n" + "y" * 9),
+                                     ("a", "z" * 10)])
+
+    def test_accepts(self):
+        accepts = self.coalescer.accepts
+        self.assertTrue(accepts("text"))
+        self.assertFalse(accepts("text", embed=object()))
+        self.assertFalse(accepts("text", tts=True))
+        self.assertFalse(accepts(None))
+        self.assertFalse(accepts("x" * 21))
+        self.coalescer.window = 0
+        self.assertFalse(accepts("text"))
+
+    def test_flush_keeps_the_order(self):
+        async def scenario():
+            merged = asyncio.ensure_future(self.coalescer.send("a", "one"))
+            await asyncio.sleep(0)
+            await self.coalescer.flush("a")
+            self.sent.append(("a", "alone"))
+            return await merged
+
+        self.assertEqual(self.loop.run_until_complete(scenario()), 1)
+        self.assertEqual(self.sent, [("a", "one"), ("a", "alone")])
+
+    def test_failures_reach_every_sender(self):
+        async def fails(destination, content):
+            raise RuntimeError("nope")
+        self.coalescer._send = fails
+        send = self.coalescer.send
+        tasks = [asyncio.ensure_future(send("a", m)) for m in ("1", "2")]
+        results = self.loop.run_until_complete(asyncio.gather(
+            *tasks, return_exceptions=True))
+        self.assertEqual([type(r) for r in results], [RuntimeError] * 2)
+
+
+@unittest.skipIf(discord is None, "discord.py is not installed")
+class BotCoalescingTest(BotTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sent = []
+        self.bot.coalescer.window = 0.01
+        self.bot._send_message = self.bot.coalescer._send = self.send
+        self.channel = discord.Object(id="5")
+
+    def tearDown(self):
+        for task in asyncio.Task.all_tasks(self.loop):
+            task.cancel()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        super().tearDown()
+
+    async def send(self, destination, content=None, **kwargs):
+        self.sent.append((content, kwargs))
+        return discord.Object(id=str(len(self.sent)))
+
+    def test_embeds_and_delete_after_are_never_merged(self):
+        bot = self.bot
+        embed = discord.Embed(title="embed")
+
+        async def scenario():
+            _internal_channel = self.channel  # Where say sends to
+            sends = [bot.send_message(self.channel, "one"),
+                     bot.send_message(self.channel, "two", embed=embed),
+                     bot.say("three", delete_after=60),
+                     bot.send_message(self.channel, "four"),
+                     bot.send_message(self.channel, "five"),
+                     bot.send_message(self.channel, "six", coalesce=False)]
+            return await asyncio.gather(*[asyncio.ensure_future(s)
+                                          for s in sends])
+
+        results = self.loop.run_until_complete(scenario())
+        self.assertEqual([s[0] for s in self.sent],
+                         ["one", "two", "three", "four\nfive", "six"])
+        self.assertIs(self.sent[1][1]["embed"], embed)
+        self.assertEqual([r.id for r in results],
+                         ["1", "2", "3", "4", "4", "5"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cogs.utils.dataIO import DataIO  # noqa: E402
+
+
+class SaveJsonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "data.json")
+        self.dataio = DataIO()
+        self.data = {"b": [1, 2, {"c": None}], "a": "\u00e9t\u00e9",
+                     "n": 1.5, "e": {}}
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def read(self, path=None):
+        with open(path or self.path, mode="rb") as f:
+            return f.read()
+
+    def test_same_output_as_before(self):
+        legacy = os.path.join(self.folder, "legacy.json")
+        self.dataio._save_json(legacy, self.data)
+        for policy in DataIO.FSYNC_POLICIES:
+            self.dataio.fsync = policy
+            self.assertTrue(self.dataio.save_json(self.path, self.data))
+            self.assertEqual(self.read(), self.read(legacy))
+        # No tmp file left behind
+        self.assertEqual(sorted(os.listdir(self.folder)),
+                         ["data.json", "legacy.json"])
+
+    def test_unserializable_data_leaves_the_file_alone(self):
+        self.dataio.save_json(self.path, self.data)
+        before = self.read()
+        with self.assertRaises(TypeError):
+            self.dataio.save_json(self.path, {"a": object()})
+        self.assertEqual(self.read(), before)
+        self.assertEqual(os.listdir(self.folder), ["data.json"])
+
+    def test_load_after_save(self):
+        self.dataio.save_json(self.path, self.data)
+        self.assertEqual(self.dataio.load_json(self.path), self.data)
+        self.assertTrue(self.dataio.is_valid_json(self.path))
+
+
+class SaveJsonAsyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "data.json")
+        self.dataio = DataIO()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.saved = []
+        self.dataio.save_listeners.append(
+            lambda filename, changed: self.saved.append(filename))
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def hold_worker(self):
+        """Keeps the save thread busy until the returned event is set"""
+        from concurrent.futures import ThreadPoolExecutor
+        release = threading.Event()
+        self.dataio._executor = ThreadPoolExecutor(max_workers=1)
+        self.dataio._executor.submit(release.wait)
+        self.addCleanup(self.dataio._executor.shutdown)
+        self.addCleanup(release.set)
+        return release
+
+    def test_newer_save_supersedes_a_queued_one(self):
+        other = os.path.join(self.folder, "other.json")
+
+        async def save():
+            release = self.hold_worker()
+            first = self.dataio.save_json_async(self.path, {"n": 1})
+            self.dataio.save_json_async(other, {"n": 1})
+            data = {"n": 2}
+            second = self.dataio.save_json_async(self.path, data)
+            data["n"] = 3  # Copied already
+            release.set()
+            return await asyncio.gather(first, second)
+
+        self.assertEqual(self.loop.run_until_complete(save()), [True, True])
+        self.assertEqual(self.saved, [other, self.path])
+        self.assertEqual(self.dataio.load_json(self.path), {"n": 2})
+
+    def test_load_waits_for_queued_saves(self):
+        async def save():
+            release = self.hold_worker()
+            self.dataio.save_json_async(self.path, {"n": 1})
+            threading.Timer(0.05, release.set).start()
+
+        self.loop.run_until_complete(save())
+        # Blocks until the save thread is done with it
+        self.assertEqual(self.dataio.load_json(self.path), {"n": 1})
+
+    def test_tracked_data_is_saved_once(self):
+        self.dataio.save_json(self.path, {"a": 1, "b": 1})
+        data = self.dataio.load_tracked(self.path)
+        del self.saved[:]
+
+        async def save():
+            data["a"] = 2
+            first = self.dataio.save_json_async(self.path, data)
+            self.assertFalse(data.dirty)
+            second = self.dataio.save_json_async(self.path, data)
+            return await asyncio.gather(first, second)
+
+        self.assertEqual(self.loop.run_until_complete(save()), [True, True])
+        self.assertEqual(self.saved, [self.path])
+        self.assertEqual(self.dataio.skipped_saves, 1)
+        self.assertEqual(self.dataio.load_json(self.path), {"a": 2, "b": 1})
+
+
+class JournaledDocumentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "doc.json")
+        self.dataio = DataIO()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_non_string_keys(self):
+        doc = self.dataio.load_journaled(self.path)
+        doc[123] = "x"
+        doc[None] = "y"
+        self.assertIn(123, doc)
+        self.assertEqual(doc[123], "x")
+        self.assertEqual(doc.get(None), "y")
+        # Stored like json.dumps stores them
+        self.assertEqual(sorted(doc), ["123", "null"])
+        self.assertEqual(doc["123"], "x")
+
+        del doc[123]
+        self.assertNotIn(123, doc)
+        with self.assertRaises(KeyError):
+            doc[123]
+        with self.assertRaises(KeyError):
+            del doc[123]
+        doc.close()
+
+        doc = self.dataio.load_journaled(self.path)
+        self.assertNotIn(123, doc)
+        self.assertEqual(doc[None], "y")
+        doc.close()
+
+    def test_compaction_in_the_loop(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        doc = self.dataio.load_journaled(self.path, max_journal_size=100)
+
+        async def change():
+            for n in range(10):
+                doc[str(n)] = "x" * 20
+            self.assertTrue(doc._compacting)  # Saved in the background
+            while doc._compacting:
+                await asyncio.sleep(0.01)
+            doc.max_journal_size = 2**20
+            doc["last"] = 1
+
+        loop.run_until_complete(change())
+        saved = self.dataio.load_json(self.path)
+        # Saved as it was when the journal got too big
+        self.assertTrue(0 < len(saved) < 10)
+        self.assertEqual(sorted(saved), [str(n) for n in range(len(saved))])
+        # Only what the saved file doesn't cover is left in the journal
+        with open(doc.journal_path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(len(saved) + len(records), 11)
+        doc.close()
+
+        doc = self.dataio.load_journaled(self.path)
+        self.assertEqual(len(doc), 11)
+        self.assertEqual(doc["last"], 1)
+        doc.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
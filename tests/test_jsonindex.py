@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cogs.utils.dataIO import DataIO  # noqa: E402
+from cogs.utils.jsonindex import KeyIndex, skip_value  # noqa: E402
+
+
+class KeyIndexTest(unittest.TestCase):
+
+    def test_skip_value(self):
+        text = '{"a": [1, "]", {"b": "}\\""}], "c": 2}'
+        start = text.index("[")
+        self.assertEqual(text[start:skip_value(text, start)],
+                         '[1, "]", {"b": "}\\""}]')
+        self.assertEqual(skip_value("-1.5e3,", 0), 6)
+        with self.assertRaises(ValueError):
+            skip_value('"never ends', 0)
+
+    def test_get_scans_lazily(self):
+        index = KeyIndex('{"a": 1, "b": {"x": [2]}, "c": "three"}')
+        self.assertEqual(index.get("b"), {"x": [2]})
+        self.assertFalse(index.complete)
+        self.assertEqual(index.get("c"), "three")
+        with self.assertRaises(KeyError):
+            index.get("d")
+        self.assertTrue(index.complete)
+
+    def test_replace(self):
+        index = KeyIndex('{"a": 1, "c": 3}')
+        index = index.replace("a", "[10, 11]")
+        self.assertEqual(index.text, '{"a": [10, 11], "c": 3}')
+        self.assertEqual(index.get("c"), 3)
+        index = index.replace("b", "2")
+        self.assertEqual(json.loads(index.text), {"a": [10, 11], "b": 2,
+                                                  "c": 3})
+        self.assertEqual(KeyIndex("{}").replace("a", "1").get("a"), 1)
+
+
+class SetValueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "data.json")
+        self.expected = os.path.join(self.folder, "expected.json")
+        self.dataio = DataIO()
+        self.data = {"b": {"x": [1, 2], "y": {"z": None}}, "d": "four",
+                     "f": 1.5}
+        self.dataio.save_json(self.path, self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def check(self, key, value):
+        self.dataio.set_value(self.path, key, value)
+        self.data[key] = value
+        self.dataio.save_json(self.expected, self.data)
+        with open(self.path, mode="rb") as f, \
+                open(self.expected, mode="rb") as g:
+            self.assertEqual(f.read(), g.read())
+
+    def test_same_output_as_save_json(self):
+        self.check("b", {"x": [], "new": {"deeper": [1, {"a": "é"}]}})
+        self.check("a", [1, 2])     # First
+        self.check("c", {"k": 1})   # In the middle
+        self.check("z", "last")     # Last
+        self.check("d", None)
+
+    def test_empty_document(self):
+        self.data = {}
+        self.dataio.save_json(self.path, self.data)
+        self.check("a", {"b": 1})
+
+    def test_get_value(self):
+        self.assertEqual(self.dataio.get_value(self.path, "b"),
+                         self.data["b"])
+        self.dataio.set_value(self.path, "b", 5)
+        self.assertEqual(self.dataio.get_value(self.path, "b"), 5)
+        with self.assertRaises(KeyError):
+            self.dataio.get_value(self.path, "missing")
+
+    def test_non_string_keys_go_through_save_json(self):
+        self.dataio.set_value(self.path, 5, True)
+        self.assertEqual(self.dataio.load_json(self.path)["5"], True)
+
+    def test_listeners_get_the_key(self):
+        saved = []
+        self.dataio.save_listeners.append(lambda *args: saved.append(args))
+        self.dataio.set_value(self.path, "d", 4)
+        self.assertEqual(saved, [(self.path, frozenset(("d",)))])
+
+
+if __name__ == "__main__":
+    unittest.main()
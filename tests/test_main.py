@@ -0,0 +1,89 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    import discord  # noqa: F401
+except ImportError:
+    discord = None
+
+if discord is not None:
+    import red
+
+
+def free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@unittest.skipIf(discord is None, "discord.py is not installed")
+class MainTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.folder = tempfile.mkdtemp()
+        os.chdir(self.folder)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def make_bot(self, **settings):
+        options = dict(_dry_run=False, profile_startup=0, no_prompt=True,
+                       snapshot_interval=0, metrics_port=0,
+                       login_credentials=None)
+        options.update(settings)
+        return SimpleNamespace(settings=SimpleNamespace(**options),
+                               watchdog=SimpleNamespace(threshold=0),
+                               loop=self.loop)
+
+    def test_main_serves_metrics(self):
+        port = free_port()
+        bot = self.make_bot(metrics_port=port)
+        servers = []
+        serve = red.metrics.serve
+
+        async def keep(*args, **kwargs):
+            server = await serve(*args, **kwargs)
+            servers.append(server)
+            return server
+
+        async def scrape():
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+            response = await reader.read()
+            writer.close()
+            return response
+
+        with mock.patch.object(red, "load_cogs"), \
+                mock.patch.object(red.metrics, "serve", keep):
+            # No credentials: main gives up after starting everything else
+            with self.assertRaises(RuntimeError):
+                self.loop.run_until_complete(red.main(bot))
+        try:
+            self.assertEqual(len(servers), 1)
+            response = self.loop.run_until_complete(scrape())
+            self.assertTrue(response.startswith(b"HTTP/1.0 200 OK"))
+            self.assertIn(b"red_data_save_seconds", response)
+        finally:
+            for server in servers:
+                server.close()
+                self.loop.run_until_complete(server.wait_closed())
+
+
+if __name__ == "__main__":
+    unittest.main()
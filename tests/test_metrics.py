@@ -0,0 +1,150 @@
+import asyncio
+import os
+import re
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cogs.utils.metrics import MetricsRegistry  # noqa: E402
+
+# Prometheus' text format, version 0.0.4
+NAME = r"[a-zA-Z_:][a-zA-Z0-9_:]*"
+LABEL = r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\\n]|\\\\|\\"|\\n)*)"'
+SAMPLE = re.compile(r"({0})(?:\{{((?:{1})(?:,{1})*)?\}})? (?P<value>\S+)$"
+                    "".format(NAME, LABEL))
+HELP = re.compile(r"# HELP ({}) (.*)$".format(NAME))
+TYPE = re.compile(r"# TYPE ({}) (counter|gauge|histogram|summary|untyped)$"
+                  "".format(NAME))
+
+
+def parse(text):
+    """Returns {(name, ((label, value), ...)): value} and the types, fails
+    on anything Prometheus wouldn't accept"""
+    assert text.endswith("\n")
+    samples = {}
+    types = {}
+    for line in text[:-1].split("\n"):
+        if HELP.match(line):
+            continue
+        match = TYPE.match(line)
+        if match:
+            assert match.group(1) not in types, "Duplicate TYPE " + line
+            types[match.group(1)] = match.group(2)
+            continue
+        match = SAMPLE.match(line)
+        assert match, "Invalid line {!r}".format(line)
+        name, labels, value = match.group(1, 2, "value")
+        labels = tuple((k, v.replace('\\"', '"').replace("\\n", "\n")
+                        .replace("\\\\", "\\"))
+                       for k, v in re.findall(LABEL, labels or ""))
+        assert (name, labels) not in samples, "Duplicate " + line
+        samples[(name, labels)] = float(value)
+    return samples, types
+
+
+class MetricsRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = MetricsRegistry()
+
+    def test_render_parses(self):
+        metrics = self.metrics
+        counter = metrics.counter("red_a_total", 'Has "quotes"\nand lines',
+                                  ("command",))
+        counter.inc(command='say "hi"\\')
+        counter.inc(2, command="ping")
+        metrics.gauge("red_servers", "Servers", func=lambda: 3)
+        metrics.gauge("red_queued", "By server", ("server",),
+                      func=lambda: {("1",): 1.5, ("2",): 0})
+        histogram = metrics.histogram("red_x_seconds", "X", ("priority",),
+                                      buckets=(0.1, 1))
+        histogram.observe(0.05, priority="critical")
+        histogram.observe(0.5, priority="critical")
+        histogram.observe(5, priority="critical")
+
+        samples, types = parse(metrics.render())
+        self.assertEqual(types, {"red_a_total": "counter",
+                                 "red_servers": "gauge",
+                                 "red_queued": "gauge",
+                                 "red_x_seconds": "histogram"})
+        self.assertEqual(samples[("red_a_total",
+                                  (("command", 'say "hi"\\'),))], 1)
+        self.assertEqual(samples[("red_a_total", (("command", "ping"),))], 2)
+        self.assertEqual(samples[("red_servers", ())], 3)
+        self.assertEqual(samples[("red_queued", (("server", "1"),))], 1.5)
+        buckets = [samples[("red_x_seconds_bucket",
+                            (("priority", "critical"), ("le", le)))]
+                   for le in ("0.1", "1", "+Inf")]
+        self.assertEqual(buckets, [1, 2, 3])
+        critical = (("priority", "critical"),)
+        self.assertEqual(samples[("red_x_seconds_sum", critical)], 5.55)
+        self.assertEqual(samples[("red_x_seconds_count", critical)], 3)
+
+    def test_failing_funcs_are_left_out(self):
+        def broken():
+            raise RuntimeError("nope")
+        self.metrics.gauge("red_broken", "Broken", func=broken)
+        self.metrics.gauge("red_fine", "Fine", func=lambda: 1)
+        with self.assertLogs("red", "ERROR"):
+            samples, types = parse(self.metrics.render())
+        self.assertEqual(list(types), ["red_fine"])
+
+    def test_registering_again_returns_the_metric(self):
+        counter = self.metrics.counter("red_a_total", "A")
+        counter.inc()
+        self.assertIs(self.metrics.counter("red_a_total", "A"), counter)
+        with self.assertRaises(ValueError):
+            self.metrics.gauge("red_a_total", "A")
+        with self.assertRaises(ValueError):
+            counter.inc(-1)
+        with self.assertRaises(ValueError):
+            counter.inc(label="x")
+
+    def test_counters_are_kept_across_restarts(self):
+        self.metrics.counter("red_a_total", "A", ("c",)).inc(c="x")
+        self.metrics.counter("red_b_total", "B").inc(4)
+        self.metrics.counter("red_func_total", "F", func=lambda: 9)
+        data = self.metrics.dump()
+        self.assertNotIn("red_func_total", data)
+
+        restarted = MetricsRegistry()
+        restarted.counter("red_a_total", "A", ("c",)).inc(c="x")
+        restarted.restore(data)
+        self.assertEqual(restarted.get("red_a_total").get(c="x"), 2)
+        # Registered after the restore, like the counters of cogs
+        self.assertEqual(restarted.counter("red_b_total", "B").get(), 4)
+
+    def test_serve(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+        self.addCleanup(loop.close)
+        self.metrics.counter("red_a_total", "A").inc()
+
+        async def get(path):
+            reader, writer = await asyncio.open_connection("127.0.0.1",
+                                                           port)
+            writer.write("GET {} HTTP/1.0\r\nHost: x\r\n\r\n"
+                         "".format(path).encode())
+            response = await reader.read()
+            writer.close()
+            return response.decode()
+
+        server = loop.run_until_complete(self.metrics.serve(0))
+        port = server.sockets[0].getsockname()[1]
+        try:
+            response = loop.run_until_complete(get("/metrics"))
+            head, body = response.split("\r\n\r\n", 1)
+            self.assertTrue(head.startswith("HTTP/1.0 200"))
+            self.assertEqual(parse(body)[0][("red_a_total", ())], 1)
+            response = loop.run_until_complete(get("/"))
+            self.assertTrue(response.startswith("HTTP/1.0 404"))
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cogs.utils.perf import (CommandProfiler, LatencySketch,  # noqa: E402
+                             format_stats, invoked_name)
+
+
+def message(server="1", content="!ping"):
+    return SimpleNamespace(server=SimpleNamespace(id=server) if server
+                           else None,
+                           channel=SimpleNamespace(id="2"), content=content)
+
+
+class LatencySketchTest(unittest.TestCase):
+
+    def test_quantiles_are_within_two_percent(self):
+        sketch = LatencySketch()
+        samples = [i / 1000 for i in range(1, 1001)]  # 1ms to 1s
+        for s in reversed(samples):
+            sketch.add(s)
+        for q in (0.5, 0.95, 0.99):
+            exact = samples[int(q * len(samples)) - 1]
+            self.assertAlmostEqual(sketch.quantile(q), exact,
+                                   delta=exact * 0.02)
+        self.assertEqual(sketch.quantile(1), 1)
+        self.assertEqual(sketch.count, 1000)
+        self.assertLess(len(sketch.buckets), 400)
+
+    def test_empty_and_tiny(self):
+        sketch = LatencySketch()
+        self.assertEqual(sketch.quantile(0.5), 0.0)
+        sketch.add(0)
+        self.assertEqual(sketch.quantile(0.5), 0)
+
+
+class CommandProfilerTest(unittest.TestCase):
+
+    def test_record(self):
+        profiler = CommandProfiler()
+        profiler.record("ping", message(), 0.01)
+        profiler.record("ping", message("3"), 0.02, failed=True)
+        profiler.record("ping", message(None), 0.03)
+        stats = profiler.commands["ping"].as_dict()
+        self.assertEqual((stats["calls"], stats["errors"]), (3, 1))
+        self.assertAlmostEqual(stats["max_ms"], 30)
+        servers = profiler.by_server("ping")
+        self.assertEqual(set(servers), {"1", "3", None})
+        self.assertEqual(servers["3"].errors, 1)
+        self.assertEqual(profiler.by_server("pong"), {})
+
+    def test_least_recently_used_servers_are_dropped(self):
+        profiler = CommandProfiler(max_server_stats=2)
+        for server in ("1", "2", "1", "3"):
+            profiler.record("ping", message(server), 0.01)
+        self.assertEqual(list(profiler.servers), [("ping", "1"),
+                                                  ("ping", "3")])
+        self.assertEqual(profiler.commands["ping"].calls, 4)
+
+    def test_slow_commands(self):
+        profiler = CommandProfiler(slow_threshold=0.5)
+        with self.assertLogs("red", "WARNING"):
+            profiler.record("ping", message(), 1)
+        profiler.record("ping", message(), 0.1)
+        self.assertEqual([s[2] for s in profiler.slow], [1])
+        profiler.reset()
+        self.assertEqual((profiler.commands, len(profiler.slow)), ({}, 0))
+
+    def test_format_stats(self):
+        profiler = CommandProfiler()
+        profiler.record("ping", message(), 0.01)
+        lines = format_stats(list(profiler.commands.items()),
+                             "command").splitlines()
+        self.assertEqual(lines[0].split()[:3], ["command", "calls", "err%"])
+        self.assertEqual(lines[1].split()[:3], ["ping", "1", "0.0"])
+
+
+class InvokedNameTest(unittest.TestCase):
+
+    def test_subcommands(self):
+        add = SimpleNamespace(qualified_name="playlist add")
+        playlist = SimpleNamespace(qualified_name="playlist",
+                                   commands={"add": add})
+        ctx = SimpleNamespace(command=playlist, prefix="!",
+                              message=message(content="!playlist add x"))
+        self.assertEqual(invoked_name(ctx), "playlist add")
+        ctx.message = message(content="!playlist x add")
+        self.assertEqual(invoked_name(ctx), "playlist")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cogs.utils.pipeline import MessagePipeline  # noqa: E402
+
+
+class FakeBot:
+
+    def __init__(self):
+        self.lookups = 0
+        self.settings = SimpleNamespace(get_matched_prefix=self.prefix)
+
+    def prefix(self, message):
+        self.lookups += 1
+        return "!" if message.content.startswith("!") else None
+
+    def user_allowed(self, message):
+        return message.author.id != "banned"
+
+
+class MessagePipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.bot = FakeBot()
+        self.pipeline = MessagePipeline(self.bot)
+        self.received = []
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def message(self, content, channel="1", private=False, author="2"):
+        return SimpleNamespace(content=content,
+                               author=SimpleNamespace(id=author),
+                               server=None if private else
+                               SimpleNamespace(id="3"),
+                               channel=SimpleNamespace(id=channel,
+                                                       is_private=private))
+
+    def subscriber(self, name):
+        async def callback(ctx):
+            self.received.append((name, ctx.content))
+        return callback
+
+    def dispatch(self, *messages):
+        ctxs = [self.pipeline.dispatch(m) for m in messages]
+        self.loop.run_until_complete(asyncio.sleep(0))
+        return ctxs
+
+    def test_filters(self):
+        self.pipeline.subscribe(self.subscriber("all"))
+        self.pipeline.subscribe(self.subscriber("prefixed"), prefixed=True,
+                                server_only=True)
+        self.pipeline.subscribe(self.subscriber("channel"), channel="5")
+        self.dispatch(self.message("hi"), self.message("!ping"),
+                      self.message("!pm", private=True),
+                      self.message("answer", channel="5"))
+        self.assertEqual(sorted(self.received),
+                         [("all", "!ping"), ("all", "!pm"),
+                          ("all", "answer"), ("all", "hi"),
+                          ("channel", "answer"), ("prefixed", "!ping")])
+        self.assertEqual(self.pipeline.delivered, 6)
+
+    def test_context_is_worked_out_once(self):
+        for _ in range(3):
+            self.pipeline.subscribe(self.subscriber("p"), prefixed=True)
+        ctx, = self.dispatch(self.message("!Ping", author="banned"))
+        self.assertEqual(self.bot.lookups, 1)
+        self.assertEqual((ctx.prefix, ctx.invoked, ctx.lowered),
+                         ("!", "Ping", "!ping"))
+        self.assertFalse(ctx.allowed)
+        ctx, = self.dispatch(self.message("Ping"))
+        self.assertIsNone(ctx.invoked)
+        self.assertEqual(self.bot.lookups, 2)
+
+    def test_unsubscribe(self):
+        everywhere = self.subscriber("a")
+        self.pipeline.subscribe(everywhere)
+        self.pipeline.subscribe(everywhere, channel="5")
+        self.pipeline.subscribe(everywhere, channel="6")
+        self.pipeline.unsubscribe(everywhere, channel="5")
+        self.assertEqual(list(self.pipeline._channels), ["6"])
+        self.pipeline.unsubscribe(everywhere)
+        self.dispatch(self.message("x", channel="6"))
+        self.assertEqual(self.received, [])
+        self.assertEqual(self.pipeline._channels, {})
+
+    def test_errors_dont_stop_the_others(self):
+        async def fails(ctx):
+            raise RuntimeError("nope")
+        self.pipeline.subscribe(fails)
+        self.pipeline.subscribe(self.subscriber("ok"))
+        with self.assertLogs("red", "ERROR"):
+            self.dispatch(self.message("x"))
+        self.assertEqual(self.received, [("ok", "x")])
+
+
+if __name__ == "__main__":
+    unittest.main()
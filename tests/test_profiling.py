@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cogs.utils import profiling  # noqa: E402
+from cogs.utils.profiling import (BootProfiler, format_report,  # noqa: E402
+                                  summarize)
+
+
+class BootProfilerTest(unittest.TestCase):
+
+    def test_nested_phases(self):
+        profiler = BootProfiler()
+        with profiler.phase("load_cogs"):
+            with profiler.phase("cogs.mod setup"):
+                pass
+        names = [p.name for p in profiler.phases]
+        self.assertEqual(names, ["load_cogs > cogs.mod setup", "load_cogs"])
+        results = profiler.results()
+        self.assertEqual(results["phases"][0]["parent"], "load_cogs")
+        self.assertGreaterEqual(results["phases"][1]["ms"],
+                                results["phases"][0]["ms"])
+
+    def test_nothing_is_recorded_after_the_boot(self):
+        profiler = BootProfiler()
+        profiler.start("connect")
+        with mock.patch.dict(os.environ):
+            os.environ.pop(profiling.OUTPUT_ENV, None)
+            results = profiler.finish()
+        self.assertEqual(results["phases"], [])
+        self.assertIsNone(profiler.finish())
+        with profiler.phase("late"):
+            pass
+        profiler.stop("connect")
+        self.assertEqual(profiler.phases, [])
+
+    def test_allocations(self):
+        profiler = BootProfiler()
+        profiler.trace_allocations()
+        with profiler.phase("alloc"):
+            data = [bytearray(1024) for _ in range(100)]
+        profiler.finish()
+        self.assertGreater(profiler.phases[0].allocated, 100 * 1024)
+        del data
+
+    def test_results_are_written_for_profile_boots(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        path = os.path.join(folder, "boot.json")
+        profiler = BootProfiler()
+        with profiler.phase("a"):
+            pass
+        with mock.patch.dict(os.environ, {profiling.OUTPUT_ENV: path}):
+            self.assertTrue(profiler.profiled_boot)
+            profiler.finish()
+        with open(path) as f:
+            self.assertEqual(json.load(f)["phases"][0]["name"], "a")
+
+
+class SummaryTest(unittest.TestCase):
+
+    def boot(self, total, ms, alloc=None):
+        return {"total_ms": total,
+                "phases": [{"name": "a", "parent": None, "ms": ms,
+                            "cpu_ms": ms, "alloc_kb": alloc}]}
+
+    def test_summarize(self):
+        summary = summarize([self.boot(10, 1, 5), self.boot(30, 3),
+                             self.boot(20, 2, 7)])
+        self.assertEqual(summary["runs"], 3)
+        self.assertEqual(summary["total_ms"], 20)
+        self.assertEqual((summary["min_total_ms"], summary["max_total_ms"]),
+                         (10, 30))
+        phase = summary["phases"][0]
+        self.assertEqual((phase["ms"], phase["min_ms"], phase["max_ms"]),
+                         (2, 1, 3))
+        self.assertEqual(phase["alloc_kb"], 6)
+
+    def test_report_lists_the_slowest_first(self):
+        results = {"total_ms": 10,
+                   "phases": [{"name": "fast", "ms": 1, "cpu_ms": 1,
+                               "alloc_kb": None},
+                              {"name": "slow", "ms": 5, "cpu_ms": 4,
+                               "alloc_kb": 12.0}]}
+        lines = format_report(results).splitlines()
+        self.assertEqual([l.split()[0] for l in lines],
+                         ["phase", "slow", "fast", "total"])
+        self.assertEqual(lines[1].split()[-1], "12")
+        self.assertEqual(lines[2].split()[-1], "-")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import asyncio
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    import discord
+except ImportError:
+    discord = None
+
+if discord is not None:
+    import red
+    from cogs.utils.bus import (bus, GlobalIgnoresChanged, IgnoreListChanged,
+                                RolesChanged)
+
+
+class BotTestCase(unittest.TestCase):
+    """Runs Red's Bot in a temporary folder, without logging in"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.folder = tempfile.mkdtemp()
+        os.chdir(self.folder)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        with mock.patch.object(sys, "argv", ["red.py"]), \
+                redirect_stdout(io.StringIO()):
+            self.bot = red.initialize(loop=self.loop)
+        self.bot.settings.owner = "1"
+
+    def tearDown(self):
+        for event in (GlobalIgnoresChanged, IgnoreListChanged,
+                      RolesChanged):
+            bus.unsubscribe(event, self.bot._forget_allowed)
+        self.bot.http.session.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+@unittest.skipIf(discord is None, "discord.py is not installed")
+class UserAllowedTest(BotTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.owner_cog = SimpleNamespace(ignored={"blacklist": set(),
+                                                  "whitelist": set()})
+        self.mod_cog = SimpleNamespace(ignored={"SERVERS": set(),
+                                                "CHANNELS": set()})
+        self.bot.cogs["Owner"] = self.owner_cog
+        self.bot.cogs["Mod"] = self.mod_cog
+        self.n = 0
+
+    def message(self, author="2", roles=(), bot=False, private=False):
+        self.n += 1
+        roles = [SimpleNamespace(name=r) for r in roles]
+        return SimpleNamespace(
+            id=str(self.n),
+            author=SimpleNamespace(id=author, bot=bot, roles=roles),
+            server=None if private else SimpleNamespace(id="10"),
+            channel=SimpleNamespace(id="20", is_private=private))
+
+    def test_lists(self):
+        allowed = self.bot.user_allowed
+        self.assertTrue(allowed(self.message()))
+        self.assertFalse(allowed(self.message(bot=True)))
+        self.owner_cog.ignored["blacklist"].add("2")
+        self.assertFalse(allowed(self.message()))
+        self.assertTrue(allowed(self.message(author="1")))  # Owner
+        self.owner_cog.ignored["blacklist"].clear()
+        self.owner_cog.ignored["whitelist"].add("3")
+        self.assertFalse(allowed(self.message()))
+        self.assertTrue(allowed(self.message(author="3")))
+
+    def test_ignored_servers_and_channels(self):
+        allowed = self.bot.user_allowed
+        self.mod_cog.ignored["CHANNELS"].add("20")
+        self.assertFalse(allowed(self.message()))
+        self.assertTrue(allowed(self.message(private=True)))
+        # Admins and mods are heard everywhere
+        self.assertTrue(allowed(self.message(roles=["Process"])))
+        self.mod_cog.ignored["CHANNELS"].clear()
+        self.mod_cog.ignored["SERVERS"].add("10")
+        self.assertFalse(allowed(self.message()))
+
+    def test_result_is_remembered_until_the_lists_change(self):
+        message = self.message()
+        self.assertTrue(self.bot.user_allowed(message))
+        self.owner_cog.ignored["blacklist"].add("2")
+        self.assertTrue(self.bot.user_allowed(message))
+        bus.publish(GlobalIgnoresChanged("blacklist"))
+        self.assertFalse(self.bot.user_allowed(message))
+        self.owner_cog.ignored["blacklist"].clear()
+        self.mod_cog.ignored["SERVERS"].add("10")
+        bus.publish(IgnoreListChanged("SERVERS"))
+        self.assertFalse(self.bot.user_allowed(message))
+        self.mod_cog.ignored["SERVERS"].clear()
+        self.assertFalse(self.bot.user_allowed(message))
+        bus.publish(IgnoreListChanged("SERVERS"))
+        self.assertTrue(self.bot.user_allowed(message))
+
+
+if __name__ == "__main__":
+    unittest.main()
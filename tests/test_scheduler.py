@@ -0,0 +1,161 @@
+import asyncio
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cogs.utils.scheduler import (BACKGROUND, CRITICAL,  # noqa: E402
+                                  INTERACTIVE, RequestScheduler)
+
+
+class RequestSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.ran = []
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def request(self, name, gate=None):
+        async def request():
+            self.ran.append(name)
+            if gate is not None:
+                await gate.wait()
+            return name
+        return request
+
+    def run_all(self, *coros):
+        return self.loop.run_until_complete(asyncio.gather(*coros))
+
+    def test_critical_jobs_run_before_background_jobs(self):
+        scheduler = RequestScheduler(concurrency=1)
+        gate = asyncio.Event()
+
+        async def scenario():
+            first = asyncio.ensure_future(
+                scheduler.queue(self.request("first", gate)))
+            await asyncio.sleep(0.01)  # The only slot is taken
+            queued = [scheduler.queue(self.request("background"),
+                                      priority=BACKGROUND),
+                      scheduler.queue(self.request("interactive")),
+                      scheduler.queue(self.request("critical"),
+                                      priority=CRITICAL)]
+            queued = [asyncio.ensure_future(q) for q in queued]
+            await asyncio.sleep(0.01)
+            self.assertEqual(scheduler.stats()["background"]["queued"], 1)
+            gate.set()
+            return await asyncio.gather(first, *queued)
+
+        results = self.loop.run_until_complete(scenario())
+        self.assertEqual(results, ["first", "background", "interactive",
+                                   "critical"])
+        self.assertEqual(self.ran, ["first", "critical", "interactive",
+                                    "background"])
+        stats = scheduler.stats()
+        self.assertEqual(stats["critical"]["done"], 1)
+        self.assertEqual(stats["interactive"]["done"], 2)
+        self.assertEqual(stats["background"]["queued"], 0)
+
+    def test_concurrency(self):
+        scheduler = RequestScheduler(concurrency=2)
+        gate = asyncio.Event()
+        running = []
+
+        async def request(name):
+            running.append(name)
+            await gate.wait()
+            return name
+
+        async def scenario():
+            jobs = [asyncio.ensure_future(scheduler.queue(request, n))
+                    for n in range(3)]
+            await asyncio.sleep(0.01)
+            self.assertEqual(running, [0, 1])
+            gate.set()
+            return await asyncio.gather(*jobs)
+
+        self.assertEqual(self.loop.run_until_complete(scenario()), [0, 1, 2])
+
+    def test_one_job_per_bucket_at_a_time(self):
+        scheduler = RequestScheduler(concurrency=10)
+        gate = asyncio.Event()
+
+        async def scenario():
+            jobs = [scheduler.queue(self.request("a1", gate), route="a"),
+                    scheduler.queue(self.request("a2"), route="a"),
+                    scheduler.queue(self.request("b1"), route="b")]
+            jobs = [asyncio.ensure_future(j) for j in jobs]
+            await asyncio.sleep(0.01)
+            self.assertEqual(self.ran, ["a1", "b1"])
+            gate.set()
+            return await asyncio.gather(*jobs)
+
+        self.loop.run_until_complete(scenario())
+        self.assertEqual(self.ran, ["a1", "b1", "a2"])
+
+    def test_exhausted_buckets_are_skipped_until_reset(self):
+        lock = asyncio.Lock()
+        scheduler = RequestScheduler()
+        scheduler._locks = {"a": lock}
+
+        async def scenario():
+            await lock.acquire()  # discord.py waiting for the reset
+            jobs = [asyncio.ensure_future(scheduler.queue(
+                self.request("a"), route="a")),
+                    asyncio.ensure_future(scheduler.queue(
+                        self.request("b"), route="b"))]
+            await asyncio.sleep(0.01)
+            self.assertEqual(self.ran, ["b"])
+            lock.release()
+            return await asyncio.gather(*jobs)
+
+        self.assertEqual(self.loop.run_until_complete(scenario()),
+                         ["a", "b"])
+
+    def test_failures_reach_the_caller(self):
+        scheduler = RequestScheduler()
+
+        async def fails():
+            raise RuntimeError("nope")
+
+        with self.assertRaises(RuntimeError):
+            self.loop.run_until_complete(scheduler.queue(fails))
+        self.assertEqual(scheduler.stats()["interactive"]["failed"], 1)
+        with self.assertRaises(ValueError):
+            self.loop.run_until_complete(scheduler.queue(fails, priority=5))
+
+    def test_submit_queues_requests_with_its_priority(self):
+        scheduler = RequestScheduler()
+        priorities = []
+
+        async def request(route, **kwargs):
+            return route
+
+        scheduled = scheduler.wrap(request)
+        original = scheduler.queue
+
+        def queue(func, *args, priority=INTERACTIVE, **kwargs):
+            priorities.append(priority)
+            return original(func, *args, priority=priority, **kwargs)
+        scheduler.queue = queue
+
+        class Route:
+            bucket = "a"
+
+        async def ban():
+            return await scheduled(Route)
+
+        result = self.loop.run_until_complete(
+            scheduler.submit(ban, priority=CRITICAL))
+        self.assertIs(result, Route)
+        self.loop.run_until_complete(scheduled(Route))
+        self.assertEqual(priorities, [CRITICAL, INTERACTIVE])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    import discord
+except ImportError:
+    discord = None
+
+if discord is not None:
+    from cogs.utils.settings import Settings
+
+
+@unittest.skipIf(discord is None, "discord.py is not installed")
+class SettingsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.folder = tempfile.mkdtemp()
+        os.chdir(self.folder)
+        self.settings = Settings(parse_args=False)
+        self.server = discord.Server(id="1")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_get_server_returns_a_copy(self):
+        self.settings.set_server_admin(self.server, "Admins")
+        server = self.settings.get_server(self.server)
+        self.assertIs(type(server), dict)
+        server["ADMIN_ROLE"] = "Changed"
+        json.dumps(server)
+        self.assertEqual(self.settings.get_server_admin(self.server),
+                         "Admins")
+        self.assertEqual(self.settings.get_server(None)["ADMIN_ROLE"],
+                         "Transistor")
+
+    def test_server_view(self):
+        view = self.settings.server_view(self.server)
+        self.assertEqual(view["MOD_ROLE"], "Process")
+        self.settings.set_server_mod(self.server, "Mods")
+        view = self.settings.server_view(self.server)
+        self.assertEqual(view["MOD_ROLE"], "Mods")
+        self.assertIs(self.settings.server_view(self.server), view)
+        with self.assertRaises(TypeError):
+            view["MOD_ROLE"] = "Changed"
+        self.settings.set_server_mod(self.server, "Others")
+        self.assertEqual(view["MOD_ROLE"], "Others")
+
+    def test_roles_cache(self):
+        self.assertEqual(self.settings.get_server_roles(self.server),
+                         ("Transistor", "Process"))
+        self.settings.default_admin = "Admins"
+        self.assertEqual(self.settings.get_server_roles(self.server),
+                         ("Admins", "Process"))
+        self.settings.set_server_admin(self.server, "Owners")
+        self.assertEqual(self.settings.get_server_roles(self.server),
+                         ("Owners", "Process"))
+
+    def test_match_prefix_picks_the_longest(self):
+        self.settings.prefixes = ["!", "!!", "red "]
+        self.assertEqual(self.settings.match_prefix(None, "!!ping"), "!!")
+        self.assertEqual(self.settings.match_prefix(None, "!ping"), "!")
+        self.assertEqual(self.settings.match_prefix(None, "red ping"),
+                         "red ")
+        self.assertIsNone(self.settings.match_prefix(None, "ping !"))
+
+    def test_server_prefixes(self):
+        self.settings.prefixes = ["!"]
+        self.assertEqual(self.settings.match_prefix(self.server, "!a"), "!")
+        self.settings.set_server_prefixes(self.server, ["?", "?."])
+        self.assertEqual(self.settings.match_prefix(self.server, "?.a"),
+                         "?.")
+        self.assertIsNone(self.settings.match_prefix(self.server, "!a"))
+        self.assertEqual(self.settings.match_prefix(None, "!a"), "!")
+
+    def test_matched_prefix_is_shared(self):
+        self.settings.prefixes = ["!"]
+        message = SimpleNamespace(id="1", content="!ping", server=None)
+        self.assertEqual(self.settings.get_matched_prefix(message), "!")
+        with mock.patch.object(self.settings, "match_prefix") as match:
+            self.assertEqual(self.settings.get_matched_prefix(message), "!")
+        match.assert_not_called()
+        message.content = "?ping"  # Edited
+        self.assertIsNone(self.settings.get_matched_prefix(message))
+        # Changing the prefixes forgets what was matched
+        self.settings.prefixes = ["?"]
+        self.assertEqual(self.settings.get_matched_prefix(message), "?")
+
+
+if __name__ == "__main__":
+    unittest.main()
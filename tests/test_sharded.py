@@ -0,0 +1,98 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cogs.utils.dataIO import DataIO  # noqa: E402
+from cogs.utils.sqlite_engine import SQLiteEngine  # noqa: E402
+
+
+class ShardedDocumentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.shards = os.path.join(self.folder, "bank")
+        self.dataio = DataIO()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_legacy_file_is_split(self):
+        legacy = os.path.join(self.folder, "bank.json")
+        self.dataio.save_json(legacy, {"1": {"a": 1}, "2/3": {"b": 2}})
+        doc = self.dataio.load_sharded(self.shards, legacy=legacy)
+        self.assertFalse(os.path.exists(legacy))
+        self.assertTrue(os.path.isfile(legacy + ".bak"))
+        self.assertEqual(sorted(os.listdir(self.shards)),
+                         ["1.json", "2%2F3.json"])
+        self.assertEqual(sorted(doc), ["1", "2/3"])
+        self.assertEqual(doc.loaded, 0)
+        self.assertEqual(doc["2/3"], {"b": 2})
+        self.assertEqual(doc.loaded, 1)
+
+    def test_only_changed_shards_are_saved(self):
+        doc = self.dataio.load_sharded(self.shards)
+        doc["1"] = {"a": 1}
+        doc["2"] = {"b": 2}
+        doc.save()
+        saved = []
+        self.dataio.save_listeners.append(lambda f, c: saved.append(f))
+        doc["1"]["a"] = 5
+        doc["2"]
+        doc.save()
+        self.assertEqual(saved, [doc.path("1")])
+
+    def test_idle_shards_are_evicted_and_saved(self):
+        doc = self.dataio.load_sharded(self.shards, idle_timeout=60)
+        doc["1"] = {"a": 1}
+        doc["2"] = {"b": 2}
+        doc.save()
+        doc["1"]["a"] = 5  # Changed but not saved yet
+        doc._last_used["1"] -= 120
+        doc._last_used["2"] -= 120
+        doc.evict_idle()
+        self.assertEqual((doc.loaded, doc.evicted), (0, 2))
+        self.assertEqual(self.dataio.load_json(doc.path("1")), {"a": 5})
+        self.assertEqual(doc["1"], {"a": 5})
+
+    def test_delete(self):
+        doc = self.dataio.load_sharded(self.shards)
+        doc["1"] = {}
+        doc.save()
+        del doc["1"]
+        self.assertNotIn("1", doc)
+        self.assertFalse(os.path.exists(doc.path("1")))
+
+    def test_peek_doesnt_load(self):
+        doc = self.dataio.load_sharded(self.shards)
+        doc["1"] = {"a": 1}
+        doc["2"] = {"b": 2}
+        doc.save()
+
+        doc = self.dataio.load_sharded(self.shards)
+        self.assertEqual(doc.peek("1"), {"a": 1})
+        self.assertEqual(doc.loaded, 0)
+        self.assertEqual(doc["2"], {"b": 2})
+        self.assertIs(doc.peek("2"), doc["2"])
+        with self.assertRaises(KeyError):
+            doc.peek("3")
+
+    def test_no_folder_with_an_engine(self):
+        engine = SQLiteEngine(os.path.join(self.folder, "red.sqlite3"),
+                              root=self.folder)
+        self.addCleanup(engine.conn.close)
+        self.dataio.use_engine(engine)
+        doc = self.dataio.load_sharded(self.shards)
+        doc["1"] = {"a": 1}
+        doc.save()
+        self.assertFalse(os.path.exists(self.shards))
+        doc = self.dataio.load_sharded(self.shards)
+        self.assertEqual(doc["1"], {"a": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
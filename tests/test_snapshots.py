@@ -0,0 +1,81 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cogs.utils import snapshots  # noqa: E402
+from cogs.utils.dataIO import DataIO  # noqa: E402
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.root = os.path.join(self.folder, "data")
+        self.snapshots = os.path.join(self.folder, "snapshots")
+        os.makedirs(os.path.join(self.root, "cog"))
+        self.dataio = DataIO()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def take(self, **kwargs):
+        kwargs.setdefault("compress", False)
+        return snapshots.take_snapshot(self.dataio, root=self.root,
+                                       folder=self.snapshots, **kwargs)
+
+    def test_copies_then_links_unchanged_files(self):
+        self.dataio.save_json(os.path.join(self.root, "cog", "a.json"), {})
+        first = self.take()
+        self.assertEqual((first.copied, first.linked), (1, 0))
+        second = self.take()
+        self.assertEqual((second.copied, second.linked), (0, 1))
+        self.assertTrue(os.path.isfile(os.path.join(second.path, "cog",
+                                                    "a.json")))
+
+    def test_file_deleted_after_listing_is_skipped(self):
+        snapshot = snapshots.Snapshot(os.path.join(self.folder, "s"))
+        missing = os.path.join(self.root, "cog", "gone.json")
+        snapshots._snapshot_file(snapshot, missing,
+                                 os.path.join(self.folder, "gone.json"), None)
+        self.assertEqual(snapshot.copied, 0)
+
+        self.dataio.save_json(os.path.join(self.root, "cog", "a.json"), {})
+        # Lists a file that has been deleted since
+        listed = [(dirpath, dirnames, filenames + ["gone.json"])
+                  for dirpath, dirnames, filenames in os.walk(self.root)]
+        with mock.patch.object(snapshots.os, "walk", return_value=listed):
+            snapshot = self.take()
+        self.assertEqual(snapshot.copied, 1)
+
+    def test_prune_skips_snapshots_being_compressed(self):
+        busy = self.take()
+        with snapshots._compressing_lock:
+            snapshots._compressing.add(os.path.normpath(busy.path))
+        try:
+            for _ in range(2):
+                self.take(keep=1)
+            self.assertTrue(os.path.isdir(busy.path))
+        finally:
+            with snapshots._compressing_lock:
+                snapshots._compressing.discard(os.path.normpath(busy.path))
+        self.take(keep=1)
+        self.assertFalse(os.path.isdir(busy.path))
+        self.assertEqual(len(os.listdir(self.snapshots)), 1)
+
+    def test_compress(self):
+        self.dataio.save_json(os.path.join(self.root, "a.json"), {})
+        snapshot = self.take(compress=True)
+        archive = snapshot.compressed.result(timeout=10)
+        self.assertTrue(os.path.isfile(archive))
+        self.assertNotIn(os.path.normpath(snapshot.path),
+                         snapshots._compressing)
+
+
+if __name__ == "__main__":
+    unittest.main()
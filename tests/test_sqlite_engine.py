@@ -0,0 +1,103 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cogs.utils.dataIO import DataIO, dataIO  # noqa: E402
+from cogs.utils.sqlite_engine import (SQLiteEngine, export_data,  # noqa: E402
+                                      import_data)
+
+
+class SQLiteEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.root = os.path.join(self.folder, "data")
+        os.makedirs(os.path.join(self.root, "cog"))
+        self.path = os.path.join(self.root, "cog", "settings.json")
+        self.engine = SQLiteEngine(os.path.join(self.folder, "red.sqlite3"),
+                                   root=self.root)
+
+    def tearDown(self):
+        self.engine.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def entries(self):
+        return dict(self.engine.conn.execute("SELECT key, value FROM "
+                                             "entries").fetchall())
+
+    def test_handles(self):
+        self.assertTrue(self.engine.handles(self.path))
+        self.assertFalse(self.engine.handles(self.path[:-5] + ".txt"))
+        self.assertFalse(self.engine.handles(os.path.join(self.folder,
+                                                          "a.json")))
+
+    def test_round_trip(self):
+        data = {"a": 1, "b": {"c": [1, 2]}, "5": None}
+        self.engine.save(self.path, data)
+        self.assertTrue(self.engine.exists(self.path))
+        self.assertEqual(self.engine.load(self.path), data)
+        self.engine.save(self.path, [1, 2])
+        self.assertEqual(self.engine.load(self.path), [1, 2])
+        self.engine.delete(self.path)
+        self.assertFalse(self.engine.exists(self.path))
+        with self.assertRaises(FileNotFoundError):
+            self.engine.load(self.path)
+
+    def test_only_changed_keys_are_written(self):
+        self.engine.save(self.path, {"a": 1, "b": 2})
+        self.engine.conn.execute("UPDATE entries SET value = '5' "
+                                 "WHERE key = 'b'")
+        # b is assumed to be unchanged, a was removed
+        self.engine.save(self.path, {"b": 2, "c": 3}, changed={"a", "c"})
+        self.assertEqual(self.entries(), {"b": "5", "c": "3"})
+        # Without changed every key is compared to what was saved
+        self.engine.save(self.path, {"b": 4, "c": 3})
+        self.assertEqual(self.entries(), {"b": "4", "c": "3"})
+
+    def test_single_values(self):
+        self.engine.save(self.path, {"a": 1})
+        self.assertEqual(self.engine.get_value(self.path, "a"), 1)
+        self.engine.set_value(self.path, 2, {"x": True})
+        self.assertEqual(self.engine.load(self.path),
+                         {"a": 1, "2": {"x": True}})
+        with self.assertRaises(KeyError):
+            self.engine.get_value(self.path, "missing")
+
+    def test_dataio_goes_through_the_engine(self):
+        dataio = DataIO()
+        dataio.use_engine(self.engine)
+        dataio.save_json(self.path, {"a": 1})
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(dataio.load_json(self.path), {"a": 1})
+        self.assertTrue(dataio.is_valid_json(self.path))
+        self.assertEqual(dataio.list_json(os.path.dirname(self.path)),
+                         ["settings.json"])
+        dataio.delete(self.path)
+        self.assertFalse(dataio.exists(self.path))
+
+    def test_import_and_export(self):
+        dataIO.save_json(self.path, {"a": [1, 2]})
+        with open(os.path.join(self.root, "cog", "broken.json"), "w") as f:
+            f.write("{")
+        with redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(import_data(self.engine, self.root), 1)
+        self.assertIn("broken.json", out.getvalue())
+        self.assertEqual(self.engine.load(self.path), {"a": [1, 2]})
+
+        with open(self.path, mode="rb") as f:
+            original = f.read()
+        os.remove(self.path)
+        self.assertEqual(export_data(self.engine), 1)
+        with open(self.path, mode="rb") as f:
+            self.assertEqual(f.read(), original)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import copy
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cogs.utils.dataIO import DataIO  # noqa: E402
+from cogs.utils.tracked import TrackedDict, TrackedList, track  # noqa: E402
+
+
+class TrackedTest(unittest.TestCase):
+
+    def test_nested_changes_mark_the_top_level_key(self):
+        data = track({"a": {"b": [1, {"c": 2}]}, "d": 1})
+        self.assertFalse(data.dirty)
+        data["a"]["b"][1]["c"] = 3
+        self.assertEqual(data.changes.keys, {"a"})
+        self.assertFalse(data.changes.everything)
+        data.mark_clean()
+        data["a"]["b"].append(4)
+        del data["d"]
+        self.assertEqual(data.changes.keys, {"a", "d"})
+
+    def test_same_value_isnt_a_change(self):
+        data = track({"a": 1, "b": {"c": 1}})
+        data["a"] = 1
+        data["b"] = {"c": 1}
+        self.assertFalse(data.dirty)
+        data.setdefault("a", 2)
+        self.assertFalse(data.dirty)
+
+    def test_top_level_list_changes_everything(self):
+        data = track([{"a": 1}])
+        data[0]["a"] = 2
+        self.assertTrue(data.changes.everything)
+
+    def test_assigned_containers_are_tracked(self):
+        data = track({})
+        nested = {"x": []}
+        data["a"] = nested
+        data.mark_clean()
+        self.assertIsInstance(data["a"], TrackedDict)
+        self.assertIsInstance(data["a"]["x"], TrackedList)
+        nested["x"].append(1)  # Copied, so not seen
+        self.assertFalse(data.dirty)
+        data["a"]["x"].append(1)
+        self.assertEqual(data.changes.keys, {"a"})
+
+    def test_default_factory(self):
+        data = track({}, default_factory=dict)
+        data["a"]["b"] = 1
+        self.assertEqual(data, {"a": {"b": 1}})
+        self.assertEqual(data.changes.keys, {"a"})
+
+    def test_copies_are_plain(self):
+        data = track({"a": [1]})
+        self.assertIs(type(copy.deepcopy(data)), dict)
+        self.assertIs(type(copy.deepcopy(data)["a"]), list)
+        self.assertEqual(json.dumps(data), '{"a": [1]}')
+
+
+class TrackedSaveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "a.json")
+        self.dataio = DataIO()
+        self.dataio.save_json(self.path, {"a": {"b": 1}, "c": 2})
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_unchanged_data_isnt_saved(self):
+        saved = []
+        self.dataio.save_listeners.append(lambda *args: saved.append(args))
+        data = self.dataio.load_tracked(self.path)
+        self.assertTrue(self.dataio.save_json(self.path, data))
+        self.assertEqual(saved, [])
+        self.assertEqual(self.dataio.skipped_saves, 1)
+
+        data["a"]["b"] = 5
+        self.dataio.save_json(self.path, data)
+        self.assertEqual(saved, [(self.path, frozenset(("a",)))])
+        self.assertFalse(data.dirty)
+        self.assertEqual(self.dataio.load_json(self.path),
+                         {"a": {"b": 5}, "c": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
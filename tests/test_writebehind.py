@@ -0,0 +1,85 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cogs.utils.dataIO import DataIO  # noqa: E402
+
+
+class WriteBehindTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "a.json")
+        self.dataio = DataIO()
+        self.dataio.write_behind.delay = 0.05
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def saved(self):
+        return self.dataio.load_json(self.path)
+
+    def test_coalesces_in_the_loop(self):
+        async def change():
+            for n in range(5):
+                self.dataio.mark_dirty(self.path, {"n": n})
+            self.assertEqual(self.dataio.write_behind.pending, 1)
+            self.assertFalse(os.path.exists(self.path))
+            await asyncio.sleep(0.1)
+
+        self.loop.run_until_complete(change())
+        self.dataio.flush()
+        self.assertEqual(self.saved(), {"n": 4})
+        self.assertEqual(self.dataio.write_behind.coalesced, 4)
+
+    def test_saves_right_away_without_a_running_loop(self):
+        self.dataio.mark_dirty(self.path, {"n": 1})
+        self.assertEqual(self.dataio.write_behind.pending, 0)
+        self.assertEqual(self.saved(), {"n": 1})
+
+    def test_marks_from_other_threads_go_through_the_loop(self):
+        async def change():
+            self.dataio.mark_dirty(self.path, {"n": 1})
+            thread = threading.Thread(target=self.dataio.mark_dirty,
+                                      args=(self.path, {"n": 2}))
+            thread.start()
+            thread.join()
+            await asyncio.sleep(0)
+            self.assertEqual(self.dataio.write_behind.pending, 1)
+            self.assertEqual(self.dataio.write_behind.coalesced, 1)
+            await asyncio.sleep(0.1)
+
+        self.loop.run_until_complete(change())
+        self.dataio.flush()
+        self.assertEqual(self.saved(), {"n": 2})
+
+    def test_overflow_is_saved_in_the_background(self):
+        self.dataio.write_behind.max_pending = 3
+
+        async def change():
+            for n in range(3):
+                path = os.path.join(self.folder, "{}.json".format(n))
+                self.dataio.mark_dirty(path, {"n": n})
+            self.assertEqual(self.dataio.write_behind.pending, 0)
+            self.assertEqual(len(self.dataio._writes), 3)
+
+        self.loop.run_until_complete(change())
+        self.dataio.flush()
+        for n in range(3):
+            path = os.path.join(self.folder, "{}.json".format(n))
+            self.assertEqual(self.dataio.load_json(path), {"n": n})
+
+
+if __name__ == "__main__":
+    unittest.main()